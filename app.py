@@ -1,14 +1,37 @@
 import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import heapq
+import inspect
+import json
+import math
+import multiprocessing
 import os
-from collections import deque
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
 from dotenv import load_dotenv
-from typing import Annotated, AsyncGenerator, Dict, Generator, Literal, Optional, Protocol, Tuple
-from dataclasses import field, dataclass
+from typing import Annotated, Any, AsyncGenerator, Awaitable, Callable, Coroutine, Dict, Literal, Optional, Protocol, Sequence, Tuple, TypeVar
+from dataclasses import asdict, field, dataclass
 from typing_extensions import TypeAlias
 
-from mikro_next.api.schema import Image, Stage
+import dask.array as da
+import numpy as np
+from mikro_next.api.schema import (
+    Image,
+    PartialAffineTransformationViewInput,
+    Stage,
+    acreate_stage,
+    afrom_array_like,
+    aget_image,
+    aget_stage,
+)
 from arkitekt_next import easy, register, state, startup, log
 from rekuest_next.declare import declare
+from rekuest_next.state.publish import Patch, Publisher, get_current_publisher, publish_context
 from rekuest_next.structures.model import model
 from rekuest_next.widgets import withDescription
 
@@ -165,6 +188,27 @@ class FrameLike(Protocol):
         ...
 
 
+@declare(app="FRAME Fork Approval")
+class FrameTeachingLike(Protocol):
+    """The FRAME calls used to teach well bounds.
+
+    Kept apart from ``FrameLike`` so the imaging workflows do not require
+    ``getStagePosition``, which only teaching uses.
+    """
+
+    def getStagePosition(self, positionerName: Optional[str]) -> PositionModel:
+        """Get current stage position."""
+        ...
+
+    def saveFirstWellCorner(self, positionerName: Optional[str]) -> PositionModel:
+        """Save current stage XY position as first corner of a well rectangle."""
+        ...
+
+    def saveSecondWellCorner(self, well_id: str, plate_type: Optional[str], positionerName: Optional[str]) -> None:
+        """Save current stage XY position as second corner and commit the well bounds."""
+        ...
+
+
 @declare(app="stainstorm-stitch")
 class StitchLike(Protocol):
     def generate_n_string(self, n: Optional[int], timeout: Optional[int]) -> str:
@@ -247,6 +291,32 @@ class Slide:
         str,
         withDescription("The Opentrons protocol to run for this slide."),
     ]
+    wells: Annotated[
+        list[str],
+        withDescription("The wells to tile-scan on this slide, in scan order."),
+    ] = field(default_factory=lambda: ["A1"])
+    plate_type: Annotated[
+        Optional[str],
+        withDescription("The plate type the wells belong to; unset for the FRAME's default."),
+    ] = None
+    sample_type: Annotated[
+        Optional[str],
+        withDescription("The kind of sample carrier, used to pick the robot's motion profiles."),
+    ] = None
+    deck: Annotated[
+        Optional[int],
+        withDescription(
+            "With several Opentrons, the index of the one the slide sits in; "
+            "unset to spread the slides over them in turn."
+        ),
+    ] = None
+
+
+@model
+class Station:
+    robot: Annotated[int, withDescription("Index of the robot arm.")] = 0
+    opentrons: Annotated[int, withDescription("Index of an Opentrons the arm reaches.")] = 0
+    microscope: Annotated[int, withDescription("Index of a FRAME the arm reaches.")] = 0
 
 
 # --- Local app state --------------------------------------------------------
@@ -262,6 +332,108 @@ class SlideStatus:
     DONE = "done"
 
 
+class SlideOrder:
+    """How a workflow orders the slides competing for the robot, FRAME and Opentrons."""
+
+    LOADED = "loaded"
+    SHORTEST_FIRST = "shortest_first"
+
+
+class Gripper:
+    """The gripper states tracked in ``DeviceState``."""
+
+    OPEN = "open"
+    CLOSED = "closed"
+
+
+class ArmLocation:
+    """Where the robot arm last put down or picked up a slide."""
+
+    OPENTRONS = "opentrons"
+    FRAME = "frame"
+
+
+@model
+class DeviceState:
+    robot_initialized: Annotated[
+        bool, withDescription("Whether the robot and gripper have been initialized.")
+    ] = False
+    gripper: Annotated[
+        Optional[str], withDescription("'open' or 'closed' (see Gripper); unset if unknown.")
+    ] = None
+    arm_location: Annotated[
+        Optional[str],
+        withDescription("'opentrons' or 'frame' (see ArmLocation); unset if unknown."),
+    ] = None
+    stage_homed: Annotated[
+        bool, withDescription("Whether the microscope stage is known to be homed.")
+    ] = False
+
+
+@model
+class CallLatency:
+    count: Annotated[int, withDescription("Number of completed calls.")]
+    errors: Annotated[int, withDescription("Number of calls that raised.")]
+    p50: Annotated[float, withDescription("Median latency in seconds.")]
+    p95: Annotated[float, withDescription("95th-percentile latency in seconds.")]
+    max: Annotated[float, withDescription("Slowest call in seconds.")]
+
+
+@model
+class ComputeInstance:
+    outstanding: Annotated[int, withDescription("Calls currently running on the instance.")] = 0
+    count: Annotated[int, withDescription("Calls the instance completed, successfully or not.")] = 0
+    errors: Annotated[int, withDescription("Calls that raised on the instance.")] = 0
+    latency: Annotated[
+        Optional[float],
+        withDescription("Moving average of the instance's call duration in seconds, if known."),
+    ] = None
+    healthy: Annotated[bool, withDescription("Whether the instance is given new calls.")] = True
+
+
+@model
+class WellFocus:
+    scans: Annotated[int, withDescription("Scans of this well since the stage was homed.")] = 0
+
+
+@model
+class MotionProfile:
+    speed: Annotated[
+        Optional[int], withDescription("Transit speed of the leg; unset for the robot's default.")
+    ] = None
+    acceleration: Annotated[
+        Optional[int], withDescription("Acceleration of the leg; unset for the robot's default.")
+    ] = None
+    danger_speed: Annotated[
+        Optional[int],
+        withDescription("Speed of the final approach to the FRAME or the deck; unset for the default."),
+    ] = None
+
+
+@model
+class WellGeometry:
+    plate_type: Annotated[str, withDescription("The plate type the well belongs to.")]
+    well_id: Annotated[str, withDescription("The well, e.g. 'A1'.")]
+    first_corner: Annotated[
+        list[int], withDescription("Stage x, y, z at the first corner of the well.")
+    ]
+    version: Annotated[
+        int, withDescription("The registry version at which the well was last taught.")
+    ]
+    second_corner: Annotated[
+        Optional[list[int]],
+        withDescription("Stage x, y, z at the opposite corner; unset for wells taught before it was recorded."),
+    ] = None
+
+
+@model
+class ImageRecord:
+    round: Annotated[int, withDescription("The staining round the well was imaged after.")]
+    well: Annotated[str, withDescription("The well, e.g. 'A1'.")]
+    stitched: Annotated[Image, withDescription("The stitched composite of the well.")]
+    segmented: Annotated[Image, withDescription("The segmentation mask of the composite.")]
+
+
 @state
 class AppState:
     currently_imaging_slide: Annotated[
@@ -284,190 +456,2945 @@ class AppState:
         Dict[str, Image],
         withDescription("The latest segmentation mask per slide name."),
     ] = field(default_factory=dict)
+    image_history: Annotated[
+        Dict[str, list[ImageRecord]],
+        withDescription(
+            "The last stitched and segmented images per slide name, oldest first; "
+            "slides are ordered from least to most recently imaged."
+        ),
+    ] = field(default_factory=dict)
+    slide_eta: Annotated[
+        Dict[str, float],
+        withDescription(
+            "Expected completion per slide name, in seconds since the epoch; the actual "
+            "completion once the slide is done. Unset while its durations are unknown."
+        ),
+    ] = field(default_factory=dict)
+    call_latency: Annotated[
+        Dict[str, CallLatency],
+        withDescription("Latency of every remote call, keyed by 'app.method'."),
+    ] = field(default_factory=dict)
+    compute_instances: Annotated[
+        Dict[str, ComputeInstance],
+        withDescription("Load and health of every pooled compute instance, keyed by 'app/index'."),
+    ] = field(default_factory=dict)
+    devices: Annotated[
+        DeviceState,
+        withDescription("What is known about the robot and the microscope stage."),
+    ] = field(default_factory=DeviceState)
+    station_devices: Annotated[
+        Dict[str, DeviceState],
+        withDescription(
+            "In multi-station runs, what is known about each robot ('robot/<index>') "
+            "and each microscope stage ('microscope/<index>')."
+        ),
+    ] = field(default_factory=dict)
+    focus_maps: Annotated[
+        Dict[str, WellFocus],
+        withDescription("The wells scanned since the stage was last homed, by 'slide/well', least recent first."),
+    ] = field(default_factory=dict)
+    motion_profiles: Annotated[
+        Dict[str, MotionProfile],
+        withDescription("Robot motion profile per transfer leg, or per 'leg/sample_type'."),
+    ] = field(default_factory=dict)
+    well_geometry: Annotated[
+        Dict[str, WellGeometry],
+        withDescription("Taught well geometry per 'plate_type/well_id'."),
+    ] = field(default_factory=dict)
+    pending_well_corner: Annotated[
+        Optional[list[int]],
+        withDescription("Stage x, y, z of a first well corner awaiting its second corner."),
+    ] = None
+    cell_counts: Annotated[
+        Dict[str, list[int]],
+        withDescription("Segmented cells per imaging round per slide name, summed over its wells."),
+    ] = field(default_factory=dict)
+    converged_after: Annotated[
+        Dict[str, int],
+        withDescription(
+            "Per slide name, the number of protocol rounds after which its cell count "
+            "plateaued and the remaining rounds were skipped."
+        ),
+    ] = field(default_factory=dict)
 
 
 @startup
 def startup_hook() -> AppState:
-    """Initialize the app state when the agent boots."""
-    return AppState()
+    """Initialize the app state when the agent boots, with the taught well geometry."""
+    return AppState(well_geometry=well_registry.wells())
 
 
 # --- Helpers ----------------------------------------------------------------
 
 
-def _run_protocol(
+T = TypeVar("T")
+
+
+# The executor blocking calls made in this context run on; the loop's default if unset.
+_call_executor: contextvars.ContextVar[Optional[concurrent.futures.Executor]] = (
+    contextvars.ContextVar("call_executor", default=None)
+)
+
+
+async def _acall(method: Callable[..., T | Awaitable[T]], *args: Any, **kwargs: Any) -> T:
+    """Call a declared remote method without blocking the event loop.
+
+    The declared apps expose plain ``def`` methods, which block until the remote
+    assignation returns; those are pushed onto a worker thread (of the executor
+    set in ``_call_executor``, if any). ``async def`` implementations are awaited
+    directly.
+    """
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+    executor = _call_executor.get()
+    if executor is None:
+        return await asyncio.to_thread(method, *args, **kwargs)  # type: ignore[arg-type]
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, method, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)  # type: ignore[arg-type]
+
+
+def _ref(obj: Any) -> Any:
+    """The server-side id of a mikro object, or the object itself if it has none."""
+    return getattr(obj, "id", obj)
+
+
+def _as_list(value: Any) -> list[Any]:
+    """``value`` itself if it is a list of devices, else a list of just it."""
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+async def _run_protocol(
     opentrons: OT2Like, protocol: Literal["washing", "staining"]
 ) -> None:
     """Dispatch to the correct Opentrons protocol function."""
     if protocol == "washing":
-        opentrons.run_washing_protocol()
+        await _acall(opentrons.run_washing_protocol)
     elif protocol == 'staining':
-        opentrons.run_staining_protocol()
+        await _acall(opentrons.run_staining_protocol)
     else:
-        opentrons.run_dummy_protocol()
+        await _acall(opentrons.run_dummy_protocol)
+
+
+_TASK_DONE = object()
+
+
+class _Pipeline:
+    """Fan-in of results emitted by concurrently running coroutines.
+
+    Workers are started with :meth:`spawn` and hand their results to
+    :meth:`emit`; :meth:`stream` yields them in completion order until every
+    worker has finished. The first worker to fail cancels the others and its
+    exception is re-raised from :meth:`stream`.
+    """
+
+    def __init__(self) -> None:
+        self._results: asyncio.Queue[Any] = asyncio.Queue()
+        self._tasks: set[asyncio.Task[Any]] = set()
+
+    def spawn(self, coro: Coroutine[Any, Any, T]) -> "asyncio.Task[T]":
+        """Start ``coro`` as a worker task of this pipeline."""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(lambda _: self._results.put_nowait(_TASK_DONE))
+        return task
+
+    def emit(self, item: Any) -> None:
+        """Hand a result to the consumer of :meth:`stream`."""
+        self._results.put_nowait(item)
+
+    async def stream(self) -> AsyncGenerator[Any, None]:
+        """Yield emitted results until all workers are done."""
+        try:
+            while self._tasks:
+                item = await self._results.get()
+                if item is not _TASK_DONE:
+                    yield item
+                    continue
+                for task in [t for t in self._tasks if t.done()]:
+                    self._tasks.discard(task)
+                    task.result()  # re-raise the worker's exception, if any
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+
+# --- State publishing -------------------------------------------------------
+
+
+DEFAULT_STATE_PUBLISH_INTERVAL = 1.0
+
+
+def _parent(path: str) -> str:
+    return path.rsplit("/", 1)[0]
+
+
+def _shifts_siblings(patch: Patch) -> bool:
+    """Whether ``patch`` inserts into or removes from a list, moving the items after it."""
+    last = patch.path.rsplit("/", 1)[-1]
+    return patch.op in ("add", "remove") and (last == "-" or last.isdigit())
+
+
+def _depends_on(later: Patch, earlier: Patch) -> bool:
+    """Whether ``later`` must stay after ``earlier`` on a different path."""
+    return (
+        later.path.startswith(earlier.path + "/")
+        or earlier.path.startswith(later.path + "/")
+        or (_shifts_siblings(earlier) and later.path.startswith(_parent(earlier.path) + "/"))
+    )
+
+
+class CoalescingPublisher:
+    """Forwards state patches to ``inner`` at most once every ``interval`` seconds.
+
+    Patches are held back for ``interval`` seconds after the first one arrives. A
+    ``replace`` of a path that already has a held patch is folded into it, so a
+    value that changes many times within the interval is sent once, with its
+    latest value. Everything else is sent in order. While the publisher is
+    entered, it is the current one, and tasks started then publish through it;
+    ``flush`` sends whatever is held.
+    """
+
+    def __init__(self, inner: Optional[Publisher], interval: float) -> None:
+        self.inner = inner
+        self.interval = interval
+        self.received = 0
+        self.sent = 0
+        self._held: list[tuple[str, Patch]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._token: Any = None
+
+    def publish_patch(self, interface: str, patch: Patch) -> None:
+        self.received += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if self.interval <= 0 or loop is None:
+            self.flush()
+            self._send(interface, patch)
+            return
+        self._hold(interface, patch)
+        if self._timer is None:
+            self._timer = loop.call_later(self.interval, self.flush)
+
+    def _hold(self, interface: str, patch: Patch) -> None:
+        for i in range(len(self._held) - 1, -1, -1):
+            held_interface, held = self._held[i]
+            if held_interface != interface:
+                continue
+            if held.path == patch.path:
+                if patch.op == "replace" and held.op in ("add", "replace"):
+                    self._held[i] = (
+                        interface,
+                        Patch(
+                            op=held.op,
+                            path=held.path,
+                            value=patch.value,
+                            old_value=held.old_value,
+                            port=patch.port,
+                            correlation_id=patch.correlation_id,
+                        ),
+                    )
+                    return
+                break
+            if _depends_on(patch, held):
+                break
+        self._held.append((interface, patch))
+
+    def flush(self) -> None:
+        """Send every held patch now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        held, self._held = self._held, []
+        for interface, patch in held:
+            self._send(interface, patch)
+
+    def _send(self, interface: str, patch: Patch) -> None:
+        if self.inner is not None:
+            self.sent += 1
+            self.inner.publish_patch(interface, patch)
+
+    def __enter__(self) -> "CoalescingPublisher":
+        self._token = publish_context.set(self)  # type: ignore[arg-type]
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        publish_context.reset(self._token)
+
+
+# --- Remote call instrumentation -------------------------------------------
+
+
+def _declared_app(protocol: type) -> str:
+    """The app identifier a declared ``Protocol`` was registered with."""
+    dependency = getattr(protocol, "__rekuest__dependency__", None)
+    return getattr(dependency, "app", None) or protocol.__name__
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+@dataclass
+class _CallTotals:
+    count: int = 0
+    errors: int = 0
+    slowest: float = 0.0
+
+
+class LatencyRecorder:
+    """Times calls to declared remote apps and publishes them into ``AppState``.
+
+    Counts, errors and the maximum cover the lifetime of the agent; the
+    percentiles are taken over the last ``window`` calls of each method, so they
+    follow the fleet as it warms up or degrades. Successful calls also teach the
+    :class:`DurationModel`.
+    """
+
+    def __init__(self, window: int = 500) -> None:
+        self.window = window
+        self._samples: dict[str, deque[float]] = {}
+        self._totals: dict[str, _CallTotals] = {}
+
+    def record(self, state: AppState, key: str, seconds: float, failed: bool = False) -> None:
+        """Add one call of ``key`` and refresh its entry in ``state.call_latency``."""
+        samples = self._samples.setdefault(key, deque(maxlen=self.window))
+        totals = self._totals.setdefault(key, _CallTotals())
+        samples.append(seconds)
+        totals.count += 1
+        totals.errors += failed
+        totals.slowest = max(totals.slowest, seconds)
+        if not failed:
+            duration_model.observe(key, seconds)
+        ordered = sorted(samples)
+        state.call_latency[key] = CallLatency(
+            count=totals.count,
+            errors=totals.errors,
+            p50=_percentile(ordered, 0.5),
+            p95=_percentile(ordered, 0.95),
+            max=totals.slowest,
+        )
+
+    def instrument(self, device: T, protocol: type, state: AppState) -> T:
+        """Wrap ``device`` so every method call on it is timed as ``app.method``."""
+        return _TimedDevice(device, _declared_app(protocol), self, state)  # type: ignore[return-value]
+
+
+class _TimedDevice:
+    """Proxy around a declared dependency that reports each call to a recorder."""
+
+    def __init__(self, device: Any, app: str, recorder: LatencyRecorder, state: AppState) -> None:
+        self._device = device
+        self._app = app
+        self._recorder = recorder
+        self._state = state
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._device, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        key = f"{self._app}.{name}"
+
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            try:
+                result = await _acall(attr, *args, **kwargs)
+            except Exception:
+                self._recorder.record(self._state, key, loop.time() - start, failed=True)
+                raise
+            self._recorder.record(self._state, key, loop.time() - start)
+            return result
+
+        timed.__name__ = name
+        return timed
+
+
+latency_recorder = LatencyRecorder()
+
+
+# --- Timeouts, retries and hedging -----------------------------------------
+
+
+@dataclass
+class CallPolicy:
+    """How calls to one remote method are dispatched.
+
+    Each attempt is given up after ``timeout`` seconds and a failed attempt is
+    retried up to ``retries`` times, waiting ``backoff`` seconds before the first
+    retry and twice as long before each further one. With ``hedge`` (for
+    idempotent calls only), an attempt that runs past the method's p95 latency
+    gets a duplicate, and whichever finishes first wins; this needs at least
+    ``hedge_after`` recorded calls, and a :class:`ComputePool` with another
+    healthy instance to run the duplicate on.
+    """
+
+    timeout: Optional[float] = None
+    retries: int = 0
+    backoff: float = 5.0
+    hedge: bool = False
+    hedge_after: int = 20
+
+
+# Keyed by 'app.method'; methods without an entry are called once, without a timeout.
+CALL_POLICIES: Dict[str, CallPolicy] = {
+    "cellpose-ARK.run_cellpose_SAM": CallPolicy(timeout=1800.0, retries=2, hedge=True),
+    "stainstorm-stitch.stitch_stage": CallPolicy(timeout=1800.0, retries=2, hedge=True),
+}
+
+
+def with_call_policies(device: T, protocol: type, state: AppState) -> T:
+    """Wrap ``device`` so calls with an entry in ``CALL_POLICIES`` follow it."""
+    return _PolicyDevice(device, _declared_app(protocol), state)  # type: ignore[return-value]
+
+
+class _PolicyDevice:
+    """Proxy around a declared dependency that applies ``CALL_POLICIES``."""
+
+    def __init__(self, device: Any, app: str, state: AppState) -> None:
+        self._device = device
+        self._app = app
+        self._state = state
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._device, name)
+        key = f"{self._app}.{name}"
+        policy = CALL_POLICIES.get(key)
+        if policy is None or name.startswith("_") or not callable(attr):
+            return attr
+
+        async def dispatched(*args: Any, **kwargs: Any) -> Any:
+            for attempt in range(policy.retries + 1):
+                try:
+                    return await self._attempt(name, attr, key, policy, args, kwargs)
+                except Exception as e:
+                    if attempt == policy.retries:
+                        raise
+                    delay = policy.backoff * 2**attempt
+                    log(f"{key} failed ({e!r}); retrying in {delay:.0f} s.")
+                    await asyncio.sleep(delay)
+
+        dispatched.__name__ = name
+        return dispatched
+
+    async def _attempt(
+        self,
+        name: str,
+        method: Callable[..., Any],
+        key: str,
+        policy: CallPolicy,
+        args: tuple,
+        kwargs: dict,
+    ) -> Any:
+        # Only a pool can run a duplicate elsewhere; on the instance already running
+        # the call it would just double that instance's load.
+        pool = self._device if isinstance(self._device, ComputePool) else None
+        busy: set[str] = set()
+
+        def launch() -> "asyncio.Task[Any]":
+            call = pool.avoiding(name, busy) if pool is not None else method
+            return asyncio.ensure_future(asyncio.wait_for(_acall(call, *args, **kwargs), policy.timeout))
+
+        attempts = {launch()}
+        try:
+            latency = self._state.call_latency.get(key)
+            if (
+                policy.hedge
+                and pool is not None
+                and latency is not None
+                and latency.count >= policy.hedge_after
+            ):
+                done, _ = await asyncio.wait(attempts, timeout=latency.p95)
+                if not done and pool.has_spare(busy):
+                    log(f"{key} is slower than its p95 of {latency.p95:.1f} s; hedging.")
+                    attempts.add(launch())
+            failure: Optional[BaseException] = None
+            for finished in asyncio.as_completed(attempts):
+                try:
+                    return await finished
+                except Exception as e:
+                    failure = e
+            raise failure  # type: ignore[misc]
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+
+# --- Compute pools ----------------------------------------------------------
+
+
+# Worker threads for blocking compute calls. An attempt given up on by a timeout or
+# a hedge keeps its thread until the remote call returns, so this bounds how many
+# such calls can pile up.
+DEFAULT_COMPUTE_THREADS = 16
+
+_compute_threads: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _compute_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _compute_threads
+    if _compute_threads is None:
+        _compute_threads = concurrent.futures.ThreadPoolExecutor(
+            DEFAULT_COMPUTE_THREADS, thread_name_prefix="compute"
+        )
+    return _compute_threads
+
+
+@dataclass
+class _PoolMember:
+    key: str
+    device: Any
+    outstanding: int = 0
+    count: int = 0
+    errors: int = 0
+    latency: Optional[float] = None
+    failures_in_row: int = 0
+    resting_until: float = -math.inf
+
+
+class ComputePool:
+    """Spreads the calls to a declared compute app over several of its instances.
+
+    Each call goes to the healthy instance with the fewest calls outstanding, and
+    on a tie to the one with the lowest moving average of its call durations. An
+    instance that fails ``unhealthy_after`` calls in a row is left out for
+    ``cooldown`` seconds and then tried again; while every instance is left out,
+    calls still go to the least loaded one. Each instance is published as
+    ``state.compute_instances['app/index']``.
+
+    Only Python callers can hand a pool several instances: the registered workflows
+    declare one required dependency per app, which resolves to a single instance.
+    """
+
+    def __init__(
+        self,
+        instances: Sequence[Any],
+        protocol: type,
+        state: AppState,
+        unhealthy_after: int = 3,
+        cooldown: float = 60.0,
+        smoothing: float = 0.2,
+    ) -> None:
+        if not instances:
+            raise ValueError(f"A pool of {protocol.__name__} needs at least one instance.")
+        app = _declared_app(protocol)
+        self._members = [
+            _PoolMember(f"{app}/{i}", instance) for i, instance in enumerate(instances)
+        ]
+        self._state = state
+        self._unhealthy_after = unhealthy_after
+        self._cooldown = cooldown
+        self._smoothing = smoothing
+        for member in self._members:
+            self._publish(member, now=-math.inf)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attr = getattr(self._members[0].device, name)
+        if not callable(attr):
+            return attr
+
+        async def dispatched(*args: Any, **kwargs: Any) -> Any:
+            return await self._call(name, args, kwargs)
+
+        dispatched.__name__ = name
+        return dispatched
+
+    def avoiding(self, name: str, busy: set[str]) -> Callable[..., Awaitable[Any]]:
+        """Method ``name`` called on an instance not in ``busy``, which it is then added to."""
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await self._call(name, args, kwargs, busy)
+
+        return call
+
+    def has_spare(self, busy: set[str]) -> bool:
+        """Whether a healthy instance is left that is not in ``busy``."""
+        now = asyncio.get_running_loop().time()
+        return any(m.resting_until <= now and m.key not in busy for m in self._members)
+
+    def _pick(self, now: float, busy: set[str]) -> _PoolMember:
+        free = [m for m in self._members if m.key not in busy] or self._members
+        healthy = [m for m in free if m.resting_until <= now] or free
+        return min(healthy, key=lambda m: (m.outstanding, m.latency or 0.0))
+
+    async def _call(
+        self, name: str, args: tuple, kwargs: dict, busy: Optional[set[str]] = None
+    ) -> Any:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        member = self._pick(start, busy or set())
+        if busy is not None:
+            busy.add(member.key)
+        member.outstanding += 1
+        self._publish(member, start)
+        # Blocking compute calls get their own threads, so stuck ones cannot starve
+        # the robot and FRAME calls on the loop's default executor.
+        token = _call_executor.set(_compute_executor())
+        try:
+            result = await _acall(getattr(member.device, name), *args, **kwargs)
+        except asyncio.CancelledError:
+            # Timed out or lost a hedge: at least this slow, but not a failure.
+            member.latency = max(member.latency or 0.0, loop.time() - start)
+            raise
+        except Exception:
+            member.count += 1
+            member.errors += 1
+            member.failures_in_row += 1
+            if member.failures_in_row >= self._unhealthy_after:
+                member.resting_until = loop.time() + self._cooldown
+                log(
+                    f"{member.key} failed {member.failures_in_row} calls in a row; "
+                    f"leaving it out for {self._cooldown:.0f} s."
+                )
+            raise
+        else:
+            seconds = loop.time() - start
+            member.count += 1
+            member.failures_in_row = 0
+            member.latency = (
+                seconds
+                if member.latency is None
+                else member.latency + self._smoothing * (seconds - member.latency)
+            )
+            return result
+        finally:
+            _call_executor.reset(token)
+            member.outstanding -= 1
+            self._publish(member, loop.time())
+
+    def _publish(self, member: _PoolMember, now: float) -> None:
+        self._state.compute_instances[member.key] = ComputeInstance(
+            outstanding=member.outstanding,
+            count=member.count,
+            errors=member.errors,
+            latency=member.latency,
+            healthy=member.resting_until <= now,
+        )
+
+
+def compute_pool(instances: Any, protocol: type, state: AppState) -> Any:
+    """A :class:`ComputePool` over ``instances`` -- one instance or a list of them.
+
+    Every call is also timed into ``state.call_latency`` under the app's name.
+    """
+    return ComputePool(
+        [
+            latency_recorder.instrument(instance, protocol, state)
+            for instance in _as_list(instances)
+        ],
+        protocol,
+        state,
+    )
+
+
+# --- Local state files ------------------------------------------------------
+
+
+# What the agent learns between runs (call cache, durations, taught wells) is kept
+# here unless a file's own environment variable points elsewhere.
+STATE_DIR = os.getenv("STAINSTORM_STATE_DIR", os.path.join(os.path.expanduser("~"), ".stainstorm"))
+
+
+def state_file(env: str, name: str) -> str:
+    """The path in the environment variable ``env``, or ``name`` in :data:`STATE_DIR`."""
+    return os.getenv(env) or os.path.join(STATE_DIR, name)
+
+
+def write_json(path: str, data: Any, indent: Optional[int] = None) -> None:
+    """Atomically replace ``path`` with ``data`` as JSON, creating its directory if needed.
+
+    Each write goes through its own temporary file, so concurrent writers never
+    share a half-written one; the last to finish wins.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".partial", delete=False
+    ) as f:
+        try:
+            json.dump(data, f, indent=indent)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    os.replace(f.name, path)
+
+
+def read_json(path: Optional[str], parse: Callable[[Any], T], default: T) -> T:
+    """``parse`` applied to the JSON in ``path``, or ``default`` if there is none.
+
+    A file that cannot be read or parsed is logged and treated as missing, so a
+    corrupt state file costs what was learned rather than the agent's start.
+    """
+    if path is None or not os.path.exists(path):
+        return default
+    try:
+        with open(path) as f:
+            return parse(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log(f"Ignoring unreadable state file {path} ({e!r}); starting empty.")
+        return default
+
+
+# --- Call memoization -------------------------------------------------------
+
+
+# Keyed by 'app.method': calls whose result only depends on their inputs and
+# parameters, with the kind of mikro object they return.
+MEMOIZED_CALLS: Dict[str, Literal["stage", "image"]] = {
+    "correct_coordinate_system.invert_x_axis": "stage",
+    "correct_coordinate_system.invert_y_axis": "stage",
+    "correct_coordinate_system.invert_xy_axes": "stage",
+    "stainstorm-stitch.stitch_stage": "image",
+    "cellpose-ARK.run_cellpose_SAM": "image",
+}
+
+DEFAULT_CALL_CACHE_ENTRIES = 10_000
+DEFAULT_CALL_CACHE_AGE = 30 * 24 * 3600.0
+
+
+class CallCache:
+    """The ids returned by memoized calls, keyed by the call, its input ids and parameters.
+
+    Entries are kept from least to most recently used. Past ``max_entries`` the
+    least recently used ones are dropped, and entries older than ``max_age``
+    seconds are not used again. With a ``path``, the cache is loaded from that JSON
+    file, and changes are written back atomically from a worker thread: on an
+    event loop, a write is started after a change and every change made while it
+    runs is written by one more, so the loop never waits on the file. Expired
+    entries are only dropped from the file along with the next change.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_entries: int = DEFAULT_CALL_CACHE_ENTRIES,
+        max_age: float = DEFAULT_CALL_CACHE_AGE,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: Dict[str, Dict[str, Any]] = read_json(
+            path, lambda data: dict(data["entries"]), {}
+        )
+        # Entries are also changed from worker threads (e.g. clear_call_cache).
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saving: Optional[asyncio.Task[None]] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(call: str, args: tuple, kwargs: Dict[str, Any]) -> tuple[str, list[str]]:
+        """The cache key of a call and the ids of its inputs.
+
+        Raises :class:`TypeError` if an argument has no id and is no plain value.
+        """
+        inputs: list[str] = []
+
+        def identify(value: Any) -> Any:
+            if getattr(value, "id", None) is None:
+                raise TypeError(f"{type(value).__name__} has no id to key a cached call by.")
+            inputs.append(str(value.id))
+            return {"id": value.id}
+
+        encoded = json.dumps([call, args, kwargs], sort_keys=True, default=identify)
+        return hashlib.sha256(encoded.encode()).hexdigest(), inputs
+
+    def get(self, key: str) -> Optional[Any]:
+        """The result ids stored under ``key``, unless missing or too old."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if time.time() - entry["stored"] > self.max_age:
+                return None
+            self._entries[key] = entry  # now the most recently used
+            return entry["result"]
+
+    def put(self, key: str, call: str, inputs: list[str], result: Any) -> None:
+        """Store the result ids of a call under ``key``."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "call": call,
+                "inputs": inputs,
+                "result": result,
+                "stored": time.time(),
+            }
+            while len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._changed()
+
+    def invalidate(
+        self,
+        call: Optional[str] = None,
+        input_id: Optional[str] = None,
+        key: Optional[str] = None,
+    ) -> int:
+        """Drop the entries of ``call``, taking ``input_id``, or under ``key``; all by default.
+
+        Returns how many entries were dropped.
+        """
+        with self._lock:
+            dropped = [
+                k
+                for k, entry in self._entries.items()
+                if (call is None or entry["call"] == call)
+                and (input_id is None or input_id in entry["inputs"])
+                and (key is None or k == key)
+            ]
+            for k in dropped:
+                del self._entries[k]
+        if dropped:
+            self._changed()
+        return len(dropped)
+
+    async def flush(self) -> None:
+        """Wait until every change so far has been written to ``path``."""
+        if self._saving is not None:
+            await asyncio.shield(self._saving)
+
+    def _changed(self) -> None:
+        if self.path is None:
+            return
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not on an event loop (e.g. a synchronous function's worker thread).
+            self._dirty = False
+            write_json(self.path, {"entries": self._snapshot()})
+            return
+        if self._saving is None:
+            self._saving = loop.create_task(self._save())
+
+    async def _save(self) -> None:
+        try:
+            while self._dirty:
+                self._dirty = False
+                entries = self._snapshot()  # taken on the loop, written off it
+                await asyncio.to_thread(write_json, self.path, {"entries": entries})
+        finally:
+            self._saving = None
+
+    def _snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return dict(self._entries)
+
+
+call_cache = CallCache(state_file("STAINSTORM_CALL_CACHE", "call_cache.json"))
+
+
+def memoized(device: T, protocol: type) -> T:
+    """Wrap ``device`` so calls listed in ``MEMOIZED_CALLS`` are answered from ``call_cache``."""
+    return _MemoizedDevice(device, _declared_app(protocol))  # type: ignore[return-value]
+
+
+def _result_ids(result: Any) -> Optional[Any]:
+    # Only results mikro can hand out again by id are cached.
+    items = list(result) if isinstance(result, tuple) else [result]
+    ids = [getattr(item, "id", None) for item in items]
+    if any(not isinstance(i, str) for i in ids):
+        return None
+    return ids if isinstance(result, tuple) else ids[0]
+
+
+async def _load_result(kind: str, ids: Any) -> Any:
+    load = aget_stage if kind == "stage" else aget_image
+    if isinstance(ids, list):
+        return tuple(await asyncio.gather(*(load(i) for i in ids)))
+    return await load(ids)
+
+
+async def _memoize(
+    call: str, compute: Callable[..., Awaitable[T]], *args: Any, **kwargs: Any
+) -> T:
+    """``compute(*args, **kwargs)``, or what the memoized ``call`` with them returned before."""
+    cache = call_cache
+    try:
+        key, inputs = cache.key(call, args, kwargs)
+    except TypeError:
+        return await compute(*args, **kwargs)
+    ids = cache.get(key)
+    if ids is not None:
+        try:
+            return await _load_result(MEMOIZED_CALLS[call], ids)
+        except Exception as e:
+            log(f"Cached result of {call} could not be loaded ({e!r}); calling it again.")
+            cache.invalidate(key=key)
+    result = await compute(*args, **kwargs)
+    ids = _result_ids(result)
+    if ids is not None:
+        cache.put(key, call, inputs, ids)
+    return result
+
+
+class _MemoizedDevice:
+    """Proxy around a declared dependency that memoizes its deterministic calls."""
+
+    def __init__(self, device: Any, app: str) -> None:
+        self._device = device
+        self._app = app
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._device, name)
+        call = f"{self._app}.{name}"
+        if call not in MEMOIZED_CALLS or name.startswith("_") or not callable(attr):
+            return attr
+
+        async def cached(*args: Any, **kwargs: Any) -> Any:
+            return await _memoize(call, functools.partial(_acall, attr), *args, **kwargs)
+
+        cached.__name__ = name
+        return cached
+
+
+# --- Local coordinate correction -------------------------------------------
+
+
+# The diagonal each ``correct_coordinate_system`` inversion pre-multiplies with.
+AXIS_MIRRORS: Dict[str, np.ndarray] = {
+    "x": np.array([-1.0, 1.0, 1.0, 1.0]),
+    "y": np.array([1.0, -1.0, 1.0, 1.0]),
+    "xy": np.array([-1.0, -1.0, 1.0, 1.0]),
+}
+
+_REMOTE_INVERSIONS = {"x": "invert_x_axis", "y": "invert_y_axis", "xy": "invert_xy_axes"}
+
+
+def mirror_affine_matrices(matrices: Any, axes: str = "x") -> np.ndarray:
+    """Pre-multiply a batch of 4x4 affine matrices by ``diag(AXIS_MIRRORS[axes])``.
+
+    Pre-multiplying by a diagonal matrix scales its rows, so the whole batch is a
+    single broadcast multiply over an ``(n, 4, 4)`` stack.
+    """
+    stack = np.asarray(matrices, dtype=float).reshape(-1, 4, 4)
+    return stack * AXIS_MIRRORS[axes][:, None]
+
+
+async def invert_stage_axes(
+    stage: Stage,
+    axes: str,
+    corrector: CorrectCoordinateSystemDevLike,
+    state: Optional[AppState] = None,
+) -> Stage:
+    """Mirror every affine view of ``stage`` along ``axes`` onto a new stage.
+
+    The matrices of all views are mirrored in one batch in-process and the tiles
+    are registered on a new stage straight through mikro, instead of a round-trip
+    to the ``correct_coordinate_system`` app. That app is only used if the local
+    path fails. Either way the result is memoized as the corrector's own call,
+    and with ``state`` a local inversion is timed under that call's name too.
+    """
+    call = f"{_declared_app(CorrectCoordinateSystemDevLike)}.{_REMOTE_INVERSIONS[axes]}"
+
+    async def invert(stage: Stage) -> Stage:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            inverted = await _invert_stage_locally(stage, axes)
+        except Exception as e:
+            log(f"Local {axes}-axis inversion failed ({e!r}); using the remote corrector.")
+            return await _acall(getattr(corrector, _REMOTE_INVERSIONS[axes]), stage)
+        if state is not None:
+            latency_recorder.record(state, call, loop.time() - start)
+        return inverted
+
+    return await _memoize(call, invert, stage)
+
+
+async def _invert_stage_locally(stage: Stage, axes: str) -> Stage:
+    views = stage.affine_views
+    mirrored = mirror_affine_matrices([view.affine_matrix for view in views], axes)
+    # Every tile is read before the new stage exists, so a missing or unreadable
+    # tile falls back to the remote corrector without leaving an empty stage behind.
+    images = await asyncio.gather(*(aget_image(view.image.id) for view in views))
+    inverted = await acreate_stage(name=f"{stage.name} ({axes} inverted)")
+
+    async def reattach(image: Image, matrix: np.ndarray) -> None:
+        await afrom_array_like(
+            image.data,
+            name=image.name,
+            transformation_views=[
+                PartialAffineTransformationViewInput(
+                    stage=inverted.id, affine_matrix=matrix.tolist()
+                )
+            ],
+        )
+
+    try:
+        await asyncio.gather(*(reattach(image, matrix) for image, matrix in zip(images, mirrored)))
+    except Exception:
+        log(f"Stage {inverted.id} was left partially filled by a failed local inversion.")
+        raise
+    return await aget_stage(inverted.id)
+
+
+# --- Stitching cache --------------------------------------------------------
+
+
+# Registration settings for re-stitching a grid that has been stitched before:
+# only search a few pixels around the seams the tile layout implies, and skip
+# ORB refinement. Nothing from the earlier solve is reused.
+WARM_STITCH_SETTINGS: Dict[str, Any] = {
+    "ncc_seam_tol_px": 8,
+    "ncc_ortho_px": 4,
+    "do_landmark_refine": False,
+}
+
+
+def grid_signature(stage: Stage) -> Optional[tuple]:
+    """The tile layout of ``stage`` (pixel scale and tile origins), or ``None`` without tiles."""
+    views = getattr(stage, "affine_views", None)
+    if not views:
+        return None
+    matrices = np.asarray([view.affine_matrix for view in views], dtype=float)
+    scale = tuple(np.round(matrices[0, :2, :2], 6).ravel().tolist())
+    origins = tuple(sorted(map(tuple, np.round(matrices[:, :2, 3], 1).tolist())))
+    return scale, origins
+
+
+class StitchCache:
+    """Remembers the tile grid each (slide, well) was last stitched with.
+
+    Rounds of the same slide rescan the same grid, so once a grid has been
+    stitched, stitching it again uses a narrow registration search
+    (``WARM_STITCH_SETTINGS``). The cache holds no solved offsets or shading:
+    ``stitch_stage`` cannot take them, so the search is centred on the step the
+    tile layout assumes. A stage that lands tiles further off than that search
+    is mis-registered, which is why workflows only use it when asked to.
+    """
+
+    def __init__(self) -> None:
+        self._grids: dict[tuple[str, str], tuple] = {}
+        self.hits = 0
+
+    def settings(self, slide: str, well: str, stage: Stage) -> Dict[str, Any]:
+        """Extra ``stitch_stage`` arguments for ``stage``; empty for an unknown grid."""
+        signature = grid_signature(stage)
+        if signature is None or self._grids.get((slide, well)) != signature:
+            return {}
+        self.hits += 1
+        return dict(WARM_STITCH_SETTINGS)
+
+    def stitched(self, slide: str, well: str, stage: Stage) -> None:
+        """Record that the grid of ``stage`` has been stitched for ``slide``/``well``."""
+        signature = grid_signature(stage)
+        if signature is not None:
+            self._grids[(slide, well)] = signature
+
+
+# --- Segmentation batching -------------------------------------------------
+
+
+# Requests are only held if a window is asked for; the segmenter has no batch
+# call, so holding them buys nothing but deduplication.
+DEFAULT_SEGMENTATION_WINDOW = 0.0
+
+
+class SegmentationBatcher:
+    """Coalesces ``run_cellpose_SAM`` requests that arrive close together.
+
+    A batch stays open while requests keep arriving less than ``window`` seconds
+    apart, and closes once it holds ``max_batch`` requests or its oldest request
+    has waited ``max_delay`` seconds, so a lone request is never held longer than
+    ``window``. With the default window of zero, a batch holds the requests made
+    in the same event-loop step. A closed batch is submitted as concurrent calls,
+    one per distinct request: identical requests (same image and parameters) share
+    a single call, but distinct ones are not batched on the segmenter's GPU. Each
+    caller gets back its own result or exception.
+    """
+
+    def __init__(
+        self,
+        segmenter: SegmenterLike,
+        window: float = DEFAULT_SEGMENTATION_WINDOW,
+        max_batch: int = 8,
+        max_delay: float = 2.0,
+    ) -> None:
+        self.segmenter = segmenter
+        self.window = window
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: list[tuple[Any, dict[str, Any], asyncio.Future[Any]]] = []
+        self._arrived = asyncio.Event()
+        self._closer: Optional[asyncio.Task[None]] = None
+        self._submissions: set[asyncio.Task[None]] = set()
+
+    async def segment(self, image: Any, **kwargs: Any) -> Tuple[Any, Any, Any]:
+        """Queue ``image`` for the next batch and wait for its segmentation."""
+        future: asyncio.Future[Any] = asyncio.get_running_loop().create_future()
+        self._pending.append((image, kwargs, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._closer is None:
+            self._closer = asyncio.ensure_future(self._close_when_quiet())
+        else:
+            self._arrived.set()
+        return await future
+
+    def close(self) -> None:
+        """Cancel the open batch and every submission still in flight."""
+        if self._closer is not None:
+            self._closer.cancel()
+            self._closer = None
+        for task in self._submissions:
+            task.cancel()
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending = []
+
+    async def _close_when_quiet(self) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while (timeout := min(self.window, deadline - loop.time())) > 0:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        self._closer = None
+        self._flush()
+
+    def _flush(self) -> None:
+        if self._closer is not None:
+            self._closer.cancel()
+            self._closer = None
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._submit(batch))
+        self._submissions.add(task)
+        task.add_done_callback(self._submissions.discard)
+
+    async def _submit(self, batch: list[tuple[Any, dict[str, Any], asyncio.Future[Any]]]) -> None:
+        requests: dict[Any, tuple[Any, dict[str, Any]]] = {}
+        waiters: dict[Any, list[asyncio.Future[Any]]] = defaultdict(list)
+        for image, kwargs, future in batch:
+            key = (_ref(image), tuple(sorted(kwargs.items())))
+            requests.setdefault(key, (image, kwargs))
+            waiters[key].append(future)
+        try:
+            results = await asyncio.gather(
+                *(
+                    _acall(self.segmenter.run_cellpose_SAM, image, **kwargs)
+                    for image, kwargs in requests.values()
+                ),
+                return_exceptions=True,
+            )
+        except asyncio.CancelledError:
+            for _, _, future in batch:
+                future.cancel()
+            raise
+        for key, result in zip(requests, results):
+            for future in waiters[key]:
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+# --- Convergence ------------------------------------------------------------
+
+
+def count_cells(mask: Image) -> int:
+    """Number of labelled cells in a Cellpose mask (label 0 is background).
+
+    The mask is read one chunk at a time and only a per-label pixel count is
+    kept, so a mosaic never has to fit in memory.
+    """
+    labels = da.asarray(mask.data.data)
+    areas = np.zeros(1)
+    for index in np.ndindex(*labels.numblocks):
+        chunk = np.asarray(labels.blocks[index].compute()).ravel().astype(np.intp, copy=False)
+        areas = _add_sums(areas, np.bincount(chunk))
+    return int(np.count_nonzero(areas[1:]))
+
+
+def has_plateaued(counts: list[int], tolerance: float) -> bool:
+    """Whether the last two rounds' cell counts differ by at most ``tolerance`` (relative)."""
+    if len(counts) < 2:
+        return False
+    previous, latest = counts[-2], counts[-1]
+    return abs(latest - previous) <= tolerance * max(previous, 1)
+
+
+# --- Stain quantification ---------------------------------------------------
+
+
+DEFAULT_STAIN_CONTRAST = 2.0
+
+
+@dataclass
+class StainQuantification:
+    cells: int
+    stained_cells: int
+
+    @property
+    def stained_fraction(self) -> float:
+        return self.stained_cells / self.cells if self.cells else 0.0
+
+
+_quantify_executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+
+def _quantify_pool() -> concurrent.futures.ProcessPoolExecutor:
+    # The agent runs threads (compute calls, file writes), which a forked worker
+    # would inherit mid-flight; start the workers from a clean process instead.
+    global _quantify_executor
+    if _quantify_executor is None:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _quantify_executor = concurrent.futures.ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context(method)
+        )
+    return _quantify_executor
+
+
+def _label_sums(labels: np.ndarray, stain: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Pixel count and summed stain intensity per label of one chunk."""
+    labels = labels.ravel().astype(np.intp, copy=False)
+    return np.bincount(labels), np.bincount(labels, weights=stain.ravel())
+
+
+def _add_sums(total: np.ndarray, part: np.ndarray) -> np.ndarray:
+    if len(part) > len(total):
+        total, part = part, total
+    total = total.astype(float, copy=True)
+    total[: len(part)] += part
+    return total
+
+
+async def quantify_stain(
+    image: Image,
+    mask: Image,
+    stain_channel: int = 0,
+    contrast: float = DEFAULT_STAIN_CONTRAST,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> StainQuantification:
+    """Count the cells of a Cellpose ``mask`` and how many of them ``image`` shows stained.
+
+    A cell is stained when its mean intensity in ``stain_channel`` is at least
+    ``contrast`` times that of the background (label 0). Both images are read
+    from their zarr stores one chunk of the mask at a time, and each chunk is
+    reduced to per-label sums in ``executor`` (a shared process pool by
+    default). Each chunk's sums are added to the totals as soon as they are
+    ready, so neither the mosaic nor its per-chunk sums have to fit in memory.
+    """
+    labels = da.asarray(mask.data.isel(c=0, t=0).data)
+    stain = da.asarray(image.data.isel(c=stain_channel, t=0).data).rechunk(labels.chunks)
+    loop = asyncio.get_running_loop()
+    pool = executor or _quantify_pool()
+    # A few chunks per worker in flight keep the pool busy without reading ahead.
+    reading = asyncio.Semaphore(2 * (os.cpu_count() or 1))
+
+    async def reduce(index: tuple[int, ...]) -> tuple[np.ndarray, np.ndarray]:
+        async with reading:
+            label_chunk, stain_chunk = await asyncio.to_thread(
+                da.compute, labels.blocks[index], stain.blocks[index]
+            )
+            return await loop.run_in_executor(pool, _label_sums, label_chunk, stain_chunk)
+
+    areas, sums = np.zeros(1), np.zeros(1)
+    tasks = [asyncio.ensure_future(reduce(index)) for index in np.ndindex(*labels.numblocks)]
+    try:
+        for reduced in asyncio.as_completed(tasks):
+            chunk_areas, chunk_sums = await reduced
+            areas, sums = _add_sums(areas, chunk_areas), _add_sums(sums, chunk_sums)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    present = areas[1:] > 0
+    means = sums[1:][present] / areas[1:][present]
+    background = sums[0] / areas[0] if areas[0] else 0.0
+    stained = means >= contrast * background if background else means > 0
+    return StainQuantification(cells=int(present.sum()), stained_cells=int(stained.sum()))
+
+
+# --- Image history ----------------------------------------------------------
+
+
+DEFAULT_HISTORY_PER_SLIDE = 5
+DEFAULT_HISTORY_ENTRIES = 500
+
+
+def record_history(
+    state: AppState, slide: str, record: ImageRecord, keep: int, max_entries: int
+) -> None:
+    """Add ``record`` to the slide's history, which keeps its last ``keep`` records.
+
+    ``keep`` is at least one; the workflow rejects a lower ``history_per_slide``.
+
+    The slide moves to the end of ``state.image_history``, which thereby stays
+    ordered from least to most recently imaged.
+    """
+    history = state.image_history.pop(slide, [])
+    state.image_history[slide] = [*history, record][-keep:]
+    evict_done_slides(state, max_entries)
+
+
+def evict_done_slides(state: AppState, max_entries: int) -> None:
+    """Forget whole slides that are done, least recently imaged first.
+
+    Slides are forgotten until ``state.image_history`` holds at most
+    ``max_entries`` records, or no done slide is left; their latest images go too.
+    """
+    total = sum(len(history) for history in state.image_history.values())
+    for name in list(state.image_history):
+        if total <= max_entries:
+            return
+        if state.slide_status.get(name) != SlideStatus.DONE:
+            continue
+        total -= len(state.image_history.pop(name))
+        state.latest_images.pop(name, None)
+        state.latest_segmented.pop(name, None)
+
+
+# --- Checkpoint journal -----------------------------------------------------
+
+
+@dataclass
+class SlideProgress:
+    """What a journal records one slide of a run as having completed.
+
+    Imaging round 0 is the first scan; round ``n`` follows the ``n``-th protocol.
+    ``cell_counts`` are keyed by imaging round and only kept for completed rounds,
+    since an unfinished round is scanned again.
+    """
+
+    rounds_done: int = 0
+    protocols_done: int = 0
+    stages: Dict[tuple[int, str], str] = field(default_factory=dict)
+    masks: Dict[tuple[int, str], str] = field(default_factory=dict)
+    cell_counts: Dict[int, int] = field(default_factory=dict)
+    converged_after: Optional[int] = None
+
+
+class RunJournal:
+    """Append-only JSON-lines journal of the steps a run has completed.
+
+    Every line records one step of one slide in one imaging round: ``scan`` and
+    ``segment`` with the returned Stage/Image id, ``count``, ``round`` once the
+    slide is back on the deck, ``protocol`` and ``converged``. Lines are synced
+    to disk before the workflow moves on, and a line cut short by a crash is
+    ignored. ``start`` opens a new run; :meth:`replay` only reads the steps after
+    the last one. Without a ``path`` nothing is recorded.
+    """
+
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+
+    def start(self) -> None:
+        """Mark the beginning of a new run."""
+        self._append({"step": "start"})
+
+    def record(self, slide: str, round_: int, step: str, **details: Any) -> None:
+        """Append one completed ``step`` of ``slide`` in imaging round ``round_``."""
+        self._append({"slide": slide, "round": round_, "step": step, **details})
+
+    def replay(self) -> Dict[str, SlideProgress]:
+        """The progress of every slide of the last run, keyed by slide name."""
+        progress: Dict[str, SlideProgress] = {}
+        for entry in self._entries():
+            step = entry["step"]
+            if step == "start":
+                progress = {}
+                continue
+            slide = progress.setdefault(entry["slide"], SlideProgress())
+            round_ = entry["round"]
+            if step == "scan":
+                slide.stages[(round_, entry["well"])] = entry["id"]
+            elif step == "segment":
+                slide.masks[(round_, entry["well"])] = entry["id"]
+            elif step == "count":
+                slide.cell_counts[round_] = entry["cells"]
+            elif step == "round":
+                slide.rounds_done = round_ + 1
+            elif step == "protocol":
+                slide.protocols_done = round_
+            elif step == "converged":
+                slide.converged_after = round_
+        for slide in progress.values():
+            slide.cell_counts = {
+                round_: cells
+                for round_, cells in sorted(slide.cell_counts.items())
+                if round_ < slide.rounds_done
+            }
+        return progress
+
+    def _entries(self) -> list[dict[str, Any]]:
+        if self.path is None or not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+        return entries
+
+    def _append(self, entry: dict[str, Any]) -> None:
+        if self.path is None:
+            return
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# --- Motion profiles --------------------------------------------------------
+
+
+ROBOT_LEGS = ("pick_up_opentrons", "release_at_frame", "pick_up_frame", "release_at_opentrons")
+
+
+def motion_profile(
+    profiles: Dict[str, MotionProfile], leg: str, sample_type: Optional[str]
+) -> Optional[MotionProfile]:
+    """The profile for ``leg``: the one for ``sample_type`` if set, else the leg's default."""
+    if sample_type is not None and f"{leg}/{sample_type}" in profiles:
+        return profiles[f"{leg}/{sample_type}"]
+    return profiles.get(leg)
+
+
+def _motion_kwargs(profile: Optional[MotionProfile]) -> Dict[str, int]:
+    if profile is None:
+        return {}
+    kwargs = {
+        "speed": profile.speed,
+        "acceleration": profile.acceleration,
+        "dangerSpeed": profile.danger_speed,
+    }
+    return {key: value for key, value in kwargs.items() if value is not None}
+
+
+# --- Well geometry ----------------------------------------------------------
+
+
+DEFAULT_PLATE = "default"
+
+
+def well_key(plate_type: Optional[str], well_id: str) -> str:
+    """The registry key of ``well_id`` on ``plate_type`` (the FRAME's default if unset)."""
+    return f"{plate_type or DEFAULT_PLATE}/{well_id}"
+
+
+class WellRegistry:
+    """Local, versioned log of the wells taught on the FRAME, keyed by plate type and well.
+
+    The FRAME keeps the bounds it scans with; this log only records which wells
+    were taught, when and at which corners, so a run can warn about untaught
+    wells and a lost well can be taught again at the same stage positions. The
+    whole log lives in one JSON file that is rewritten atomically on every change;
+    each change bumps the version, which is stamped on the entry.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.version, self._wells = read_json(
+            path,
+            lambda data: (
+                int(data["version"]),
+                {key: WellGeometry(**entry) for key, entry in data["wells"].items()},
+            ),
+            (0, {}),
+        )
+
+    def get(self, plate_type: Optional[str], well_id: str) -> Optional[WellGeometry]:
+        """The geometry taught for ``well_id`` on ``plate_type``, if any."""
+        return self._wells.get(well_key(plate_type, well_id))
+
+    def wells(self) -> Dict[str, WellGeometry]:
+        """Every taught well, keyed by :func:`well_key`."""
+        return dict(self._wells)
+
+    def teach(
+        self,
+        plate_type: Optional[str],
+        well_id: str,
+        first_corner: list[int],
+        second_corner: Optional[list[int]] = None,
+    ) -> WellGeometry:
+        """Record (or replace) the geometry of ``well_id`` and persist the registry."""
+        self.version += 1
+        geometry = WellGeometry(
+            plate_type=plate_type or DEFAULT_PLATE,
+            well_id=well_id,
+            first_corner=list(first_corner),
+            version=self.version,
+            second_corner=list(second_corner) if second_corner is not None else None,
+        )
+        self._wells[well_key(plate_type, well_id)] = geometry
+        self._save()
+        return geometry
+
+    def _save(self) -> None:
+        data = {
+            "version": self.version,
+            "wells": {key: asdict(geometry) for key, geometry in self._wells.items()},
+        }
+        write_json(self.path, data, indent=2)
+
+
+well_registry = WellRegistry(state_file("STAINSTORM_WELL_REGISTRY", "well_geometry.json"))
+
+
+def warn_untaught_wells(state: AppState, slides: list[Slide]) -> None:
+    """Log the wells of ``slides`` the registry has no geometry for."""
+    untaught = sorted(
+        {
+            well_key(slide.plate_type, well)
+            for slide in slides
+            for well in slide.wells
+            if well_key(slide.plate_type, well) not in state.well_geometry
+        }
+    )
+    if untaught:
+        log(
+            f"No taught geometry for {', '.join(untaught)}; relying on the bounds the "
+            "FRAME remembers."
+        )
+
+
+# --- Duration model ---------------------------------------------------------
+
+
+DEFAULT_DURATION_SMOOTHING = 0.2
+
+
+class DurationModel:
+    """Learned durations of remote calls and round counts of protocols.
+
+    Every successful timed call updates a moving average of its duration under
+    ``app.method``; every finished slide updates the average number of protocol
+    rounds it took under :func:`rounds_key`. With a ``path``, the averages are
+    loaded from that JSON file and :meth:`save` rewrites it atomically, so what was
+    learned carries over to the next run.
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, smoothing: float = DEFAULT_DURATION_SMOOTHING
+    ) -> None:
+        self.path = path
+        self.smoothing = smoothing
+        self._means: Dict[str, float] = read_json(path, lambda data: dict(data["means"]), {})
+
+    def observe(self, key: str, value: float) -> None:
+        """Fold one measurement of ``key`` into its moving average."""
+        mean = self._means.get(key)
+        self._means[key] = value if mean is None else mean + self.smoothing * (value - mean)
+
+    def mean(self, key: str) -> Optional[float]:
+        """The moving average of ``key``, if it was ever measured."""
+        return self._means.get(key)
+
+    def save(self) -> None:
+        """Write the averages to ``path``, if there is one."""
+        if self.path is None:
+            return
+        write_json(self.path, {"means": self._means}, indent=2)
+
+
+duration_model = DurationModel(state_file("STAINSTORM_DURATION_MODEL", "duration_model.json"))
+
+
+def rounds_key(workflow: str, protocol: str) -> str:
+    """The :class:`DurationModel` key of the protocol rounds a slide takes in ``workflow``."""
+    return f"{workflow}/rounds/{protocol}"
+
+
+def expected_rounds(model: DurationModel, workflow: str, slide: Slide, limit: int) -> float:
+    """The protocol rounds ``slide`` is expected to take, ``limit`` until any was measured."""
+    learned = model.mean(rounds_key(workflow, slide.protocol))
+    return float(limit) if learned is None else min(float(limit), learned)
+
+
+def expected_duration(
+    model: DurationModel,
+    slide: Slide,
+    protocols: float,
+    passes: float,
+    per_pass: Sequence[str] = (),
+) -> Optional[float]:
+    """Expected seconds of ``protocols`` protocol runs and ``passes`` imaging passes.
+
+    An imaging pass is the transfer onto the FRAME, a scan per well, the transfer
+    back and the ``per_pass`` calls. Unset while any of those was never measured.
+    """
+    robot, frame = _declared_app(FairinoLike), _declared_app(FrameLike)
+    pass_keys = [
+        *(f"{robot}.{leg}" for leg in ROBOT_LEGS),
+        *[f"{frame}.run_well_tile_scan"] * len(slide.wells),
+        *per_pass,
+    ]
+    means = [model.mean(key) for key in pass_keys]
+    protocol = model.mean(f"{_declared_app(OT2Like)}.run_{slide.protocol}_protocol")
+    if protocol is None and protocols > 0 or any(mean is None for mean in means):
+        return None
+    return protocols * (protocol or 0.0) + passes * sum(means)  # type: ignore[arg-type]
+
+
+def update_eta(state: AppState, slide: Slide, remaining: Optional[float]) -> None:
+    """Publish when ``slide`` is expected to be done, ``remaining`` seconds of work from now."""
+    if remaining is None:
+        state.slide_eta.pop(slide.name, None)
+    else:
+        state.slide_eta[slide.name] = time.time() + remaining
+
+
+def _shortest_first(duration: Optional[float]) -> float:
+    # Slides whose duration cannot be estimated yet go last, in their given order.
+    return math.inf if duration is None else duration
+
+
+def _check_order(order: str) -> None:
+    if order not in (SlideOrder.LOADED, SlideOrder.SHORTEST_FIRST):
+        raise ValueError(f"Unknown slide order {order!r}; use 'loaded' or 'shortest_first'.")
+
+
+# --- Resource-aware scheduling ----------------------------------------------
+
+
+class _ProtocolBatch:
+    """The slides waiting on one upcoming protocol run."""
+
+    def __init__(self) -> None:
+        self.slides = 1
+        self.done: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+
+class Workcell:
+    """The robot, microscope and Opentrons of one cell as separately held resources.
+
+    Every physical step only takes the device it needs, so slide B can be carried
+    to the FRAME and scanned while slide A sits in an Opentrons protocol.
+
+    * The FRAME holds a single slide. ``frame_lock`` is taken before a slide is
+      released onto it and given back once the slide has been picked up again.
+    * ``robot_lock`` covers a single transfer (a pick-up and the matching release).
+    * ``deck_lock`` covers the Opentrons deck: a protocol run and every robot
+      transfer that reaches into the deck exclude each other, so the arm never
+      enters the OT-2 while it is pipetting.
+
+    Locks are always taken in the order frame -> robot -> deck. Before a protocol
+    starts, any slide that is waiting to go onto a freshly emptied FRAME is loaded
+    first, so the scan of that slide overlaps with the protocol instead of queueing
+    behind it.
+
+    ``devices`` tracks whether the robot is initialized, the gripper state, the arm
+    location and whether the stage is homed (or only the robot's part of that,
+    with ``stage_devices`` given for the stage). The robot is only initialized and
+    the stage only homed when that state is unknown; any failed robot or
+    microscope call forgets what was known about that device.
+
+    Workcells that share a device (see :class:`Stations`) are given the same lock
+    and state for it, and those sharing an Opentrons share its protocol runs.
+
+    Slides due for the same protocol share one run of it, up to ``deck_capacity``
+    slides; the first of them waits ``batch_window`` seconds for others to join.
+
+    ``focus_maps`` remembers which wells have been focused since the stage was
+    last homed, ordered from least to most recently scanned; homing the stage
+    clears it. Every transfer leg is run with its
+    profile from ``motion_profiles`` (see :func:`motion_profile`).
+    """
+
+    def __init__(
+        self,
+        robot: FairinoLike,
+        opentrons: OT2Like,
+        microscope: FrameLike,
+        devices: Optional[DeviceState] = None,
+        focus_maps: Optional[Dict[str, WellFocus]] = None,
+        motion_profiles: Optional[Dict[str, MotionProfile]] = None,
+        deck_capacity: int = 1,
+        batch_window: float = 0.0,
+        *,
+        stage_devices: Optional[DeviceState] = None,
+        frame_lock: Optional[asyncio.Lock] = None,
+        robot_lock: Optional[asyncio.Lock] = None,
+        deck_lock: Optional[asyncio.Lock] = None,
+        protocol_batches: Optional[dict[str, _ProtocolBatch]] = None,
+    ) -> None:
+        self.robot = robot
+        self.opentrons = opentrons
+        self.microscope = microscope
+        self.devices = devices if devices is not None else DeviceState()
+        self.stage_devices = stage_devices if stage_devices is not None else self.devices
+        self.focus_maps = focus_maps if focus_maps is not None else {}
+        self.motion_profiles = motion_profiles if motion_profiles is not None else {}
+        self.deck_capacity = deck_capacity
+        self.batch_window = batch_window
+        self._protocol_batches = protocol_batches if protocol_batches is not None else {}
+        self.frame_lock = frame_lock or asyncio.Lock()
+        self.robot_lock = robot_lock or asyncio.Lock()
+        self.deck_lock = deck_lock or asyncio.Lock()
+        self._loads_pending = 0
+        self._frame_loading = False
+        self._loads_changed = asyncio.Condition()
+
+    async def load_frame(self, slide: Slide) -> None:
+        """Carry ``slide`` from its Opentrons deck position onto the FRAME."""
+        await self._set_loads_pending(+1)
+        try:
+            await self.frame_lock.acquire()
+            self._frame_loading = True
+            try:
+                async with self.robot_lock, self.deck_lock:
+                    await self._ensure_robot_ready()
+                    await self._move(
+                        self.robot.pick_up_opentrons, slide, Gripper.CLOSED, ArmLocation.OPENTRONS
+                    )
+                    await self._move(
+                        self.robot.release_at_frame, slide, Gripper.OPEN, ArmLocation.FRAME
+                    )
+            except BaseException:
+                self.frame_lock.release()
+                raise
+            finally:
+                self._frame_loading = False
+        finally:
+            await self._set_loads_pending(-1)
+
+    async def unload_frame(self, slide: Slide) -> None:
+        """Carry ``slide`` from the FRAME back to its Opentrons deck position."""
+        async with self.robot_lock, self.deck_lock:
+            await self._ensure_robot_ready()
+            await self._move(
+                self.robot.pick_up_frame, slide, Gripper.CLOSED, ArmLocation.FRAME
+            )
+            await self._move(
+                self.robot.release_at_opentrons, slide, Gripper.OPEN, ArmLocation.OPENTRONS
+            )
+        self.frame_lock.release()
+
+    async def scan(
+        self,
+        well_id: str,
+        focus_key: Optional[str] = None,
+        refinement_range: Optional[int] = None,
+        plate_type: Optional[str] = None,
+    ) -> Stage:
+        """Tile-scan ``well_id`` of the slide on the FRAME, homing the stage first if needed.
+
+        With a ``refinement_range``, a well that was also the FRAME's previous scan
+        under ``focus_key`` is scanned with that narrow autofocus range instead of a
+        full sweep. The FRAME refines around wherever the stage was left, so any
+        other well in between needs a full sweep again.
+        """
+        try:
+            if not self.stage_devices.stage_homed:
+                await _acall(self.microscope.homeStageAxis)
+                self.stage_devices.stage_homed = True
+                self.focus_maps.clear()  # focus found before homing no longer applies
+            settings: dict[str, Any] = {}
+            if plate_type is not None:
+                settings["plate_type"] = plate_type
+            if refinement_range is not None and focus_key is not None:
+                if next(reversed(self.focus_maps), None) == focus_key:
+                    settings["autofocus_range"] = refinement_range
+            stage = await _acall(self.microscope.run_well_tile_scan, well_id=well_id, **settings)
+        except Exception:
+            self.stage_devices.stage_homed = False
+            raise
+        if focus_key is not None:
+            # Moved to the end, so the last key is the well the stage was left at.
+            previous = self.focus_maps.pop(focus_key, None)
+            self.focus_maps[focus_key] = WellFocus(scans=(previous.scans if previous else 0) + 1)
+        return stage
+
+    async def run_protocol(self, protocol: str) -> None:
+        """Run ``protocol`` once the FRAME has been refilled, if anyone is waiting.
+
+        A slide that asks for a protocol another slide is already waiting to run
+        joins that run instead of queueing its own, up to ``deck_capacity`` slides.
+        """
+        batch = self._protocol_batches.get(protocol)
+        if batch is not None and batch.slides < self.deck_capacity:
+            batch.slides += 1
+            await asyncio.shield(batch.done)
+            return
+
+        batch = _ProtocolBatch()
+        self._protocol_batches[protocol] = batch
+        try:
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            async with self._loads_changed:
+                await self._loads_changed.wait_for(self._frame_settled)
+            async with self.deck_lock:
+                self._close_batch(protocol, batch)  # later arrivals start a new run
+                if batch.slides > 1:
+                    log(f"Running the {protocol} protocol for {batch.slides} slides at once.")
+                await _run_protocol(self.opentrons, protocol)  # type: ignore[arg-type]
+        except BaseException as e:
+            self._close_batch(protocol, batch)
+            if isinstance(e, asyncio.CancelledError):
+                batch.done.cancel()
+            elif batch.slides > 1:
+                batch.done.set_exception(e)
+            raise
+        batch.done.set_result(None)
+
+    def _close_batch(self, protocol: str, batch: _ProtocolBatch) -> None:
+        # A full batch may already have been replaced by the next one.
+        if self._protocol_batches.get(protocol) is batch:
+            del self._protocol_batches[protocol]
+
+    async def _ensure_robot_ready(self) -> None:
+        # Only an initialized robot with an open gripper can start a transfer.
+        devices = self.devices
+        if devices.robot_initialized and devices.gripper == Gripper.OPEN:
+            return
+        try:
+            await _acall(self.robot.init_robot_and_gripper)
+        except Exception:
+            self.forget_robot()
+            raise
+        devices.robot_initialized = True
+        devices.gripper = Gripper.OPEN
+
+    async def _move(
+        self, method: Callable[..., Any], slide: Slide, gripper: str, location: str
+    ) -> None:
+        profile = motion_profile(self.motion_profiles, method.__name__, slide.sample_type)
+        try:
+            await _acall(method, slide.name, **_motion_kwargs(profile))
+        except Exception:
+            self.forget_robot()
+            raise
+        self.devices.gripper = gripper
+        self.devices.arm_location = location
+
+    def forget_robot(self) -> None:
+        """Mark the robot's state as unknown so it is re-initialized before its next move."""
+        self.devices.robot_initialized = False
+        self.devices.gripper = None
+        self.devices.arm_location = None
+
+    def _frame_settled(self) -> bool:
+        # A released frame lock only flips to locked once the woken waiter runs,
+        # so "unlocked with loads pending" means a load is about to happen.
+        if self._frame_loading:
+            return False
+        return self.frame_lock.locked() or self._loads_pending == 0
+
+    async def _set_loads_pending(self, delta: int) -> None:
+        async with self._loads_changed:
+            self._loads_pending += delta
+            self._loads_changed.notify_all()
+
+
+class Stations:
+    """Several workcells, each a robot arm with an Opentrons and a FRAME it reaches.
+
+    ``stations[i]`` says which devices ``cells[i]`` is made of. A slide stays in
+    the Opentrons it sits in (``Slide.deck``, or the decks in turn), but each
+    imaging pass goes to whichever FRAME reachable from there frees up first.
+
+    Only Python callers can hand over several devices of a kind: the registered
+    workflow declares one required dependency per app.
+    """
+
+    def __init__(self, cells: Sequence[Workcell], stations: Sequence[Station]) -> None:
+        self.cells = list(cells)
+        self.stations = list(stations)
+        self.decks = sorted({station.opentrons for station in stations})
+        self._frames_changed = asyncio.Condition()
+
+    @classmethod
+    def build(
+        cls,
+        robots: Sequence[FairinoLike],
+        opentrons: Sequence[OT2Like],
+        microscopes: Sequence[FrameLike],
+        stations: Optional[Sequence[Station]],
+        state: AppState,
+        deck_capacity: int = 1,
+        batch_window: float = 0.0,
+    ) -> "Stations":
+        """Workcells for ``stations``, which index into the device lists.
+
+        A device that is part of several stations is shared by their workcells.
+        Without ``stations``, a single robot reaches every Opentrons and FRAME.
+        What is known about each robot and stage is kept in
+        ``state.station_devices``, and each FRAME remembers its own focus.
+        """
+        if stations is None:
+            if len(robots) > 1:
+                raise ValueError("With several robots, stations must say what each one reaches.")
+            stations = [
+                Station(robot=0, opentrons=o, microscope=m)
+                for o in range(len(opentrons))
+                for m in range(len(microscopes))
+            ]
+        for station in stations:
+            if not (
+                0 <= station.robot < len(robots)
+                and 0 <= station.opentrons < len(opentrons)
+                and 0 <= station.microscope < len(microscopes)
+            ):
+                raise ValueError(f"{station} names a device that was not given.")
+        robot_locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        frame_locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        deck_locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        batches: dict[int, dict[str, _ProtocolBatch]] = defaultdict(dict)
+        focus: dict[int, Dict[str, WellFocus]] = defaultdict(dict)
+        devices = state.station_devices
+        cells = [
+            Workcell(
+                robots[station.robot],
+                opentrons[station.opentrons],
+                microscopes[station.microscope],
+                devices.setdefault(f"robot/{station.robot}", DeviceState()),
+                focus[station.microscope],
+                state.motion_profiles,
+                deck_capacity,
+                batch_window,
+                stage_devices=devices.setdefault(f"microscope/{station.microscope}", DeviceState()),
+                frame_lock=frame_locks[station.microscope],
+                robot_lock=robot_locks[station.robot],
+                deck_lock=deck_locks[station.opentrons],
+                protocol_batches=batches[station.opentrons],
+            )
+            for station in stations
+        ]
+        return cls(cells, stations)
+
+    def deck_of(self, slide: Slide, index: int) -> int:
+        """The Opentrons of the ``index``-th slide of a run."""
+        if slide.deck is None or len(self.decks) == 1:
+            return self.decks[index % len(self.decks)]
+        if slide.deck not in self.decks:
+            raise ValueError(
+                f"Slide {slide.name} sits in Opentrons {slide.deck}, which no station reaches."
+            )
+        return slide.deck
+
+    def at_deck(self, deck: int) -> Workcell:
+        """A workcell with the Opentrons ``deck``, to run a protocol there."""
+        return next(cell for cell, s in zip(self.cells, self.stations) if s.opentrons == deck)
+
+    async def load_frame(self, slide: Slide, deck: int) -> Workcell:
+        """Carry ``slide`` from Opentrons ``deck`` onto the first reachable FRAME that is free."""
+        candidates = [cell for cell, s in zip(self.cells, self.stations) if s.opentrons == deck]
+        if len(candidates) == 1:
+            await candidates[0].load_frame(slide)
+            return candidates[0]
+        # Waiting counts as a pending load at every candidate, so no protocol on the
+        # deck starts ahead of it while one of their FRAMEs stands empty.
+        waiting: list[Workcell] = []
+        try:
+            for cell in candidates:
+                await cell._set_loads_pending(+1)
+                waiting.append(cell)
+            async with self._frames_changed:
+                await self._frames_changed.wait_for(
+                    lambda: any(not cell.frame_lock.locked() for cell in candidates)
+                )
+            chosen = min(
+                candidates, key=lambda cell: (cell.frame_lock.locked(), cell._loads_pending)
+            )
+            for cell in candidates:
+                if cell is not chosen:
+                    await cell._set_loads_pending(-1)
+                    waiting.remove(cell)
+            await chosen.load_frame(slide)
+        except BaseException:
+            await self._frame_changed()
+            raise
+        finally:
+            for cell in waiting:
+                await cell._set_loads_pending(-1)
+        return chosen
+
+    async def unload_frame(self, cell: Workcell, slide: Slide) -> None:
+        """Carry ``slide`` from the FRAME of ``cell`` back to its Opentrons."""
+        await cell.unload_frame(slide)
+        await self._frame_changed()
+
+    async def _frame_changed(self) -> None:
+        async with self._frames_changed:
+            self._frames_changed.notify_all()
+
+
+# --- Declarative plans ------------------------------------------------------
+
+
+# The declared app each device of a plan stands for.
+PLAN_DEVICES: Dict[str, type] = {
+    "robot": FairinoLike,
+    "opentrons": OT2Like,
+    "microscope": FrameLike,
+    "coordinate_corrector": CorrectCoordinateSystemDevLike,
+    "stitcher": StitchLike,
+    "segmenter": SegmenterLike,
+}
+
+
+@dataclass(frozen=True)
+class Ref:
+    """A step argument that is the result of an earlier step, or its ``index``-th item."""
+
+    step: str
+    index: Optional[int] = None
+
+
+@dataclass
+class PlanStep:
+    """One call of a declared method, what it waits for and which resources it holds.
+
+    The step starts once the steps in ``after`` (and those its :class:`Ref` arguments
+    name) are done and its resources are free. ``uses`` are held while the call runs,
+    by default its device. ``claims`` stay held after it, until a later step gives
+    them back through ``releases`` once that step is done -- e.g. the FRAME, from
+    picking a slide up for it until the slide is back in the Opentrons.
+    """
+
+    name: str
+    device: str
+    method: str
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    after: tuple[str, ...] = ()
+    uses: Optional[tuple[str, ...]] = None
+    claims: tuple[str, ...] = ()
+    releases: tuple[str, ...] = ()
+
+    @property
+    def needs(self) -> tuple[str, ...]:
+        """Every step this one waits for."""
+        refs = [value.step for value in self.kwargs.values() if isinstance(value, Ref)]
+        return tuple(dict.fromkeys([*self.after, *refs]))
+
+    @property
+    def taken(self) -> frozenset[str]:
+        """The resources the step takes when it starts."""
+        return frozenset((self.device,) if self.uses is None else self.uses) | set(self.claims)
+
+    @property
+    def freed(self) -> frozenset[str]:
+        """The resources given back when the step is done."""
+        return self.taken - set(self.claims) | set(self.releases)
+
+    @property
+    def key(self) -> str:
+        """The ``app.method`` the step's calls are timed under."""
+        return f"{_declared_app(PLAN_DEVICES[self.device])}.{self.method}"
+
+
+@dataclass
+class Plan:
+    """The steps of a protocol as data, each waiting only for steps listed before it."""
+
+    steps: list[PlanStep]
+
+    def __post_init__(self) -> None:
+        claimed_before: dict[str, set[str]] = {}
+        for step in self.steps:
+            if step.name in claimed_before:
+                raise ValueError(f"Plan step {step.name!r} is listed twice.")
+            protocol = PLAN_DEVICES.get(step.device)
+            if protocol is None:
+                raise ValueError(f"Plan step {step.name!r} runs on unknown device {step.device!r}.")
+            if step.method.startswith("_") or not callable(getattr(protocol, step.method, None)):
+                raise ValueError(
+                    f"Plan step {step.name!r} calls {step.method!r}, which "
+                    f"{protocol.__name__} does not declare."
+                )
+            claimed: set[str] = set(step.claims)
+            for name in step.needs:
+                if name not in claimed_before:
+                    raise ValueError(
+                        f"Plan step {step.name!r} waits for {name!r}, "
+                        "which is not listed before it."
+                    )
+                claimed |= claimed_before[name]
+            if not set(step.releases) <= claimed:
+                raise ValueError(
+                    f"Plan step {step.name!r} releases resources no step before it claimed."
+                )
+            claimed_before[step.name] = claimed
+
+
+class _Resources:
+    """Named exclusive resources, taken all at once or not at all."""
+
+    def __init__(self) -> None:
+        self._busy: set[str] = set()
+        self._changed = asyncio.Condition()
+
+    async def take(self, names: frozenset[str]) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._busy.isdisjoint(names))
+            self._busy |= names
+
+    async def give_back(self, names: frozenset[str]) -> None:
+        async with self._changed:
+            self._busy -= names
+            self._changed.notify_all()
+
+
+def _resolve(value: Any, tasks: Dict[str, "asyncio.Task[Any]"]) -> Any:
+    if not isinstance(value, Ref):
+        return value
+    result = tasks[value.step].result()
+    return result if value.index is None else result[value.index]
+
+
+async def run_plan(
+    plan: Plan, devices: Dict[str, Any], state: AppState
+) -> AsyncGenerator[tuple[str, Any], None]:
+    """Run ``plan`` on ``devices`` (keyed like :data:`PLAN_DEVICES`).
+
+    Every step starts as soon as the steps it needs are done and its resources are
+    free, and its name and result are yielded as it completes. Each call is timed
+    into ``state.call_latency``. The first step to fail cancels the others.
+    """
+    missing = sorted({step.device for step in plan.steps} - devices.keys())
+    if missing:
+        raise ValueError(f"The plan needs devices that were not given: {', '.join(missing)}.")
+    timed = {
+        name: memoized(
+            latency_recorder.instrument(devices[name], PLAN_DEVICES[name], state),
+            PLAN_DEVICES[name],
+        )
+        for name in {step.device for step in plan.steps}
+    }
+    resources = _Resources()
+    pipeline = _Pipeline()
+    tasks: Dict[str, "asyncio.Task[Any]"] = {}
+
+    async def run(step: PlanStep) -> Any:
+        await asyncio.gather(*(tasks[name] for name in step.needs))
+        kwargs = {key: _resolve(value, tasks) for key, value in step.kwargs.items()}
+        await resources.take(step.taken)
+        try:
+            result = await _acall(getattr(timed[step.device], step.method), **kwargs)
+        finally:
+            await resources.give_back(step.freed)
+        pipeline.emit((step.name, result))
+        return result
+
+    for step in plan.steps:
+        tasks[step.name] = pipeline.spawn(run(step))
+    async for item in pipeline.stream():
+        yield item
+
+
+@dataclass
+class PlanEstimate:
+    """What a dry run of a :class:`Plan` predicts."""
+
+    makespan: float
+    starts: Dict[str, float]
+    critical_path: list[str]
+    unmeasured: list[str]
+
+
+def estimate_plan(
+    plan: Plan,
+    durations: Optional[Dict[str, float]] = None,
+    model: Optional[DurationModel] = None,
+) -> PlanEstimate:
+    """Predict when each step of ``plan`` starts and how long the plan takes, calling nothing.
+
+    Like :func:`run_plan`, every step starts once the steps it needs are done and
+    its resources are free; the step that has been ready longest goes first, the
+    earlier listed one on a tie. A step takes its
+    ``app.method`` entry of ``durations``, else what the :class:`DurationModel`
+    learned; steps whose duration is unknown take no time and are listed in
+    ``unmeasured``. The critical path is the chain of steps, each of which held up
+    the next, that ends with the last step to finish.
+    """
+    model = model if model is not None else duration_model
+    durations = durations or {}
+    unmeasured: set[str] = set()
+
+    def duration(step: PlanStep) -> float:
+        known = durations.get(step.key, model.mean(step.key))
+        if known is None:
+            unmeasured.add(step.key)
+        return known or 0.0
+
+    pending = list(plan.steps)
+    running: list[tuple[float, int, PlanStep]] = []
+    starts: Dict[str, float] = {}
+    ends: Dict[str, float] = {}
+    held_up_by: Dict[str, Optional[str]] = {}
+    freed_by: Dict[str, str] = {}
+    busy: set[str] = set()
+    now = 0.0
+    while pending or running:
+        ready = [
+            (max((ends[name] for name in step.needs), default=0.0), index, step)
+            for index, step in enumerate(pending)
+            if all(ends.get(name, math.inf) <= now for name in step.needs)
+        ]
+        for _, _, step in sorted(ready, key=lambda item: item[:2]):
+            if busy.isdisjoint(step.taken):
+                pending.remove(step)
+                starts[step.name] = now
+                # Whatever ended last, just as the step could start, held it up.
+                blockers = [name for name in step.needs if ends[name] == now]
+                blockers += [freed_by[r] for r in step.taken if r in freed_by]
+                held_up_by[step.name] = next(
+                    (name for name in blockers if ends.get(name) == now and now > 0), None
+                )
+                busy |= step.taken
+                heapq.heappush(running, (now + duration(step), len(starts), step))
+        if not running:
+            raise ValueError(
+                f"Plan step {pending[0].name!r} can never start: a resource it needs stays claimed."
+            )
+        now = running[0][0]
+        while running and running[0][0] == now:
+            _, _, step = heapq.heappop(running)
+            ends[step.name] = now
+            busy -= step.freed
+            for resource in step.freed:
+                freed_by[resource] = step.name
+
+    path: list[str] = []
+    last = max(ends, key=ends.__getitem__, default=None)
+    while last is not None:
+        path.append(last)
+        last = held_up_by[last]
+    return PlanEstimate(
+        makespan=max(ends.values(), default=0.0),
+        starts=starts,
+        critical_path=path[::-1],
+        unmeasured=sorted(unmeasured),
+    )
+
+
+def stainstorm_plan(slides: list[Slide], iterations: int) -> Plan:
+    """The imaging and protocol rounds of :func:`run_stainstorm_7` as a :class:`Plan`.
+
+    Each slide is imaged, then run through its protocol and imaged again
+    ``iterations`` times; every scan is corrected and segmented in the
+    background. The robot is claimed from a pick-up until the matching release,
+    and the FRAME while a slide is on its way to, on or back from it.
+
+    The plan is an approximation of the workflow, not a replay of it: it has one
+    robot, Opentrons and FRAME, no protocol batching, convergence checks, journal
+    or focus refinement, and it corrects scans with the remote corrector where the
+    workflow inverts them locally. The workflow times its local inversion under
+    the same ``correct_coordinate_system.invert_x_axis`` name, so estimates use
+    the duration the workflow actually sees.
+    """
+    steps = [
+        PlanStep("init", "robot", "init_robot_and_gripper"),
+        PlanStep("home", "microscope", "homeStageAxis"),
+    ]
+    for slide in slides:
+        sample = {"sample": slide.name}
+        settings = {"plate_type": slide.plate_type} if slide.plate_type is not None else {}
+        previous: tuple[str, ...] = ("init",)
+        for round_ in range(iterations + 1):
+            at = f"{slide.name}/{round_}"
+            if round_:
+                steps.append(
+                    PlanStep(
+                        f"{at}/protocol",
+                        "opentrons",
+                        f"run_{slide.protocol}_protocol",
+                        after=previous,
+                    )
+                )
+                previous = (f"{at}/protocol",)
+            steps += [
+                PlanStep(
+                    f"{at}/pick_up_opentrons",
+                    "robot",
+                    "pick_up_opentrons",
+                    sample,
+                    after=previous,
+                    uses=("opentrons",),
+                    claims=("robot", "frame"),
+                ),
+                PlanStep(
+                    f"{at}/release_at_frame",
+                    "robot",
+                    "release_at_frame",
+                    sample,
+                    after=(f"{at}/pick_up_opentrons",),
+                    uses=(),
+                    releases=("robot",),
+                ),
+            ]
+            previous = (f"{at}/release_at_frame", "home")
+            for well in slide.wells:
+                scan, corrected = f"{at}/{well}/scan", f"{at}/{well}/correct"
+                steps += [
+                    PlanStep(
+                        scan,
+                        "microscope",
+                        "run_well_tile_scan",
+                        {"well_id": well, **settings},
+                        after=previous,
+                    ),
+                    PlanStep(
+                        corrected, "coordinate_corrector", "invert_x_axis", {"stage": Ref(scan)}
+                    ),
+                    PlanStep(
+                        f"{at}/{well}/segment",
+                        "segmenter",
+                        "run_cellpose_SAM",
+                        {"image": Ref(corrected), "diameter": 13, "gpu": True},
+                        uses=(),
+                    ),
+                ]
+                previous = (scan,)
+            steps += [
+                PlanStep(
+                    f"{at}/pick_up_frame",
+                    "robot",
+                    "pick_up_frame",
+                    sample,
+                    after=previous,
+                    uses=(),
+                    claims=("robot",),
+                ),
+                PlanStep(
+                    f"{at}/release_at_opentrons",
+                    "robot",
+                    "release_at_opentrons",
+                    sample,
+                    after=(f"{at}/pick_up_frame",),
+                    uses=("opentrons",),
+                    releases=("robot", "frame"),
+                ),
+            ]
+            previous = (f"{at}/release_at_opentrons",)
+    return Plan(steps)
 
 
 # --- Registered protocols ---------------------------------------------------
 
 
 @register
-def run_stainstorm_7(
+async def run_stainstorm_7(
     robot: FairinoLike,
     opentrons: OT2Like,
     microscope: FrameLike,
     segmenter: SegmenterLike,
     coordinate_corrector: CorrectCoordinateSystemDevLike,
+    state: AppState,
     loaded_slides: list[Slide],
     max_iterations: int = 5,
-) -> Generator[Stage, None, None]:
+    segmentation_window: float = DEFAULT_SEGMENTATION_WINDOW,
+    plateau_tolerance: Optional[float] = None,
+    journal_path: Optional[str] = None,
+    resume: bool = False,
+    focus_refinement_range: Optional[int] = None,
+    deck_capacity: int = 1,
+    protocol_batch_window: float = 0.0,
+    state_publish_interval: float = DEFAULT_STATE_PUBLISH_INTERVAL,
+    stations: Optional[list[Station]] = None,
+    order: str = SlideOrder.SHORTEST_FIRST,
+) -> AsyncGenerator[Stage, None]:
     """Iteratively image, stitch, segment, and stain each slide.
+
+    Slides are interleaved across the robot, the microscope and the Opentrons:
+    while one slide runs its protocol the next one is scanned, and correction and
+    segmentation run in the background without holding the FRAME. The wells of a
+    slide are scanned back to back, each one analyzed while the next is scanned,
+    and results are yielded per well. Identical segmentation requests share one
+    Cellpose call (see :class:`SegmentationBatcher`). Scans and segmentations are
+    yielded as they complete. Every remote call is timed into ``state.call_latency``.
+    Called from Python, ``segmenter`` may also be a list of instances, in which
+    case each segmentation goes to the least loaded of them (see
+    :class:`ComputePool`). Registered, it is one declared dependency and the pool
+    has a single instance.
+
+    With ``plateau_tolerance`` set, a slide's segmented cells are counted after
+    every imaging round into ``state.cell_counts``. Once the count changes by at
+    most that fraction from one round to the next, the slide's remaining rounds
+    are skipped and recorded in ``state.converged_after``.
+
+    With ``journal_path`` set, every completed step is appended to that
+    :class:`RunJournal`. ``resume`` replays the journal of an interrupted run into
+    ``state`` and continues each slide from its first unfinished imaging round,
+    re-segmenting any scans whose masks were lost. It assumes every slide is back
+    at its deck position.
+
+    With ``focus_refinement_range`` set, a well rescanned straight after its own
+    previous scan on the same FRAME is scanned with that narrow autofocus range
+    (see :meth:`Workcell.scan`). That only happens for a single single-well slide
+    per FRAME; interleaved slides and wells are always swept in full.
+
+    With a ``deck_capacity`` above one, slides waiting for the same protocol are
+    processed by a single run of it; the first slide to ask waits up to
+    ``protocol_batch_window`` seconds for others to join.
+
+    While slides are in progress, changes to ``state`` are published at most
+    every ``state_publish_interval`` seconds, each changed value once (see
+    :class:`CoalescingPublisher`).
+
+    Called from Python, ``robot``, ``opentrons`` and ``microscope`` may also be
+    lists of devices, with ``stations`` saying which robot reaches which Opentrons
+    and FRAME. Each slide stays in its Opentrons, and every imaging pass goes to
+    whichever FRAME reachable from there frees up first (see :class:`Stations`).
+    Registered, each is one declared dependency, so ``stations`` can only name
+    device 0.
+
+    With ``order`` ``"shortest_first"``, the slides with the least physical work
+    left are started first, as estimated by the :class:`DurationModel` from the
+    durations measured in earlier calls and runs (and, with ``plateau_tolerance``,
+    the rounds their protocol took to plateau). Slides it cannot estimate yet keep
+    their order, after the others. ``state.slide_eta`` holds the expected
+    completion of each slide, refreshed after every imaging round.
+    """
+    _check_order(order)
+    segmenter = memoized(
+        with_call_policies(compute_pool(segmenter, SegmenterLike, state), SegmenterLike, state),
+        SegmenterLike,
+    )
+    coordinate_corrector = latency_recorder.instrument(
+        coordinate_corrector, CorrectCoordinateSystemDevLike, state
+    )
+    warn_untaught_wells(state, loaded_slides)
+    if stations is None and not any(
+        isinstance(device, (list, tuple)) for device in (robot, opentrons, microscope)
+    ):
+        workcell = Workcell(
+            latency_recorder.instrument(robot, FairinoLike, state),
+            latency_recorder.instrument(opentrons, OT2Like, state),
+            latency_recorder.instrument(microscope, FrameLike, state),
+            state.devices,
+            state.focus_maps,
+            state.motion_profiles,
+            deck_capacity=deck_capacity,
+            batch_window=protocol_batch_window,
+        )
+        workcells = Stations([workcell], [Station()])
+    else:
+        workcells = Stations.build(
+            [latency_recorder.instrument(r, FairinoLike, state) for r in _as_list(robot)],
+            [latency_recorder.instrument(o, OT2Like, state) for o in _as_list(opentrons)],
+            [latency_recorder.instrument(m, FrameLike, state) for m in _as_list(microscope)],
+            stations,
+            state,
+            deck_capacity=deck_capacity,
+            batch_window=protocol_batch_window,
+        )
+    scheduled = [(slide, workcells.deck_of(slide, i)) for i, slide in enumerate(loaded_slides)]
+    pipeline = _Pipeline()
+    batcher = SegmentationBatcher(segmenter, window=segmentation_window)
+    journal = RunJournal(journal_path)
+    # Cell counts per slide and imaging round; ``state.cell_counts`` lists them in round order.
+    counts: Dict[str, Dict[int, int]] = defaultdict(dict)
+    if resume:
+        if journal_path is None:
+            raise ValueError("Resuming a run needs the journal_path it was started with.")
+        replayed = journal.replay()
+        for name, progress in replayed.items():
+            state.staining_rounds[name] = progress.protocols_done
+            if progress.cell_counts:
+                counts[name].update(progress.cell_counts)
+                state.cell_counts[name] = list(progress.cell_counts.values())
+            if progress.converged_after is not None:
+                state.converged_after[name] = progress.converged_after
+    else:
+        replayed = {}
+        journal.start()
+
+    def work_left(slide: Slide, rounds_done: int, protocols_done: int) -> Optional[float]:
+        rounds: float = max_iterations
+        if plateau_tolerance is not None:
+            rounds = expected_rounds(duration_model, "run_stainstorm_7", slide, max_iterations)
+        return expected_duration(
+            duration_model,
+            slide,
+            max(0.0, rounds - protocols_done),
+            max(0.0, rounds + 1 - rounds_done),
+        )
+
+    def finished(slide: Slide, rounds: int) -> None:
+        state.slide_eta[slide.name] = time.time()
+        if plateau_tolerance is not None:
+            duration_model.observe(rounds_key("run_stainstorm_7", slide.protocol), rounds)
+
+    async def analyze(slide: Slide, round_: int, well: str, stage: Stage) -> list[Image]:
+        corrected = await invert_stage_axes(stage, "x", coordinate_corrector, state)
+        cells, _, _ = await batcher.segment(corrected, diameter=13, gpu=True)
+        journal.record(slide.name, round_, "segment", well=well, id=_ref(cells))
+        pipeline.emit(cells)
+        return [cells]
+
+    async def report(analyses: list["asyncio.Task[list[Image]]"], message: str) -> None:
+        await asyncio.gather(*analyses)
+        log(message)
+
+    async def measure(
+        slide: Slide, round_: int, analyses: list["asyncio.Task[list[Image]]"]
+    ) -> None:
+        masks = [mask for masks in await asyncio.gather(*analyses) for mask in masks]
+        cells = sum(await asyncio.gather(*(asyncio.to_thread(count_cells, m) for m in masks)))
+        journal.record(slide.name, round_, "count", cells=cells)
+        counts[slide.name][round_] = cells
+        state.cell_counts[slide.name] = [n for _, n in sorted(counts[slide.name].items())]
+
+    async def scan(
+        workcell: Workcell, slide: Slide, round_: int, message: Optional[str] = None
+    ) -> Optional["asyncio.Task[None]"]:
+        # Each well's analysis starts as soon as it is scanned, so the next well is
+        # scanned while the previous one is corrected and segmented.
+        analyses = []
+        for well in slide.wells:
+            stage = await workcell.scan(
+                well, f"{slide.name}/{well}", focus_refinement_range, slide.plate_type
+            )
+            journal.record(slide.name, round_, "scan", well=well, id=_ref(stage))
+            pipeline.emit(stage)
+            analyses.append(pipeline.spawn(analyze(slide, round_, well, stage)))
+        if message:
+            pipeline.spawn(report(analyses, message))
+        if plateau_tolerance is None:
+            return None
+        return pipeline.spawn(measure(slide, round_, analyses))
+
+    async def load_masks(ids: Any) -> list[Image]:
+        return list(await asyncio.gather(*(aget_image(id) for id in _as_list(ids))))
+
+    async def recover(slide: Slide, progress: SlideProgress) -> list["asyncio.Task[None]"]:
+        # Segment the scans of completed rounds whose masks were lost, and count the
+        # cells of completed rounds whose count was lost; scans of an unfinished
+        # round are repeated instead.
+        analyses: Dict[int, list["asyncio.Task[list[Image]]"]] = defaultdict(list)
+        for (round_, well), stage_id in progress.stages.items():
+            if round_ >= progress.rounds_done:
+                continue
+            if (round_, well) not in progress.masks:
+                stage = await aget_stage(stage_id)
+                analyses[round_].append(pipeline.spawn(analyze(slide, round_, well, stage)))
+            elif plateau_tolerance is not None and round_ not in progress.cell_counts:
+                analyses[round_].append(pipeline.spawn(load_masks(progress.masks[round_, well])))
+        if plateau_tolerance is None:
+            return []
+        return [
+            pipeline.spawn(measure(slide, round_, tasks))
+            for round_, tasks in analyses.items()
+            if round_ not in progress.cell_counts
+        ]
+
+    async def process(slide: Slide, deck: int) -> None:
+        progress = replayed.get(slide.name, SlideProgress())
+        recovered = await recover(slide, progress)
+        if progress.converged_after is not None:
+            return
+        # The plateau check waits for the counts of recovered rounds, too.
+        measured: Optional[Awaitable[Any]] = asyncio.gather(*recovered) if recovered else None
+        workcell = workcells.at_deck(deck)
+        update_eta(state, slide, work_left(slide, progress.rounds_done, progress.protocols_done))
+
+        for round_ in range(progress.rounds_done, max_iterations + 1):
+            if round_ and plateau_tolerance is not None:
+                # Decided with the slide back on the deck, so the FRAME is free meanwhile.
+                if measured is not None:
+                    await measured
+                if has_plateaued(state.cell_counts.get(slide.name, []), plateau_tolerance):
+                    state.converged_after[slide.name] = round_ - 1
+                    journal.record(slide.name, round_ - 1, "converged")
+                    finished(slide, round_ - 1)
+                    log(
+                        f"Slide {slide.name}: cell count plateaued after {round_ - 1} "
+                        f"round(s); skipping the remaining {max_iterations - round_ + 1}."
+                    )
+                    return
+            if round_ > progress.protocols_done:
+                await workcell.run_protocol(slide.protocol)
+                journal.record(slide.name, round_, "protocol")
+                state.staining_rounds[slide.name] = round_
+            workcell = await workcells.load_frame(slide, deck)
+            message = f"Slide {slide.name}: iteration {round_} complete." if round_ else None
+            measured = await scan(workcell, slide, round_, message)
+            await workcells.unload_frame(workcell, slide)
+            journal.record(slide.name, round_, "round")
+            update_eta(state, slide, work_left(slide, round_ + 1, round_))
+        finished(slide, max_iterations)
+
+    if order == SlideOrder.SHORTEST_FIRST:
+        # Slides queue for the devices in the order they are started.
+        def start_order(item: tuple[Slide, int]) -> float:
+            progress = replayed.get(item[0].name, SlideProgress())
+            return _shortest_first(
+                work_left(item[0], progress.rounds_done, progress.protocols_done)
+            )
+
+        scheduled.sort(key=start_order)
+
+    publisher = CoalescingPublisher(get_current_publisher(), state_publish_interval)
+    with publisher:
+        for slide, deck in scheduled:
+            pipeline.spawn(process(slide, deck))
+
+    try:
+        async for result in pipeline.stream():
+            yield result
+    finally:
+        batcher.close()
+        publisher.flush()
+        duration_model.save()
+        await call_cache.flush()
+
+
+@register
+async def run_concurrent_staining_6(
+    robot: FairinoLike,
+    opentrons: OT2Like,
+    microscope: FrameLike,
+    stitcher: StitchLike,
+    segmenter: SegmenterLike,
+    state: AppState,
+    loaded_slides: list[Slide],
+    target_stain_percentage: float = 0.8,
+    stain_channel: int = 0,
+    stain_contrast: float = DEFAULT_STAIN_CONTRAST,
+    max_rounds: int = 5,
+    max_in_flight: int = 4,
+    segmentation_window: float = DEFAULT_SEGMENTATION_WINDOW,
+    focus_refinement_range: Optional[int] = None,
+    warm_stitching: bool = False,
+    deck_capacity: int = 1,
+    state_publish_interval: float = DEFAULT_STATE_PUBLISH_INTERVAL,
+    history_per_slide: int = DEFAULT_HISTORY_PER_SLIDE,
+    max_history_entries: int = DEFAULT_HISTORY_ENTRIES,
+    order: str = SlideOrder.SHORTEST_FIRST,
+) -> AsyncGenerator[Image, None]:
+    """Concurrent staining workflow with an internal task-tracking scheduler.
+
+    The robot and single microscope are a serial bottleneck, so only one slide is
+    ever physically handled at a time. The expensive compute -- stitching the tile
+    grid, Cellpose segmentation, stain quantification -- is independent per slide
+    and is fired off as a background ``asyncio`` task the moment a slide's tiles
+    are acquired. While those tasks run on the agent fleet, the robot keeps moving
+    the next slide. At most ``max_in_flight`` analyses are on the fleet at once;
+    further ones queue locally without holding up the physical path. Identical
+    segmentation requests share one Cellpose call (see :class:`SegmentationBatcher`).
+    With ``focus_refinement_range`` set, a
+    well re-imaged straight after its own previous scan is scanned with that
+    narrow autofocus range, which only happens with a single single-well slide. With
+    ``warm_stitching``, a re-imaged well whose tile grid is unchanged is stitched
+    with a narrow registration search around the nominal tile step, which is only
+    safe on a stage that repeats its positions to a few pixels (see
+    :class:`StitchCache`). With a
+    ``deck_capacity`` above one, every queued slide due for the same protocol is
+    stained by a single run of it. Changes to ``state`` are published at most
+    every ``state_publish_interval`` seconds, each changed value once.
+
+    Each of a slide's wells is analyzed as soon as it is scanned, and its stained
+    fraction is measured in the agent (see :func:`quantify_stain`): the share of
+    its cells whose mean intensity in ``stain_channel`` is at least
+    ``stain_contrast`` times the background's. Once all of them are in (in
+    completion order, not slide order) we check whether the slide is
+    *under*-stained (its least-stained well has too few stained cells,
+    ``percentage < target_stain_percentage``). If so the slide is queued for a
+    staining run on the Opentrons and then re-imaged, up to ``max_rounds`` times.
+
+    Every transition is mirrored into the published ``AppState`` so observers can
+    follow each slide moving through queued -> imaging -> analyzing -> staining ->
+    done, along with its staining-round count and latest stitched/segmented images,
+    and every remote call is timed into ``state.call_latency``. The last
+    ``history_per_slide`` stitched and segmented pairs of each slide are kept in
+    ``state.image_history``. Past ``max_history_entries`` pairs in total, the
+    slides that are done are forgotten, least recently imaged first. Called from
+    Python, ``stitcher`` and ``segmenter`` may also be lists of instances, in which
+    case each call goes to the least loaded of them (see :class:`ComputePool`).
+    Registered, each is one declared dependency and its pool has a single instance.
+
+    With ``order`` ``"shortest_first"``, the robot always takes on the queued op of
+    the slide with the least work left, as estimated by the :class:`DurationModel`
+    from measured call durations and the rounds each protocol took in earlier runs;
+    ops it cannot estimate yet are taken in turn, after the others.
+    ``state.slide_eta`` holds the expected completion of each slide.
     """
+    _check_order(order)
+    if history_per_slide < 1:
+        raise ValueError("history_per_slide must keep at least one record.")
+    robot = latency_recorder.instrument(robot, FairinoLike, state)
+    opentrons = latency_recorder.instrument(opentrons, OT2Like, state)
+    microscope = latency_recorder.instrument(microscope, FrameLike, state)
+    stitcher = memoized(
+        with_call_policies(compute_pool(stitcher, StitchLike, state), StitchLike, state),
+        StitchLike,
+    )
+    segmenter = memoized(
+        with_call_policies(compute_pool(segmenter, SegmenterLike, state), SegmenterLike, state),
+        SegmenterLike,
+    )
+
+    for slide in loaded_slides:
+        if not slide.wells:
+            raise ValueError(f"Slide {slide.name} has no wells to scan.")
+
+    rounds: dict[str, int] = {slide.name: 0 for slide in loaded_slides}
+    for slide in loaded_slides:
+        state.slide_status[slide.name] = SlideStatus.QUEUED
+        state.staining_rounds[slide.name] = 0
+
+    warn_untaught_wells(state, loaded_slides)
+    workcell = Workcell(
+        robot, opentrons, microscope, state.devices, state.focus_maps, state.motion_profiles
+    )
+    pipeline = _Pipeline()
+    compute_slots = asyncio.Semaphore(max_in_flight)
+    batcher = SegmentationBatcher(segmenter, window=segmentation_window)
+    stitch_cache = StitchCache()
+    # Serial physical work queue: ("image", slide) or ("stain", slide); ``None``
+    # once every slide is done.
+    physical: asyncio.Queue[Optional[tuple[str, Slide]]] = asyncio.Queue()
+    for slide in loaded_slides:
+        physical.put_nowait(("image", slide))
+    remaining = len(loaded_slides)
+    if not remaining:
+        physical.put_nowait(None)
+
+    analysis = (
+        f"{_declared_app(StitchLike)}.stitch_stage",
+        f"{_declared_app(SegmenterLike)}.run_cellpose_SAM",
+    )
+
+    def work_left(slide: Slide, staining: bool) -> Optional[float]:
+        # A queued staining run comes on top of the rounds the slide is expected to take.
+        rounds_ = expected_rounds(duration_model, "run_concurrent_staining_6", slide, max_rounds)
+        left = max(0.0, rounds_ - rounds[slide.name])
+        return expected_duration(duration_model, slide, left + staining, left + 1, analysis)
 
     for slide in loaded_slides:
-        microscope.homeStageAxis()
-        robot.init_robot_and_gripper()
-        robot.pick_up_opentrons(slide.name)
-        robot.release_at_frame(slide.name)
-
-        frame1_before = microscope.run_well_tile_scan(well_id="A1")
-        yield frame1_before
-        # frame2_before = microscope.run_well_tile_scan(well_id="A2")
-        # yield frame2_before
-        frame1_before = coordinate_corrector.invert_x_axis(frame1_before)
-        cells_before, _, _ = segmenter.run_cellpose_SAM(frame1_before, diameter=13, gpu=True)
-        yield cells_before
-        # frame2_before = coordinate_corrector.invert_x_axis(frame2_before)
-        # cells2_before, _, _ = segmenter.run_cellpose_SAM(frame2_before)
-        # yield cells2_before
-
-        for iteration in range(max_iterations):
-            microscope.homeStageAxis()
-            robot.pick_up_frame(slide.name)
-            robot.release_at_opentrons(slide.name)
-            _run_protocol(opentrons, slide.protocol)
-            robot.pick_up_opentrons(slide.name)
-            robot.release_at_frame(slide.name)
-
-            frame1_after = microscope.run_well_tile_scan(well_id="A1")
-            yield frame1_after
-            # frame2_after = microscope.run_well_tile_scan(well_id="A2")
-            # yield frame2_after
-            frame1_after = coordinate_corrector.invert_x_axis(frame1_after)
-            cells1_after, _, _ = segmenter.run_cellpose_SAM(frame1_after, diameter=13, gpu=True)
-            yield cells1_after
-            # frame2_after = coordinate_corrector.invert_x_axis(frame2_after)
-            # cells2_after, _, _ = segmenter.run_cellpose_SAM(frame2_after)
-            # yield cells2_after
-
-            log(f"Iteration {iteration + 1} complete.")
-
-        robot.pick_up_frame(slide.name)
-
-
-# @register
-# def run_concurrent_staining_6(
-#     robot: FairinoLike,
-#     opentrons: OT2Like,
-#     microscope: FrameLike,
-#     stitcher: StitchLike,
-#     segmenter: SegmenterLike,
-#     # analyzer: AnalyzerLike,
-#     state: AppState,
-#     loaded_slides: list[Slide],
-#     target_stain_percentage: float = 0.8,
-#     max_rounds: int = 5,
-# ) -> AsyncGenerator[Image, None]:
-#     """Concurrent staining workflow with an internal task-tracking scheduler.
-
-#     The robot and single microscope are a serial bottleneck, so only one slide is
-#     ever physically handled at a time. The expensive compute -- stitching the tile
-#     grid, Cellpose segmentation, stain quantification -- is independent per slide
-#     and is fired off as a background ``asyncio`` task the moment a slide's tiles
-#     are acquired. While those tasks run on the agent fleet, the robot keeps moving
-#     the next slide.
-
-#     The loop below keeps track of the in-flight compute tasks. As each analysis
-#     finishes we check whether the slide is *under*-stained (too few stained cells,
-#     ``percentage < target_stain_percentage``). If so the slide is queued for a
-#     staining run on the Opentrons and then re-imaged, up to ``max_rounds`` times.
-
-#     Every transition is mirrored into the published ``AppState`` so observers can
-#     follow each slide moving through queued -> imaging -> analyzing -> staining ->
-#     done, along with its staining-round count and latest stitched/segmented images.
-#     """
-
-#     rounds: dict[str, int] = {slide.name: 0 for slide in loaded_slides}
-#     for slide in loaded_slides:
-#         state.slide_status[slide.name] = SlideStatus.QUEUED
-#         state.staining_rounds[slide.name] = 0
-
-#     # Serial physical work queue: ("image", slide) or ("stain", slide).
-#     physical: deque[tuple[str, Slide]] = deque(
-#         ("image", slide) for slide in loaded_slides
-#     )
-#     # In-flight stitch -> segment -> analyze tasks, keyed to their slide.
-#     compute: dict[asyncio.Task[tuple[Image, Image, float]], Slide] = {}
-
-#     async def analyze(stage: StageRef) -> tuple[Image, Image, float]:
-#         """Offloaded compute: stitch the tiles, segment with Cellpose, measure stain."""
-#         stitched = await stitcher.stitch_stage(stage)
-#         cells, _, _ = await segmenter.run_cellpose_SAM(stitched)
-#         # percentage = await analyzer.calculate_stain_percentage(cells)
-#         return stitched, cells, 60
-
-#     async def image_slide(slide: Slide) -> None:
-#         """Serial physical op: place slide on frame, run tile scan, pick it back up."""
-#         state.currently_imaging_slide = slide.name
-#         state.slide_status[slide.name] = SlideStatus.IMAGING
-#         await robot.release_at_frame(slide.name)
-#         stage = await microscope.run_well_tileScan(well_id=slide.well_id)
-#         await robot.pick_up_frame(slide.name)
-#         state.currently_imaging_slide = None
-#         state.slide_status[slide.name] = SlideStatus.ANALYZING
-#         compute[asyncio.ensure_future(analyze(stage))] = slide
-
-#     async def stain_slide(slide: Slide) -> None:
-#         """Serial physical op: carry the slide to the Opentrons and stain it."""
-#         state.slide_status[slide.name] = SlideStatus.STAINING
-#         await robot.release_at_opentrons(slide.name)
-#         await _run_protocol(opentrons, slide.protocol)
-#         await robot.pick_up_opentrons(slide.name)
-
-#     while physical or compute:
-#         # 1. Harvest any compute that has finished and decide on more staining.
-#         for task in [t for t in compute if t.done()]:
-#             slide = compute.pop(task)
-#             stitched, segmented, percentage = task.result()
-#             state.latest_images[slide.name] = stitched
-#             state.latest_segmented[slide.name] = segmented
-#             yield stitched
-#             yield segmented
-
-#             if percentage < target_stain_percentage and rounds[slide.name] < max_rounds:
-#                 rounds[slide.name] += 1
-#                 state.staining_rounds[slide.name] = rounds[slide.name]
-#                 log(
-#                     f"Slide {slide.name}: {percentage:.2%} stained -- staining "
-#                     f"(round {rounds[slide.name]})."
-#                 )
-#                 physical.append(("stain", slide))
-#             else:
-#                 state.slide_status[slide.name] = SlideStatus.DONE
-#                 log(f"Slide {slide.name}: {percentage:.2%} stained -- done.")
-
-#         # 2. Run a single physical operation if one is queued; the hardware is
-#         #    serial so we only ever do one at a time, keeping the compute fleet
-#         #    busy in the background.
-#         if physical:
-#             op, slide = physical.popleft()
-#             if op == "image":
-#                 image_slide(slide)
-#             else:
-#                 stain_slide(slide)
-#                 physical.append(("image", slide))  # re-image after staining
-#         elif compute:
-#             # Nothing physical to do right now -- wait for the next analysis.
-#             asyncio.wait(set(compute), return_when=asyncio.FIRST_COMPLETED)
+        update_eta(state, slide, work_left(slide, staining=False))
+
+    async def analyze_well(slide: Slide, well: str, stage: StageRef) -> float:
+        """Offloaded compute: stitch the tiles, segment with Cellpose, measure stain."""
+        async with compute_slots:
+            settings = stitch_cache.settings(slide.name, well, stage) if warm_stitching else {}
+            stitched = await _acall(stitcher.stitch_stage, stage, **settings)
+            stitch_cache.stitched(slide.name, well, stage)
+            cells, _, _ = await batcher.segment(stitched)
+            quantified = await quantify_stain(stitched, cells, stain_channel, stain_contrast)
+            percentage = quantified.stained_fraction
+
+        state.latest_images[slide.name] = stitched
+        state.latest_segmented[slide.name] = cells
+        record_history(
+            state,
+            slide.name,
+            ImageRecord(round=rounds[slide.name], well=well, stitched=stitched, segmented=cells),
+            history_per_slide,
+            max_history_entries,
+        )
+        pipeline.emit(stitched)
+        pipeline.emit(cells)
+        return percentage
+
+    async def conclude(slide: Slide, wells: list["asyncio.Task[float]"]) -> None:
+        """Restain the slide if its least-stained well is under target, else finish it."""
+        nonlocal remaining
+        percentage = min(await asyncio.gather(*wells))
+
+        if percentage < target_stain_percentage and rounds[slide.name] < max_rounds:
+            rounds[slide.name] += 1
+            state.staining_rounds[slide.name] = rounds[slide.name]
+            log(
+                f"Slide {slide.name}: {percentage:.2%} stained -- staining "
+                f"(round {rounds[slide.name]})."
+            )
+            update_eta(state, slide, work_left(slide, staining=True))
+            physical.put_nowait(("stain", slide))
+        else:
+            state.slide_status[slide.name] = SlideStatus.DONE
+            state.slide_eta[slide.name] = time.time()
+            duration_model.observe(
+                rounds_key("run_concurrent_staining_6", slide.protocol), rounds[slide.name]
+            )
+            evict_done_slides(state, max_history_entries)
+            log(f"Slide {slide.name}: {percentage:.2%} stained -- done.")
+            remaining -= 1
+            if not remaining:
+                physical.put_nowait(None)
+
+    async def image_slide(slide: Slide) -> None:
+        """Serial physical op: place slide on frame, scan each well, put it back."""
+        state.currently_imaging_slide = slide.name
+        state.slide_status[slide.name] = SlideStatus.IMAGING
+        await workcell.load_frame(slide)
+        wells = []
+        for well in slide.wells:
+            stage = await workcell.scan(
+                well, f"{slide.name}/{well}", focus_refinement_range, slide.plate_type
+            )
+            wells.append(pipeline.spawn(analyze_well(slide, well, stage)))
+        await workcell.unload_frame(slide)
+        state.currently_imaging_slide = None
+        state.slide_status[slide.name] = SlideStatus.ANALYZING
+        pipeline.spawn(conclude(slide, wells))
+
+    async def stain_slides(slides: list[Slide]) -> None:
+        """Serial physical op: run the slides' common protocol on the Opentrons once."""
+        for slide in slides:
+            state.slide_status[slide.name] = SlideStatus.STAINING
+        await workcell.run_protocol(slides[0].protocol)
+
+    def take_queued_stains(protocol: str, limit: int) -> list[Slide]:
+        """Pull up to ``limit`` queued stain ops for ``protocol``, keeping the rest in order."""
+        queued: list[Optional[tuple[str, Slide]]] = []
+        while not physical.empty():
+            queued.append(physical.get_nowait())
+        taken: list[Slide] = []
+        for item in queued:
+            due = item is not None and item[0] == "stain" and item[1].protocol == protocol
+            if due and len(taken) < limit:
+                taken.append(item[1])  # type: ignore[index]
+            else:
+                physical.put_nowait(item)
+        return taken
+
+    async def next_op() -> Optional[tuple[str, Slide]]:
+        """The queued op of the slide with the least work left, first come on a tie."""
+        item = await physical.get()
+        if item is None or order == SlideOrder.LOADED:
+            return item
+        queued = [item]
+        while not physical.empty():
+            queued.append(physical.get_nowait())  # type: ignore[arg-type]
+        chosen = min(
+            queued, key=lambda op: _shortest_first(work_left(op[1], staining=op[0] == "stain"))
+        )
+        for other in queued:
+            if other is not chosen:
+                physical.put_nowait(other)
+        return chosen
+
+    async def run_physical() -> None:
+        """Work through the physical queue one op at a time until all slides are done."""
+        while (item := await next_op()) is not None:
+            op, slide = item
+            if op == "image":
+                await image_slide(slide)
+            else:
+                batch = [slide, *take_queued_stains(slide.protocol, deck_capacity - 1)]
+                await stain_slides(batch)
+                for stained in batch:
+                    physical.put_nowait(("image", stained))  # re-image after staining
+
+    publisher = CoalescingPublisher(get_current_publisher(), state_publish_interval)
+    with publisher:
+        pipeline.spawn(run_physical())
+    try:
+        async for result in pipeline.stream():
+            yield result
+    finally:
+        batcher.close()
+        publisher.flush()
+        duration_model.save()
+        await call_cache.flush()
+
+
+@register
+def estimate_stainstorm_7(loaded_slides: list[Slide], max_iterations: int = 5) -> float:
+    """Roughly predict how many seconds ``run_stainstorm_7`` takes, without moving any hardware.
+
+    The run is dry-run as a :func:`stainstorm_plan` with the durations learned so
+    far; its critical path is logged, along with the calls that were never timed.
+    The plan leaves out protocol batching, early convergence and focus
+    refinement, so it tends to overestimate runs that use them.
+    """
+    estimate = estimate_plan(stainstorm_plan(loaded_slides, max_iterations))
+    log(
+        f"Predicted makespan {estimate.makespan:.0f} s; critical path: "
+        f"{' -> '.join(estimate.critical_path)}."
+    )
+    if estimate.unmeasured:
+        log(f"Not timed yet, counted as instant: {', '.join(estimate.unmeasured)}.")
+    return estimate.makespan
+
+
+@register
+def clear_call_cache(method: Optional[str] = None, input_id: Optional[str] = None) -> int:
+    """Forget memoized compute results, so those calls run again next time.
+
+    ``method`` ('app.method', e.g. 'cellpose-ARK.run_cellpose_SAM') and ``input_id``
+    (the id of a stage or image a call took) narrow down what is forgotten; without
+    either, everything is. Returns how many results were forgotten.
+    """
+    return call_cache.invalidate(call=method, input_id=input_id)
+
+
+@register
+def reset_device_state(state: AppState) -> None:
+    """Forget what is known about the robot and the microscope stage.
+
+    Use this after moving a device by hand: the next workflow run initializes the
+    robot and gripper and homes the stage again before using them, and every well
+    is focused with a full sweep again.
+    """
+    state.devices = DeviceState()
+    state.station_devices = {}
+    state.focus_maps = {}
+
+
+@register
+def set_motion_profile(
+    state: AppState,
+    leg: str,
+    sample_type: Optional[str] = None,
+    speed: Optional[int] = None,
+    acceleration: Optional[int] = None,
+    danger_speed: Optional[int] = None,
+) -> None:
+    """Set the robot's speed, acceleration and final-approach speed for one transfer leg.
+
+    ``leg`` is one of pick_up_opentrons, release_at_frame, pick_up_frame and
+    release_at_opentrons. With a ``sample_type`` the profile only applies to slides
+    of that type. Leaving every value unset removes the profile again.
+    """
+    if leg not in ROBOT_LEGS:
+        raise ValueError(f"Unknown robot leg {leg!r}; expected one of {', '.join(ROBOT_LEGS)}.")
+    key = leg if sample_type is None else f"{leg}/{sample_type}"
+    profile = MotionProfile(speed=speed, acceleration=acceleration, danger_speed=danger_speed)
+    if profile == MotionProfile():
+        state.motion_profiles.pop(key, None)
+    else:
+        state.motion_profiles[key] = profile
+
+
+@register
+def save_first_well_corner(microscope: FrameTeachingLike, state: AppState) -> None:
+    """Save the current stage position as the first corner of the well being taught.
+
+    Move the stage to one corner of the well, call this, then move to the opposite
+    corner and call ``save_second_well_corner``.
+    """
+    position = microscope.saveFirstWellCorner()
+    state.pending_well_corner = [position.x, position.y, position.z]
+
+
+@register
+def save_second_well_corner(
+    microscope: FrameTeachingLike,
+    state: AppState,
+    well_id: str,
+    plate_type: Optional[str] = None,
+) -> WellGeometry:
+    """Commit the well bounds on the FRAME and log both corners in the well registry."""
+    if state.pending_well_corner is None:
+        raise ValueError("Save the first corner of the well before the second one.")
+    position = microscope.getStagePosition()
+    microscope.saveSecondWellCorner(well_id=well_id, plate_type=plate_type)
+    geometry = well_registry.teach(
+        plate_type, well_id, state.pending_well_corner, [position.x, position.y, position.z]
+    )
+    state.well_geometry[well_key(plate_type, well_id)] = geometry
+    state.pending_well_corner = None
+    return geometry
 
 
 if __name__ == "__main__":
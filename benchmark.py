@@ -0,0 +1,613 @@
+"""Virtual-clock makespan benchmark for the StainStorm workflows.
+
+Runs the registered workflows against timed local stand-ins for every declared
+app. The stand-ins ``await asyncio.sleep`` for a configurable (optionally
+jittered) duration per call, and the whole run happens on an event loop whose
+clock only advances when every coroutine is waiting -- so hours of simulated
+hardware time take milliseconds.
+
+    uv run python benchmark.py --slides 6 --iterations 5
+
+For each workflow the report lists the makespan and, per device, its busy time,
+utilization and the idle gaps in between.
+
+The stand-ins are ``async def`` on purpose: synchronous calls are pushed onto a
+worker thread by the workflows, and a thread does not advance the virtual clock.
+"""
+
+import argparse
+import asyncio
+import random
+import selectors
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+import app
+from app import Slide
+
+
+# --- Virtual clock ----------------------------------------------------------
+
+
+class _VirtualSelector:
+    """Wraps the loop's selector so waiting for a timer advances virtual time."""
+
+    def __init__(self, selector: selectors.BaseSelector, loop: "VirtualClockLoop") -> None:
+        self._selector = selector
+        self._loop = loop
+
+    def select(self, timeout: Optional[float] = None) -> list:
+        events = self._selector.select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # Nothing is scheduled; only real I/O (e.g. a worker thread) can help.
+            return self._selector.select(None)
+        self._loop.advance(timeout)
+        return []
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._selector, name)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """An event loop whose ``time()`` jumps straight to the next scheduled timer."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._now = 0.0
+        self._selector = _VirtualSelector(self._selector, self)  # type: ignore[assignment]
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float) -> None:
+        """Move the virtual clock forward by ``seconds``."""
+        self._now += seconds
+
+
+def run_virtual(coro: Any) -> Any:
+    """Run ``coro`` to completion on a fresh :class:`VirtualClockLoop`."""
+    with asyncio.Runner(loop_factory=VirtualClockLoop) as runner:
+        return runner.run(coro)
+
+
+# --- Timed stand-ins for the declared apps ----------------------------------
+
+
+# Seconds per call, keyed by "device.method".
+DEFAULT_DURATIONS: Dict[str, float] = {
+    "robot.init_robot_and_gripper": 30.0,
+    "robot.pick_up_opentrons": 20.0,
+    "robot.release_at_opentrons": 20.0,
+    "robot.pick_up_frame": 20.0,
+    "robot.release_at_frame": 20.0,
+    "robot.open_grip": 2.0,
+    "robot.close_grip": 2.0,
+    "robot.home_robot": 15.0,
+    "opentrons.run_washing_protocol": 1200.0,
+    "opentrons.run_staining_protocol": 1200.0,
+    "opentrons.run_dummy_protocol": 60.0,
+    "microscope.homeStageAxis": 15.0,
+    "microscope.saveFirstWellCorner": 1.0,
+    "microscope.saveSecondWellCorner": 1.0,
+    "microscope.previewWell": 20.0,
+    "microscope.run_well_tile_scan": 300.0,
+    "coordinate_corrector.invert_x_axis": 5.0,
+    "coordinate_corrector.invert_y_axis": 5.0,
+    "coordinate_corrector.invert_xy_axes": 5.0,
+    "mikro.acreate_stage": 0.5,
+    "mikro.aget_image": 1.0,
+    "mikro.afrom_array_like": 1.0,
+    "mikro.aget_stage": 0.5,
+    "segmenter.run_cellpose_SAM": 120.0,
+    "stitcher.stitch_stage": 180.0,
+    "agent.quantify_stain": 30.0,
+}
+
+
+class SimFleet:
+    """A full set of timed stand-ins sharing one duration table and busy log.
+
+    ``durations`` overrides entries of :data:`DEFAULT_DURATIONS`; every call takes
+    its duration scaled by a uniform factor in ``1 +/- jitter``, drawn from a
+    generator seeded with ``seed`` so runs are reproducible. There are
+    ``segmenters`` and ``stitchers`` instances of the compute apps, logged as
+    ``segmenter``, ``segmenter-2``, ... and timed alike; like a GPU node, each of
+    them runs one call at a time. With ``stations`` above one, the robot serves
+    that many Opentrons and FRAMEs, named the same way. Scans come back as
+    :class:`SimStage` grids of ``tiles`` x ``tiles`` views, which the agent
+    reads and registers through the timed mikro calls of :class:`SimMikro`.
+    """
+
+    def __init__(
+        self,
+        durations: Optional[Dict[str, float]] = None,
+        jitter: float = 0.0,
+        seed: int = 0,
+        segmenters: int = 1,
+        stitchers: int = 1,
+        stations: int = 1,
+        tiles: int = 2,
+    ) -> None:
+        self.tiles = tiles
+        self.durations = {**DEFAULT_DURATIONS, **(durations or {})}
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.intervals: Dict[str, list[tuple[float, float]]] = defaultdict(list)
+        self.calls: list[str] = []
+        self.robot = SimRobot(self, "robot")
+        self.decks = [
+            SimOT2(self, _instance_name("opentrons", i), "opentrons") for i in range(stations)
+        ]
+        self.frames = [
+            SimFrame(self, _instance_name("microscope", i), "microscope") for i in range(stations)
+        ]
+        self.opentrons = self.decks[0]
+        self.microscope = self.frames[0]
+        self.coordinate_corrector = SimCorrector(self, "coordinate_corrector")
+        self.segmenters = [
+            SimSegmenter(self, _instance_name("segmenter", i), "segmenter")
+            for i in range(segmenters)
+        ]
+        self.stitchers = [
+            SimStitcher(self, _instance_name("stitcher", i), "stitcher") for i in range(stitchers)
+        ]
+        self.segmenter = self.segmenters[0]
+        self.stitcher = self.stitchers[0]
+        self.agent = SimAgent(self, "agent")
+        self.mikro = SimMikro(self, "mikro")
+
+    async def work(self, device: str, method: str, kind: Optional[str] = None) -> int:
+        """Spend the (jittered) duration of ``kind.method`` on the virtual clock.
+
+        The busy time is logged for ``device``, an instance of ``kind`` (by default
+        ``device`` itself).
+        """
+        key = f"{kind or device}.{method}"
+        duration = self.durations[key]
+        if self.jitter:
+            duration *= 1 + self.rng.uniform(-self.jitter, self.jitter)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.calls.append(key)
+        await asyncio.sleep(duration)
+        self.intervals[device].append((start, loop.time()))
+        return len(self.calls)
+
+
+def _instance_name(kind: str, index: int) -> str:
+    return kind if index == 0 else f"{kind}-{index + 1}"
+
+
+class _SimDevice:
+    def __init__(self, fleet: SimFleet, name: str, kind: Optional[str] = None) -> None:
+        self._fleet = fleet
+        self._name = name
+        self._kind = kind
+        # Instances of a ``kind`` run one call at a time.
+        self._serial = asyncio.Lock() if kind else None
+
+    async def _work(self, method: str) -> int:
+        if self._serial is None:
+            return await self._fleet.work(self._name, method, self._kind)
+        async with self._serial:
+            return await self._fleet.work(self._name, method, self._kind)
+
+
+class SimRobot(_SimDevice):
+    """Timed stand-in for ``FairinoLike``."""
+
+    async def release_at_opentrons(self, sample: str, speed: Optional[int] = None, acceleration: Optional[int] = None, dangerSpeed: Optional[int] = None) -> None:
+        await self._work("release_at_opentrons")
+
+    async def pick_up_opentrons(self, sample: str, speed: Optional[int] = None, acceleration: Optional[int] = None, dangerSpeed: Optional[int] = None) -> None:
+        await self._work("pick_up_opentrons")
+
+    async def release_at_frame(self, sample: str, speed: Optional[int] = None, acceleration: Optional[int] = None, dangerSpeed: Optional[int] = None) -> None:
+        await self._work("release_at_frame")
+
+    async def pick_up_frame(self, sample: str, speed: Optional[int] = None, acceleration: Optional[int] = None, dangerSpeed: Optional[int] = None) -> None:
+        await self._work("pick_up_frame")
+
+    async def init_robot_and_gripper(self) -> None:
+        await self._work("init_robot_and_gripper")
+
+    async def open_grip(self) -> None:
+        await self._work("open_grip")
+
+    async def close_grip(self) -> None:
+        await self._work("close_grip")
+
+    async def home_robot(self, move_speed: Optional[int] = None, acceleration: Optional[int] = None) -> None:
+        await self._work("home_robot")
+
+
+class SimOT2(_SimDevice):
+    """Timed stand-in for ``OT2Like``."""
+
+    async def run_washing_protocol(self) -> None:
+        await self._work("run_washing_protocol")
+
+    async def run_staining_protocol(self) -> None:
+        await self._work("run_staining_protocol")
+
+    async def run_dummy_protocol(self) -> None:
+        await self._work("run_dummy_protocol")
+
+
+class SimFrame(_SimDevice):
+    """Timed stand-in for ``FrameLike``."""
+
+    async def homeStageAxis(self, positionerName: Optional[str] = None, axis: Optional[str] = None, is_blocking: Optional[bool] = None) -> None:
+        await self._work("homeStageAxis")
+
+    async def saveFirstWellCorner(self, positionerName: Optional[str] = None) -> app.PositionModel:
+        await self._work("saveFirstWellCorner")
+        return app.PositionModel(x=0, y=0, z=0)
+
+    async def saveSecondWellCorner(self, well_id: str, plate_type: Optional[str] = None, positionerName: Optional[str] = None) -> None:
+        await self._work("saveSecondWellCorner")
+
+    async def previewWell(self, well_id: Optional[str] = None, **_: Any) -> str:
+        return f"preview-{await self._work('previewWell')}"
+
+    async def run_well_tile_scan(self, well_id: Optional[str] = None, **_: Any) -> "SimStage":
+        call = await self._work("run_well_tile_scan")
+        return SimStage.grid(f"stage-{call}", self._fleet.tiles)
+
+
+class SimCorrector(_SimDevice):
+    """Timed stand-in for ``CorrectCoordinateSystemDevLike``."""
+
+    async def invert_x_axis(self, stage: str) -> str:
+        return f"inverted-{await self._work('invert_x_axis')}"
+
+    async def invert_y_axis(self, stage: str) -> str:
+        return f"inverted-{await self._work('invert_y_axis')}"
+
+    async def invert_xy_axes(self, stage: str) -> str:
+        return f"inverted-{await self._work('invert_xy_axes')}"
+
+
+@dataclass
+class SimView:
+    image: "SimImage"
+    affine_matrix: list[list[float]]
+
+
+@dataclass
+class SimImage:
+    id: str
+    name: str
+    data: Any = None
+
+
+@dataclass
+class SimStage:
+    """A scanned stage: one affine view per tile of the well's grid."""
+
+    id: str
+    name: str
+    affine_views: list[SimView] = field(default_factory=list)
+
+    @classmethod
+    def grid(cls, id: str, tiles: int) -> "SimStage":
+        views = [
+            SimView(
+                image=SimImage(id=f"{id}/tile-{row}-{col}", name=f"tile-{row}-{col}"),
+                affine_matrix=[
+                    [1.0, 0.0, 0.0, col * 1000.0],
+                    [0.0, 1.0, 0.0, row * 1000.0],
+                    [0.0, 0.0, 1.0, 0.0],
+                    [0.0, 0.0, 0.0, 1.0],
+                ],
+            )
+            for row in range(tiles)
+            for col in range(tiles)
+        ]
+        return cls(id=id, name=id, affine_views=views)
+
+    def __str__(self) -> str:
+        return self.id
+
+
+class SimMikro(_SimDevice):
+    """Timed stand-in for the mikro calls the agent makes itself.
+
+    :func:`simulate` swaps these in for the ones ``app`` imported, so local axis
+    inversion runs (and is timed) instead of failing over to the remote corrector.
+    """
+
+    def __init__(self, fleet: SimFleet, name: str) -> None:
+        super().__init__(fleet, name)
+        self._stages: Dict[str, SimStage] = {}
+        self._images: Dict[str, SimImage] = {}
+
+    async def acreate_stage(self, name: str, **_: Any) -> SimStage:
+        call = await self._work("acreate_stage")
+        stage = self._stages[f"stage-{call}"] = SimStage(id=f"stage-{call}", name=name)
+        return stage
+
+    async def aget_image(self, id: str, **_: Any) -> SimImage:
+        await self._work("aget_image")
+        return self._images.get(id) or SimImage(id=id, name=id)
+
+    async def afrom_array_like(
+        self, data: Any, name: str, transformation_views: list[Any], **_: Any
+    ) -> SimImage:
+        call = await self._work("afrom_array_like")
+        image = self._images[f"image-{call}"] = SimImage(id=f"image-{call}", name=name, data=data)
+        for view in transformation_views:
+            self._stages[view.stage].affine_views.append(SimView(image, view.affine_matrix))
+        return image
+
+    async def aget_stage(self, id: str, **_: Any) -> SimStage:
+        await self._work("aget_stage")
+        return self._stages.get(id) or SimStage(id=id, name=id)
+
+
+class SimSegmenter(_SimDevice):
+    """Timed stand-in for ``SegmenterLike``."""
+
+    async def run_cellpose_SAM(self, image: str, **_: Any) -> tuple[str, str, str]:
+        call = await self._work("run_cellpose_SAM")
+        return f"mask-{call}", f"flows-{call}", f"styles-{call}"
+
+
+class SimStitcher(_SimDevice):
+    """Timed stand-in for ``StitchLike``."""
+
+    async def stitch_stage(self, stage: str, **_: Any) -> str:
+        return f"stitched-{await self._work('stitch_stage')}"
+
+
+class SimAgent(_SimDevice):
+    """Timed stand-in for the work the workflows do in the agent itself."""
+
+    async def quantify_stain(self, image: str, mask: str, *_: Any) -> app.StainQuantification:
+        await self._work("quantify_stain")
+        return app.StainQuantification(cells=0, stained_cells=0)
+
+
+# --- Workflows under test ---------------------------------------------------
+
+
+def _stainstorm_7(
+    fleet: SimFleet, slides: list[Slide], iterations: int, **options: Any
+) -> AsyncIterator[Any]:
+    return app.run_stainstorm_7(
+        robot=fleet.robot,
+        opentrons=fleet.decks if len(fleet.decks) > 1 else fleet.opentrons,
+        microscope=fleet.frames if len(fleet.frames) > 1 else fleet.microscope,
+        segmenter=fleet.segmenters,
+        coordinate_corrector=fleet.coordinate_corrector,
+        state=app.AppState(),
+        loaded_slides=slides,
+        max_iterations=iterations,
+        **options,
+    )
+
+
+def _concurrent_staining_6(
+    fleet: SimFleet, slides: list[Slide], iterations: int, **options: Any
+) -> AsyncIterator[Any]:
+    # An unreachable target makes every slide run exactly ``iterations`` rounds.
+    return app.run_concurrent_staining_6(
+        robot=fleet.robot,
+        opentrons=fleet.opentrons,
+        microscope=fleet.microscope,
+        stitcher=fleet.stitchers,
+        segmenter=fleet.segmenters,
+        state=app.AppState(),
+        loaded_slides=slides,
+        target_stain_percentage=float("inf"),
+        max_rounds=iterations,
+        **options,
+    )
+
+
+def _stainstorm_7_plan(
+    fleet: SimFleet, slides: list[Slide], iterations: int, **options: Any
+) -> AsyncIterator[Any]:
+    devices = {name: getattr(fleet, name) for name in app.PLAN_DEVICES}
+    return app.run_plan(app.stainstorm_plan(slides, iterations), devices, app.AppState())
+
+
+WORKFLOWS: Dict[str, Callable[..., AsyncIterator[Any]]] = {
+    "run_stainstorm_7": _stainstorm_7,
+    "run_concurrent_staining_6": _concurrent_staining_6,
+    "stainstorm_plan": _stainstorm_7_plan,
+}
+
+
+def plan_durations(durations: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """The fleet's durations keyed by ``app.method``, as :func:`app.estimate_plan` takes them."""
+    table = {**DEFAULT_DURATIONS, **(durations or {})}
+    keyed = {}
+    for key, seconds in table.items():
+        device, method = key.split(".", 1)
+        if device in app.PLAN_DEVICES:
+            keyed[f"{app._declared_app(app.PLAN_DEVICES[device])}.{method}"] = seconds
+    return keyed
+
+
+# --- Reporting --------------------------------------------------------------
+
+
+@dataclass
+class DeviceReport:
+    busy: float
+    utilization: float
+    idle_gaps: list[tuple[float, float]] = field(default_factory=list)
+
+
+@dataclass
+class BenchmarkReport:
+    workflow: str
+    slides: int
+    iterations: int
+    makespan: float
+    devices: Dict[str, DeviceReport]
+
+    def format(self) -> str:
+        lines = [
+            f"{self.workflow}: {self.slides} slides x {self.iterations} iterations",
+            f"  makespan {_hms(self.makespan)}",
+        ]
+        for name, device in sorted(self.devices.items()):
+            longest = max((end - start for start, end in device.idle_gaps), default=0.0)
+            lines.append(
+                f"  {name:<22} busy {_hms(device.busy)}  util {device.utilization:6.1%}"
+                f"  {len(device.idle_gaps):3d} idle gaps (longest {_hms(longest)})"
+            )
+        return "\n".join(lines)
+
+
+def _hms(seconds: float) -> str:
+    minutes, secs = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}"
+
+
+def _device_report(intervals: list[tuple[float, float]], makespan: float) -> DeviceReport:
+    """Merge overlapping busy intervals and derive utilization and idle gaps."""
+    merged: list[list[float]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    busy = sum(end - start for start, end in merged)
+    gaps: list[tuple[float, float]] = []
+    cursor = 0.0
+    for start, end in merged:
+        if start > cursor:
+            gaps.append((cursor, start))
+        cursor = end
+    if cursor < makespan:
+        gaps.append((cursor, makespan))
+    return DeviceReport(
+        busy=busy,
+        utilization=busy / makespan if makespan else 0.0,
+        idle_gaps=gaps,
+    )
+
+
+MIKRO_CALLS = ("acreate_stage", "aget_image", "afrom_array_like", "aget_stage")
+
+
+def simulate(
+    workflow: str,
+    slides: int,
+    iterations: int,
+    durations: Optional[Dict[str, float]] = None,
+    jitter: float = 0.0,
+    seed: int = 0,
+    protocol: str = "staining",
+    wells: int = 1,
+    segmenters: int = 1,
+    stitchers: int = 1,
+    stations: int = 1,
+    tiles: int = 2,
+    **options: Any,
+) -> BenchmarkReport:
+    """Run ``workflow`` on a fresh :class:`SimFleet` and report on the virtual clock.
+
+    Every slide gets ``wells`` wells (``A1``, ``A2``, ...); the workflow's calls
+    are spread over ``segmenters`` and ``stitchers`` compute instances and, for
+    ``run_stainstorm_7``, over ``stations`` Opentrons and FRAMEs. Each scan is a
+    ``tiles`` x ``tiles`` grid; ``options`` are passed on to the workflow.
+    """
+    fleet = SimFleet(
+        durations=durations,
+        jitter=jitter,
+        seed=seed,
+        segmenters=segmenters,
+        stitchers=stitchers,
+        stations=stations,
+        tiles=tiles,
+    )
+    well_ids = [f"A{j + 1}" for j in range(wells)]
+    loaded = [
+        Slide(name=f"slide-{i + 1}", protocol=protocol, wells=list(well_ids))
+        for i in range(slides)
+    ]
+
+    async def _run() -> float:
+        async for _ in WORKFLOWS[workflow](fleet, loaded, iterations, **options):
+            pass
+        return asyncio.get_running_loop().time()
+
+    # Stain quantification reads real image data, so the simulated agent times it instead.
+    quantify_stain, app.quantify_stain = app.quantify_stain, fleet.agent.quantify_stain
+    # Simulated durations and results must not leak into what the agent persists.
+    duration_model, app.duration_model = app.duration_model, app.DurationModel()
+    call_cache, app.call_cache = app.call_cache, app.CallCache()
+    # The agent's own mikro calls are timed like any other device.
+    mikro_calls = {name: getattr(app, name) for name in MIKRO_CALLS}
+    for name in MIKRO_CALLS:
+        setattr(app, name, getattr(fleet.mikro, name))
+    try:
+        makespan = run_virtual(_run())
+    finally:
+        app.quantify_stain = quantify_stain
+        app.duration_model = duration_model
+        app.call_cache = call_cache
+        for name, call in mikro_calls.items():
+            setattr(app, name, call)
+    return BenchmarkReport(
+        workflow=workflow,
+        slides=slides,
+        iterations=iterations,
+        makespan=makespan,
+        devices={
+            name: _device_report(intervals, makespan)
+            for name, intervals in fleet.intervals.items()
+        },
+    )
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slides", type=int, default=6)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--wells", type=int, default=1, help="Wells per slide.")
+    parser.add_argument(
+        "--deck-capacity", type=int, default=1,
+        help="Slides one Opentrons protocol run can process at once.",
+    )
+    parser.add_argument(
+        "--segmenters", type=int, default=1, help="Instances of the segmentation app."
+    )
+    parser.add_argument("--stitchers", type=int, default=1, help="Instances of the stitching app.")
+    parser.add_argument(
+        "--stations", type=int, default=1,
+        help="Opentrons and FRAMEs served by the robot (run_stainstorm_7 only).",
+    )
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workflow", choices=sorted(WORKFLOWS), action="append",
+        help="Workflow to simulate (repeatable; default: all).",
+    )
+    args = parser.parse_args(argv)
+    for workflow in args.workflow or WORKFLOWS:
+        report = simulate(
+            workflow,
+            slides=args.slides,
+            iterations=args.iterations,
+            wells=args.wells,
+            jitter=args.jitter,
+            deck_capacity=args.deck_capacity,
+            segmenters=args.segmenters,
+            stitchers=args.stitchers,
+            stations=args.stations,
+            seed=args.seed,
+        )
+        print(report.format())
+
+
+if __name__ == "__main__":
+    main()
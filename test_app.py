@@ -1,35 +1,80 @@
 """Unit tests for the StainStorm registered protocols.
 
-The registered functions (``run_stainstorm``, ``stitch_and_segment``,
-``stitch_and_segment_optimized``) are ``@register``-decorated **async**
-generators that orchestrate a set of *declared* remote dependencies. ``register``
-returns a ``WrappedFunction`` whose ``__call__`` invokes the underlying function,
-so we can call it directly and inject plain local async fakes that satisfy each
-declared ``Protocol`` structurally.
-
-Every declared method is ``async def``; the fakes mirror that. Tests drive the
-async generators with ``asyncio.run`` and assert on the orchestration logic — the
-movement sequence, the washing retry loop, the stitch->segment pipeline, and that
-the *optimized* variant runs the per-slide compute concurrently while keeping the
-physical acquisition serial.
+The registered functions (``run_stainstorm_7``, ``run_concurrent_staining_6``)
+are ``@register``-decorated **async** generators that orchestrate a set of
+*declared* remote dependencies. ``register`` returns a ``WrappedFunction`` whose
+``__call__`` invokes the underlying function, so we can call it directly and
+inject plain local fakes that satisfy each declared ``Protocol`` structurally.
+
+The workflows push plain ``def`` remote calls onto worker threads and await
+``async def`` ones directly; the fakes are ``async def`` so tests stay on the
+event loop. Tests drive the async generators with ``asyncio.run`` and assert on
+the orchestration logic -- the movement sequence, which device runs alongside
+which, the staining retry loop and the published ``AppState``.
 """
 
 import asyncio
+import concurrent.futures
+import dataclasses
+import functools
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
 from typing import Optional, cast
 
+import dask.array as da
+import numpy as np
 import pytest
+import xarray as xr
 
 from mikro_next.api.schema import Image
+from rekuest_next.state.publish import Patch, get_current_publisher
 
 import app
 from app import (
     AppState,
-    RunState,
+    ArmLocation,
+    CallCache,
+    RunJournal,
+    WellRegistry,
+    CallLatency,
+    CoalescingPublisher,
+    DeviceState,
+    DurationModel,
+    Gripper,
+    ImageRecord,
+    MotionProfile,
+    Plan,
+    PlanStep,
+    Ref,
+    SegmentationBatcher,
+    StitchCache,
     Slide,
     SlideStatus,
-    TrajectoriesState,
-    run_concurrent_staining,
-    run_stainstorm,
+    Station,
+    WellFocus,
+    grid_signature,
+    estimate_plan,
+    evict_done_slides,
+    has_plateaued,
+    invert_stage_axes,
+    mirror_affine_matrices,
+    quantify_stain,
+    record_history,
+    reset_device_state,
+    rounds_key,
+    run_concurrent_staining_6,
+    run_plan,
+    clear_call_cache,
+    count_cells,
+    memoized,
+    run_stainstorm_7,
+    save_first_well_corner,
+    save_second_well_corner,
+    stainstorm_plan,
+    set_motion_profile,
 )
 
 
@@ -50,548 +95,1067 @@ def collect(agen) -> list[Image]:
 # --- Local async fake implementations of the declared dependencies ----------
 
 
-class FakeRobot:
-    """Stand-in for ``ArkirinoLike``. Records the ordered call log."""
+class FakeFairino:
+    """Stand-in for ``FairinoLike``. Records each transfer on a shared timeline."""
 
-    def __init__(self) -> None:
-        self.trajectories = TrajectoriesState()
-        self.trajectories.available_trajectories = ["traj-1", "traj-2"]
+    def __init__(self, timeline: list) -> None:
+        self.timeline = timeline
         self.calls: list[tuple] = []
+        self.motion: list[tuple] = []
 
-    async def run_trajectory(
-        self,
-        name: str,
-        speed: Optional[int] = None,
-        acceleration: Optional[int] = None,
-    ) -> None:
-        self.calls.append(("run_trajectory", name, speed, acceleration))
+    async def _move(self, name: str, sample: str, motion: dict) -> None:
+        self.calls.append((name, sample))
+        self.motion.append((name, sample, motion))
+        self.timeline.append((name, sample))
+        await asyncio.sleep(0.001)
 
-    async def grip(self) -> None:
-        self.calls.append(("grip",))
+    async def pick_up_opentrons(self, sample: str, **motion) -> None:
+        await self._move("pick_up_opentrons", sample, motion)
 
-    async def ungrip(self) -> None:
-        self.calls.append(("ungrip",))
+    async def release_at_opentrons(self, sample: str, **motion) -> None:
+        await self._move("release_at_opentrons", sample, motion)
 
+    async def pick_up_frame(self, sample: str, **motion) -> None:
+        await self._move("pick_up_frame", sample, motion)
 
-class FakeOpentrons:
-    """Stand-in for ``OT2Like``. Records the protocols it was asked to run."""
+    async def release_at_frame(self, sample: str, **motion) -> None:
+        await self._move("release_at_frame", sample, motion)
 
-    def __init__(self) -> None:
-        self.run = RunState()
-        self.run.available_protocols = ["wash-A", "wash-B"]
-        self.run_protocols: list[str] = []
+    async def init_robot_and_gripper(self) -> None:
+        self.calls.append(("init_robot_and_gripper",))
+
+
+class FakeOT2:
+    """Stand-in for ``OT2Like``. Each protocol run takes a little wall time."""
 
-    async def run_protocol(self, protocol: str) -> None:
-        self.run_protocols.append(protocol)
+    def __init__(self, timeline: list, duration: float = 0.02) -> None:
+        self.timeline = timeline
+        self.duration = duration
+        self.runs: list[str] = []
 
+    async def _run(self, protocol: str) -> None:
+        self.runs.append(protocol)
+        self.timeline.append(("protocol_start", protocol))
+        await asyncio.sleep(self.duration)
+        self.timeline.append(("protocol_end", protocol))
 
-class FakeMicroscope:
-    """Stand-in for ``FrameLike``. Hands out a fresh sentinel image per acquire."""
+    async def run_washing_protocol(self) -> None:
+        await self._run("washing")
 
-    def __init__(self, timeline: Optional[list] = None) -> None:
-        self.timeline = timeline if timeline is not None else []
-        self.positions: list[str] = []
-        self.acquired: list[Image] = []
-        self._counter = 0
+    async def run_staining_protocol(self) -> None:
+        await self._run("staining")
 
-    async def acquire_image(self) -> Image:
-        self._counter += 1
-        image = _img(f"image-{self._counter}")
-        self.acquired.append(image)
-        self.timeline.append(("acquire", image))
-        return image
+    async def run_dummy_protocol(self) -> None:
+        await self._run("dummy")
 
-    async def move_to_position(self, position: str) -> None:
-        self.positions.append(position)
 
+class FakeFrame:
+    """Stand-in for ``FrameLike``. Hands out a fresh sentinel stage per scan."""
 
-class FakeStitcher:
-    """Stand-in for ``StitcherLike``. Returns a sentinel composite per call."""
+    def __init__(self, timeline: list, duration: float = 0.02) -> None:
+        self.timeline = timeline
+        self.duration = duration
+        self.homings = 0
+        self.scans: list[str] = []
+        self.settings: list[dict] = []
 
-    def __init__(self, timeline: Optional[list] = None) -> None:
-        self.timeline = timeline if timeline is not None else []
-        self.inputs: list[list[Image]] = []
+    async def homeStageAxis(self, **_) -> None:
+        self.homings += 1
 
-    async def stitch_images(self, images: list[Image]) -> Image:
-        self.inputs.append(list(images))
-        stitched = _img(f"stitched-{len(self.inputs)}")
-        self.timeline.append(("stitch", stitched))
-        return stitched
+    async def run_well_tile_scan(self, well_id: Optional[str] = None, **settings) -> Image:
+        self.scans.append(well_id)
+        self.settings.append(settings)
+        stage = _img(f"stage-{len(self.scans)}")
+        self.timeline.append(("scan_start", stage))
+        await asyncio.sleep(self.duration)
+        self.timeline.append(("scan_end", stage))
+        return stage
 
 
-class FakeSegmenter:
-    """Stand-in for ``SegmenterLike`` (Cellpose). Returns a sentinel mask per image.
+class FakeCorrector:
+    """Stand-in for ``CorrectCoordinateSystemDevLike``."""
 
-    An optional ``barrier`` lets a test prove concurrent execution: every call
-    waits on the barrier, so the generator only completes if enough calls are
-    in flight simultaneously.
+    async def invert_x_axis(self, stage: Image) -> Image:
+        return _img(f"inverted-{stage}")
+
+
+class FakeCellpose:
+    """Stand-in for ``SegmenterLike`` on the ``run_cellpose_SAM`` API.
+
+    Tracks how many calls are in flight at once; an optional ``barrier`` makes
+    every call wait until that many are running concurrently.
     """
 
-    def __init__(
-        self,
-        timeline: Optional[list] = None,
-        barrier: Optional[asyncio.Barrier] = None,
-    ) -> None:
-        self.timeline = timeline if timeline is not None else []
+    def __init__(self, barrier: Optional[asyncio.Barrier] = None) -> None:
         self.barrier = barrier
         self.inputs: list[Image] = []
-
-    async def segment_image(self, image: Image) -> Image:
-        if self.barrier is not None:
-            await self.barrier.wait()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def run_cellpose_SAM(self, image: Image, **_) -> tuple[Image, Image, Image]:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.barrier is not None:
+                await self.barrier.wait()
+            await asyncio.sleep(0.005)
+        finally:
+            self.in_flight -= 1
         self.inputs.append(image)
-        segmented = _img(f"segmented-{image}")
-        self.timeline.append(("segment", segmented))
-        return segmented
+        return _img(f"cells-{image}"), _img("flows"), _img("styles")
 
 
-class FakeAnalyzer:
-    """Stand-in for ``AnalyzerLike``. Returns a scripted sequence of stain %s."""
+class FakeStageStitcher:
+    """Stand-in for ``StitchLike`` on the ``stitch_stage`` API."""
 
-    def __init__(self, stains: list[float]) -> None:
-        self._stains = list(stains)
+    def __init__(self) -> None:
         self.inputs: list[Image] = []
+        self.settings: list[dict] = []
 
-    async def calculate_stain_percentage(self, image: Image) -> float:
-        self.inputs.append(image)
-        assert self._stains, "FakeAnalyzer ran out of scripted stain values"
-        return self._stains.pop(0)
+    async def stitch_stage(self, stage: Image, **settings) -> Image:
+        self.inputs.append(stage)
+        self.settings.append(settings)
+        return _img(f"stitched-{stage}")
 
 
 # --- Fixtures ---------------------------------------------------------------
 
 
 @pytest.fixture
-def robot() -> FakeRobot:
-    return FakeRobot()
+def captured_logs(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Capture every message passed to ``app.log``."""
+    messages: list[str] = []
+    monkeypatch.setattr(app, "log", lambda message: messages.append(message))
+    return messages
 
 
-@pytest.fixture
-def opentrons() -> FakeOpentrons:
-    return FakeOpentrons()
+@pytest.fixture(autouse=True)
+def latency_recorder(monkeypatch: pytest.MonkeyPatch) -> app.LatencyRecorder:
+    """Give every test its own call-latency aggregate."""
+    recorder = app.LatencyRecorder()
+    monkeypatch.setattr(app, "latency_recorder", recorder)
+    return recorder
 
 
-@pytest.fixture
-def microscope() -> FakeMicroscope:
-    return FakeMicroscope()
+@pytest.fixture(autouse=True)
+def duration_model(monkeypatch: pytest.MonkeyPatch) -> app.DurationModel:
+    """Give every test its own, unpersisted duration model."""
+    model = app.DurationModel()
+    monkeypatch.setattr(app, "duration_model", model)
+    return model
 
 
-@pytest.fixture
-def segmenter() -> FakeSegmenter:
-    return FakeSegmenter()
+@pytest.fixture(autouse=True)
+def call_cache(monkeypatch: pytest.MonkeyPatch) -> app.CallCache:
+    """Give every test its own, unpersisted call cache."""
+    cache = app.CallCache()
+    monkeypatch.setattr(app, "call_cache", cache)
+    return cache
 
 
-@pytest.fixture
-def stitcher() -> FakeStitcher:
-    return FakeStitcher()
+@pytest.fixture(autouse=True)
+def call_policies(monkeypatch: pytest.MonkeyPatch) -> dict:
+    """Keep the default call policies, but retry without waiting."""
+    policies = {
+        key: dataclasses.replace(policy, backoff=0.0) for key, policy in app.CALL_POLICIES.items()
+    }
+    monkeypatch.setattr(app, "CALL_POLICIES", policies)
+    return policies
 
 
-@pytest.fixture
-def captured_logs(monkeypatch: pytest.MonkeyPatch) -> list[str]:
-    """Capture every message passed to ``app.log``."""
-    messages: list[str] = []
-    monkeypatch.setattr(app, "log", lambda message: messages.append(message))
-    return messages
+@pytest.fixture(autouse=True)
+def stained_fractions(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    """Stand in for the stain quantifier, which reads real image data.
 
+    Wells are measured at the fractions pushed onto the returned list, in order,
+    and fully stained once it runs out.
+    """
+    fractions: list[float] = []
 
-def drive_stainstorm(
-    *,
-    robot: FakeRobot,
-    opentrons: FakeOpentrons,
-    microscope: FakeMicroscope,
-    segmenter: FakeSegmenter,
-    analyzer: FakeAnalyzer,
-    loaded_slides: list[Slide],
-    microscope_trajectory: str = "to_microscope",
-    opentrons_trajectory: str = "to_opentrons",
-    max_iterations: int = 5,
-) -> list[Image]:
-    return collect(
-        run_stainstorm(
+    async def quantify_stain(image: Image, mask: Image, *_) -> app.StainQuantification:
+        stained = round(100 * fractions.pop(0)) if fractions else 100
+        return app.StainQuantification(cells=100, stained_cells=stained)
+
+    monkeypatch.setattr(app, "quantify_stain", quantify_stain)
+    return fractions
+
+
+# --- run_stainstorm_7 tests -------------------------------------------------
+
+
+def drive_stainstorm_7(
+    slides: list[Slide],
+    max_iterations: int = 1,
+    state: Optional[AppState] = None,
+    robot: Optional[FakeFairino] = None,
+    segmenter: Optional[FakeCellpose] = None,
+    timeline: Optional[list] = None,
+    **kwargs,
+):
+    timeline = timeline if timeline is not None else []
+    robot, opentrons, microscope = (
+        robot or FakeFairino(timeline),
+        FakeOT2(timeline),
+        FakeFrame(timeline),
+    )
+    segmenter = segmenter or FakeCellpose()
+    yielded = collect(
+        run_stainstorm_7(
             robot=robot,
             opentrons=opentrons,
             microscope=microscope,
             segmenter=segmenter,
-            analyzer=analyzer,
-            loaded_slides=loaded_slides,
-            microscope_trajectory=microscope_trajectory,
-            opentrons_trajectory=opentrons_trajectory,
+            coordinate_corrector=FakeCorrector(),
+            state=state if state is not None else AppState(),
+            loaded_slides=slides,
             max_iterations=max_iterations,
+            segmentation_window=0.0,
+            **kwargs,
         )
     )
+    return yielded, timeline, robot, opentrons, microscope, segmenter
+
+
+def test_stainstorm_7_single_slide_sequence():
+    """One slide is loaded, scanned, cycled through the Opentrons and parked again."""
+    slide = Slide(name="s1", protocol="washing")
+
+    yielded, _, robot, opentrons, microscope, segmenter = drive_stainstorm_7(
+        [slide], max_iterations=2
+    )
+
+    assert robot.calls == [
+        ("init_robot_and_gripper",),
+        ("pick_up_opentrons", "s1"),
+        ("release_at_frame", "s1"),
+        *[
+            ("pick_up_frame", "s1"),
+            ("release_at_opentrons", "s1"),
+            ("pick_up_opentrons", "s1"),
+            ("release_at_frame", "s1"),
+        ]
+        * 2,
+        ("pick_up_frame", "s1"),
+        ("release_at_opentrons", "s1"),
+    ]
+    assert opentrons.runs == ["washing", "washing"]
+    assert microscope.scans == ["A1"] * 3
+    assert segmenter.inputs == [_img(f"inverted-stage-{i}") for i in (1, 2, 3)]
+    assert len(yielded) == 6  # a stage and a mask per scan
+
+
+def test_stainstorm_7_scans_one_slide_while_another_is_in_the_opentrons():
+    """Slide B's scan overlaps slide A's protocol instead of waiting for it."""
+    slides = [Slide(name="a", protocol="washing"), Slide(name="b", protocol="staining")]
+
+    _, timeline, *_ = drive_stainstorm_7(slides)
+
+    protocol_start = timeline.index(("protocol_start", "washing"))
+    protocol_end = timeline.index(("protocol_end", "washing"))
+    # A scan finishes while slide "a" is still in its protocol.
+    assert any(e[0] == "scan_end" for e in timeline[protocol_start:protocol_end])
+
+
+def test_stainstorm_7_never_reaches_into_the_deck_during_a_protocol():
+    """No robot transfer touches the Opentrons while a protocol is running."""
+    slides = [Slide(name=f"s{i}", protocol="washing") for i in range(3)]
+
+    _, timeline, *_ = drive_stainstorm_7(slides, max_iterations=2)
+
+    running = False
+    for event, _ in timeline:
+        if event == "protocol_start":
+            assert not running
+            running = True
+        elif event == "protocol_end":
+            running = False
+        elif event in ("pick_up_opentrons", "release_at_opentrons"):
+            assert not running
+
+
+def test_stainstorm_7_holds_a_single_slide_on_the_frame():
+    """A slide is only released onto the FRAME once the previous one left it."""
+    slides = [Slide(name=f"s{i}", protocol="washing") for i in range(3)]
+
+    _, timeline, *_ = drive_stainstorm_7(slides, max_iterations=2)
+
+    on_frame = None
+    for event, sample in timeline:
+        if event == "release_at_frame":
+            assert on_frame is None
+            on_frame = sample
+        elif event == "pick_up_frame":
+            assert on_frame == sample
+            on_frame = None
+
+
+def test_stainstorm_7_scans_every_well_of_a_slide():
+    slide = Slide(name="s1", protocol="washing", wells=["A1", "A2"])
+
+    yielded, _, _, _, microscope, segmenter = drive_stainstorm_7([slide], max_iterations=1)
+
+    assert microscope.scans == ["A1", "A2"] * 2
+    assert len(segmenter.inputs) == 4
+    assert len(yielded) == 8  # a stage and a mask per well scan
+
+
+def test_stainstorm_7_scans_the_next_well_while_the_previous_is_segmented():
+    timeline: list = []
+
+    class SlowCellpose(FakeCellpose):
+        async def run_cellpose_SAM(self, image: Image, **kwargs):
+            timeline.append(("segment_start", image))
+            await asyncio.sleep(0.05)
+            timeline.append(("segment_end", image))
+            return await super().run_cellpose_SAM(image, **kwargs)
 
+    slide = Slide(name="s1", protocol="washing", wells=["A1", "A2"])
+    drive_stainstorm_7([slide], max_iterations=0, segmenter=SlowCellpose(), timeline=timeline)
 
-# --- run_stainstorm tests ---------------------------------------------------
+    first_segmented = timeline.index(("segment_end", "inverted-stage-1"))
+    assert timeline.index(("scan_end", "stage-2")) < first_segmented
 
 
-def test_no_washing_when_below_threshold(
-    robot, opentrons, microscope, segmenter, captured_logs
+def _cell_counts_by_scan(monkeypatch: pytest.MonkeyPatch, counts: list[int]) -> None:
+    """Make ``app.count_cells`` report ``counts[n - 1]`` for the mask of scan ``n``."""
+
+    def count_cells(mask: Image) -> int:
+        return counts[int(mask.rsplit("-", 1)[1]) - 1]
+
+    monkeypatch.setattr(app, "count_cells", count_cells)
+
+
+def test_has_plateaued_compares_the_last_two_rounds():
+    assert not has_plateaued([100], 0.05)
+    assert not has_plateaued([100, 120], 0.05)
+    assert has_plateaued([100, 120, 124], 0.05)
+    assert has_plateaued([0, 0], 0.0)
+
+
+def test_stainstorm_7_stops_a_slide_once_its_cell_count_plateaus(
+    monkeypatch, captured_logs, duration_model
 ):
-    """A slide already below the 0.8 threshold is imaged once and never washed."""
-    analyzer = FakeAnalyzer([0.5])
-    slide = Slide(name="s1", protocol="wash-A", trajectory="traj-1")
-
-    yielded = drive_stainstorm(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=[slide],
+    _cell_counts_by_scan(monkeypatch, [100, 150, 152, 300, 400])
+    state = AppState()
+
+    _, _, _, opentrons, microscope, _ = drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")],
+        max_iterations=4,
+        state=state,
+        plateau_tolerance=0.05,
     )
 
-    assert yielded == [_img("image-1"), _img("segmented-image-1")]
-    assert opentrons.run_protocols == []
-    assert microscope.acquired == [_img("image-1")]
-    assert analyzer.inputs == [_img("segmented-image-1")]
-    assert captured_logs == []
+    assert opentrons.runs == ["washing", "washing"]
+    assert len(microscope.scans) == 3
+    assert state.cell_counts["s1"] == [100, 150, 152]
+    assert state.converged_after["s1"] == 2
+    assert any("plateaued after 2" in message for message in captured_logs)
+    assert duration_model.mean(rounds_key("run_stainstorm_7", "washing")) == 2
 
 
-def test_full_robot_sequence_for_single_unwashed_slide(
-    robot, opentrons, microscope, segmenter
-):
-    """The exact pick-up / carry / image / return movement sequence is correct."""
-    analyzer = FakeAnalyzer([0.1])
-    slide = Slide(name="s1", protocol="wash-A", trajectory="traj-slide")
-
-    drive_stainstorm(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=[slide],
-        microscope_trajectory="traj-scope",
+def test_stainstorm_7_runs_every_round_without_a_plateau_tolerance():
+    state = AppState()
+
+    _, _, _, opentrons, _, _ = drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")], max_iterations=3, state=state
     )
 
-    assert robot.calls == [
-        ("run_trajectory", "traj-slide", None, None),  # go to slide in tray
-        ("grip",),  # pick it up
-        ("run_trajectory", "traj-scope", None, None),  # carry to microscope
-        ("ungrip",),  # release onto stage
-        ("run_trajectory", "traj-scope", None, None),  # go back to fetch it
-        ("grip",),  # pick it back up
-        ("run_trajectory", "traj-slide", None, None),  # carry back to tray
-        ("ungrip",),  # drop into tray
+    assert len(opentrons.runs) == 3
+    assert state.cell_counts == {}
+    assert state.converged_after == {}
+
+
+# --- Slide ordering tests --------------------------------------------------
+
+
+def _learn_durations(model: DurationModel, **protocols: float) -> None:
+    """Teach ``model`` one-second transfers and scans and the given protocol durations."""
+    for leg in app.ROBOT_LEGS:
+        model.observe(f"fairinogale.{leg}", 1.0)
+    model.observe("FRAME Fork Approval.run_well_tile_scan", 1.0)
+    for protocol, seconds in protocols.items():
+        model.observe(f"OT2.run_{protocol}_protocol", seconds)
+
+
+def test_duration_model_averages_and_persists_what_it_learned(tmp_path):
+    path = str(tmp_path / "durations.json")
+    model = DurationModel(path)
+    model.observe("OT2.run_washing_protocol", 10.0)
+    model.observe("OT2.run_washing_protocol", 20.0)
+    model.save()
+
+    reloaded = DurationModel(path)
+
+    assert reloaded.mean("OT2.run_washing_protocol") == pytest.approx(12.0)
+    assert reloaded.mean("OT2.run_staining_protocol") is None
+
+
+def test_stainstorm_7_starts_the_slides_with_least_work_first(duration_model):
+    _learn_durations(duration_model, washing=600.0, staining=60.0)
+    slides = [Slide(name="long", protocol="washing"), Slide(name="short", protocol="staining")]
+    state = AppState()
+    before = time.time()
+
+    _, _, robot, *_ = drive_stainstorm_7(slides, state=state)
+    _, _, in_order, *_ = drive_stainstorm_7(slides, order="loaded")
+
+    assert robot.calls[1] == ("pick_up_opentrons", "short")
+    assert in_order.calls[1] == ("pick_up_opentrons", "long")
+    assert before <= state.slide_eta["short"] <= time.time()
+
+
+def test_stainstorm_7_measures_durations_it_did_not_know():
+    state = AppState()
+    slides = [Slide(name="s1", protocol="washing")]
+
+    drive_stainstorm_7(slides, state=state)
+    assert app.duration_model.mean("OT2.run_washing_protocol") is not None
+
+    with pytest.raises(ValueError, match="slide order"):
+        drive_stainstorm_7(slides, order="longest_first")
+
+
+def test_concurrent_staining_6_images_the_slide_with_least_work_left_next(duration_model):
+    _learn_durations(duration_model, washing=600.0, staining=60.0)
+    duration_model.observe("stainstorm-stitch.stitch_stage", 1.0)
+    duration_model.observe("cellpose-ARK.run_cellpose_SAM", 1.0)
+    slides = [Slide(name="long", protocol="washing"), Slide(name="short", protocol="staining")]
+    state = AppState()
+
+    robot = FakeFairino([])
+    drive_concurrent_staining_6(slides, state=state, robot=robot, max_rounds=1)
+
+    assert robot.calls[1] == ("pick_up_opentrons", "short")
+    assert set(state.slide_eta) == {"long", "short"}
+    assert duration_model.mean(rounds_key("run_concurrent_staining_6", "washing")) == 0
+
+
+# --- Declarative plan tests ------------------------------------------------
+
+
+def test_plan_rejects_steps_it_could_not_run():
+    with pytest.raises(ValueError, match="does not declare"):
+        Plan([PlanStep("fly", "robot", "fly_to_the_moon")])
+    with pytest.raises(ValueError, match="not listed before"):
+        Plan([PlanStep("scan", "microscope", "homeStageAxis", after=("init",))])
+    with pytest.raises(ValueError, match="no step before it claimed"):
+        Plan([PlanStep("drop", "robot", "open_grip", releases=("frame",))])
+
+
+def test_run_plan_overlaps_slides_but_holds_one_on_the_frame():
+    timeline: list = []
+    devices = {
+        "robot": FakeFairino(timeline),
+        "opentrons": FakeOT2(timeline),
+        "microscope": FakeFrame(timeline),
+        "coordinate_corrector": FakeCorrector(),
+        "segmenter": FakeCellpose(),
+    }
+    slides = [Slide(name="a", protocol="washing"), Slide(name="b", protocol="staining")]
+    state = AppState()
+
+    results = dict(collect(run_plan(stainstorm_plan(slides, 1), devices, state)))
+
+    assert results["b/1/A1/segment"][0] == _img(f"cells-inverted-{results['b/1/A1/scan']}")
+    assert len(devices["microscope"].scans) == 4
+    on_frame = None
+    for event, sample in timeline:
+        if event == "release_at_frame":
+            assert on_frame is None
+            on_frame = sample
+        elif event == "pick_up_frame":
+            assert on_frame == sample
+            on_frame = None
+    protocol_start = timeline.index(("protocol_start", "washing"))
+    protocol_end = timeline.index(("protocol_end", "washing"))
+    assert any(e[0] == "scan_start" for e in timeline[protocol_start:protocol_end])
+    assert state.call_latency["OT2.run_staining_protocol"].count == 1
+
+
+def test_estimate_plan_follows_dependencies_and_resource_contention():
+    plan = Plan(
+        [
+            PlanStep("home", "microscope", "homeStageAxis"),
+            PlanStep("scan", "microscope", "run_well_tile_scan", after=("home",)),
+            PlanStep("wash", "opentrons", "run_washing_protocol"),
+            PlanStep("stain", "opentrons", "run_staining_protocol"),
+            PlanStep("segment", "segmenter", "run_cellpose_SAM", {"image": Ref("scan")}),
+        ]
+    )
+    durations = {
+        "FRAME Fork Approval.homeStageAxis": 10.0,
+        "FRAME Fork Approval.run_well_tile_scan": 30.0,
+        "OT2.run_washing_protocol": 25.0,
+        "OT2.run_staining_protocol": 25.0,
+    }
+
+    estimate = estimate_plan(plan, durations)
+
+    assert estimate.makespan == 50.0  # the two protocols share the deck
+    assert estimate.starts["stain"] == 25.0
+    assert estimate.critical_path == ["wash", "stain"]
+    assert estimate.unmeasured == ["cellpose-ARK.run_cellpose_SAM"]
+
+    durations["cellpose-ARK.run_cellpose_SAM"] = 20.0
+    assert estimate_plan(plan, durations).critical_path == ["home", "scan", "segment"]
+
+
+# --- Stitching cache tests -------------------------------------------------
+
+
+def _tile_stage(name: str, positions: list[tuple[int, int]]) -> SimpleNamespace:
+    """A stage whose tiles sit at the given (x, y) translations."""
+    views = [
+        SimpleNamespace(
+            image=SimpleNamespace(id=f"{name}/{x},{y}"),
+            affine_matrix=[[1, 0, 0, x], [0, 1, 0, y], [0, 0, 1, 0], [0, 0, 0, 1]],
+        )
+        for x, y in positions
     ]
-    assert microscope.positions == ["imaging_position"]
+    return SimpleNamespace(id=name, name=name, affine_views=views)
 
 
-def test_washes_until_stain_drops_below_threshold(
-    robot, opentrons, microscope, segmenter, captured_logs
-):
-    """Over-stained slides are re-washed until the stain falls under 0.8."""
-    analyzer = FakeAnalyzer([0.9, 0.9, 0.5])  # initial -> wash -> wash -> stop
-    slide = Slide(name="s1", protocol="wash-A", trajectory="traj-1")
-
-    yielded = drive_stainstorm(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
+def test_grid_signature_ignores_tile_order_and_sees_layout_changes():
+    grid = [(0, 0), (10, 0), (0, 5), (10, 5)]
+
+    assert grid_signature(_tile_stage("a", grid)) == grid_signature(_tile_stage("b", grid[::-1]))
+    assert grid_signature(_tile_stage("a", grid)) != grid_signature(_tile_stage("c", grid[:3]))
+    assert grid_signature(_img("no-views")) is None
+
+
+def test_stitch_cache_warms_up_only_for_the_same_slide_well_and_grid():
+    cache = StitchCache()
+    grid = [(0, 0), (10, 0)]
+
+    assert cache.settings("s1", "A1", _tile_stage("r0", grid)) == {}
+    cache.stitched("s1", "A1", _tile_stage("r0", grid))
+
+    assert cache.settings("s1", "A1", _tile_stage("r1", grid)) == app.WARM_STITCH_SETTINGS
+    assert cache.settings("s1", "A2", _tile_stage("r1", grid)) == {}
+    assert cache.settings("s1", "A1", _tile_stage("r1", grid + [(20, 0)])) == {}
+    assert cache.hits == 1
+
+
+def test_concurrent_staining_6_restitches_a_known_grid_warm():
+    grid = [(0, 0), (10, 0)]
+
+    class TileFrame(FakeFrame):
+        async def run_well_tile_scan(self, well_id: Optional[str] = None, **_):
+            self.scans.append(well_id)
+            return _tile_stage(f"stage-{len(self.scans)}", grid)
+
+    _, _, stitcher = drive_concurrent_staining_6(
+        [Slide(name="s1", protocol="staining")],
+        microscope=TileFrame([], duration=0.001),
+        target_stain_percentage=100.0,
+        max_rounds=2,
+        warm_stitching=True,
+    )
+
+    assert stitcher.settings == [{}, app.WARM_STITCH_SETTINGS, app.WARM_STITCH_SETTINGS]
+
+
+def test_concurrent_staining_6_stitches_cold_by_default():
+    class TileFrame(FakeFrame):
+        async def run_well_tile_scan(self, well_id: Optional[str] = None, **_):
+            self.scans.append(well_id)
+            return _tile_stage(f"stage-{len(self.scans)}", [(0, 0), (10, 0)])
+
+    _, _, stitcher = drive_concurrent_staining_6(
+        [Slide(name="s1", protocol="staining")],
+        microscope=TileFrame([], duration=0.001),
+        target_stain_percentage=100.0,
+        max_rounds=2,
+    )
+
+    assert stitcher.settings == [{}] * 3
+
+
+# --- Checkpoint journal tests ----------------------------------------------
+
+
+def test_journal_records_every_completed_step(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    slide = Slide(name="s1", protocol="washing", wells=["A1", "A2"])
+
+    drive_stainstorm_7([slide], max_iterations=1, journal_path=path)
+
+    progress = RunJournal(path).replay()["s1"]
+    assert progress.rounds_done == 2
+    assert progress.protocols_done == 1
+    assert progress.stages == {
+        (0, "A1"): "stage-1",
+        (0, "A2"): "stage-2",
+        (1, "A1"): "stage-3",
+        (1, "A2"): "stage-4",
+    }
+    assert progress.masks == {
+        key: f"cells-inverted-{stage_id}" for key, stage_id in progress.stages.items()
+    }
+
+
+def test_journal_ignores_a_line_cut_short_and_earlier_runs(tmp_path):
+    path = tmp_path / "run.jsonl"
+    journal = RunJournal(str(path))
+    journal.record("old", 0, "round")
+    journal.start()
+    journal.record("s1", 0, "round")
+    with open(path, "a") as f:
+        f.write('{"slide": "s1", "round": 1, "st')
+
+    assert set(journal.replay()) == {"s1"}
+    assert journal.replay()["s1"].rounds_done == 1
+
+
+def test_stainstorm_7_resumes_from_the_first_unfinished_round(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    slide = Slide(name="s1", protocol="washing")
+
+    class FailingFrame(FakeFrame):
+        async def run_well_tile_scan(self, well_id: Optional[str] = None, **kwargs) -> Image:
+            if len(self.scans) == 2:
+                raise RuntimeError("stage controller lost")
+            return await super().run_well_tile_scan(well_id, **kwargs)
+
+    timeline: list = []
+    with pytest.raises(RuntimeError, match="stage controller"):
+        collect(
+            run_stainstorm_7(
+                robot=FakeFairino(timeline),
+                opentrons=FakeOT2(timeline),
+                microscope=FailingFrame(timeline),
+                segmenter=FakeCellpose(),
+                coordinate_corrector=FakeCorrector(),
+                state=AppState(),
+                loaded_slides=[slide],
+                max_iterations=3,
+                segmentation_window=0.0,
+                journal_path=path,
+            )
+        )
+
+    state = AppState()
+    _, _, _, opentrons, microscope, _ = drive_stainstorm_7(
+        [slide], max_iterations=3, state=state, journal_path=path, resume=True
+    )
+
+    assert state.staining_rounds["s1"] == 3
+    # Rounds 0 and 1 and the protocol before round 2 completed before the failure.
+    assert opentrons.runs == ["washing"]
+    assert len(microscope.scans) == 2
+    assert RunJournal(path).replay()["s1"].rounds_done == 4
+
+
+def test_stainstorm_7_resume_resegments_scans_whose_masks_were_lost(tmp_path, monkeypatch):
+    path = str(tmp_path / "run.jsonl")
+    journal = RunJournal(path)
+    journal.start()
+    journal.record("s1", 0, "scan", well="A1", id="stage-old")
+    journal.record("s1", 0, "round")
+
+    async def aget_stage(stage_id):
+        return _img(stage_id)
+
+    monkeypatch.setattr(app, "aget_stage", aget_stage)
+    segmenter = FakeCellpose()
+
+    drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")],
+        max_iterations=0,
         segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=[slide],
-    )
-
-    assert opentrons.run_protocols == ["wash-A", "wash-A"]
-    assert microscope.acquired == [_img("image-1"), _img("image-2"), _img("image-3")]
-    assert yielded == [
-        _img("image-1"),
-        _img("segmented-image-1"),
-        _img("image-2"),
-        _img("segmented-image-2"),
-        _img("image-3"),
-        _img("segmented-image-3"),
-    ]
-    assert len(captured_logs) == 2
-    assert all("Stain Percentage" in m for m in captured_logs)
-    assert not any("maximum iterations" in m for m in captured_logs)
+        journal_path=path,
+        resume=True,
+    )
 
+    assert segmenter.inputs == ["inverted-stage-old"]
+    assert RunJournal(path).replay()["s1"].masks == {(0, "A1"): "cells-inverted-stage-old"}
 
-def test_stops_at_max_iterations(
-    robot, opentrons, microscope, segmenter, captured_logs
+
+def test_stainstorm_7_resume_recounts_completed_rounds_and_drops_repeated_ones(
+    tmp_path, monkeypatch
 ):
-    """A stubbornly stained slide stops after ``max_iterations`` washes."""
-    analyzer = FakeAnalyzer([0.95] * 10)  # always above threshold
-    slide = Slide(name="s1", protocol="wash-A", trajectory="traj-1")
-
-    drive_stainstorm(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=[slide],
-        max_iterations=3,
+    path = str(tmp_path / "run.jsonl")
+    journal = RunJournal(path)
+    journal.start()
+    for round_, cells in ((0, 100), (1, None), (2, 130)):
+        if round_:
+            journal.record("s1", round_, "protocol")
+        journal.record("s1", round_, "scan", well="A1", id=f"stage-old-{round_}")
+        journal.record("s1", round_, "segment", well="A1", id=f"cells-old-{round_}")
+        if cells is not None:
+            journal.record("s1", round_, "count", cells=cells)
+        if round_ < 2:  # the run stopped before round 1's count and round 2's end
+            journal.record("s1", round_, "round")
+
+    async def aget_image(image_id):
+        return _img(image_id)
+
+    counts = {"cells-old-1": 150, "cells-inverted-stage-1": 152}
+    monkeypatch.setattr(app, "aget_image", aget_image)
+    monkeypatch.setattr(app, "count_cells", lambda mask: counts[mask])
+    state = AppState()
+
+    _, _, _, opentrons, microscope, _ = drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")],
+        max_iterations=4,
+        state=state,
+        plateau_tolerance=0.05,
+        journal_path=path,
+        resume=True,
+    )
+
+    assert RunJournal(path).replay()["s1"].cell_counts == {0: 100, 1: 150, 2: 152}
+    assert state.cell_counts["s1"] == [100, 150, 152]
+    assert state.converged_after["s1"] == 2
+    assert opentrons.runs == []
+    assert len(microscope.scans) == 1
+
+
+def test_stainstorm_7_resume_needs_a_journal():
+    with pytest.raises(ValueError, match="journal_path"):
+        drive_stainstorm_7([Slide(name="s1", protocol="washing")], resume=True)
+
+
+def test_stainstorm_7_runs_one_protocol_for_slides_waiting_on_the_deck(captured_logs):
+    slides = [Slide(name=f"s{i}", protocol="washing") for i in range(3)]
+
+    _, timeline, robot, opentrons, microscope, _ = drive_stainstorm_7(
+        slides, max_iterations=2, deck_capacity=3, protocol_batch_window=0.2
+    )
+
+    assert len(opentrons.runs) < 2 * len(slides)
+    assert len(microscope.scans) == 3 * len(slides)
+    assert any("for 3 slides at once" in message for message in captured_logs)
+
+
+def test_stainstorm_7_batches_no_more_slides_than_the_deck_holds():
+    slides = [Slide(name=f"s{i}", protocol="washing") for i in range(4)]
+
+    _, _, _, opentrons, _, _ = drive_stainstorm_7(
+        slides, max_iterations=1, deck_capacity=2, protocol_batch_window=0.3
     )
 
-    assert opentrons.run_protocols == ["wash-A"] * 3
-    assert len(analyzer.inputs) == 4  # 1 initial + 3 washes
-    assert any("maximum iterations" in m for m in captured_logs)
+    assert len(opentrons.runs) == 2
 
 
-def test_multiple_slides_each_visited_and_returned(
-    robot, opentrons, microscope, segmenter
+def _drive_stations(
+    slides: list[Slide], robots: int, opentrons: int, microscopes: int, **kwargs
 ):
-    """Every loaded slide is independently imaged using its own trajectory."""
-    analyzer = FakeAnalyzer([0.2, 0.2])  # both below threshold
+    timeline: list = []
+    devices = (
+        [FakeFairino(timeline) for _ in range(robots)],
+        [FakeOT2(timeline) for _ in range(opentrons)],
+        [FakeFrame(timeline) for _ in range(microscopes)],
+    )
+    collect(
+        run_stainstorm_7(
+            *devices,
+            segmenter=FakeCellpose(),
+            coordinate_corrector=FakeCorrector(),
+            loaded_slides=slides,
+            max_iterations=1,
+            segmentation_window=0.0,
+            **{"state": AppState(), **kwargs},
+        )
+    )
+    return devices
+
+
+def test_stainstorm_7_images_slides_on_every_frame_a_robot_reaches():
+    state = AppState()
     slides = [
-        Slide(name="s1", protocol="wash-A", trajectory="traj-1"),
-        Slide(name="s2", protocol="wash-B", trajectory="traj-2"),
+        *[Slide(name=f"w{i}", protocol="washing", deck=0) for i in range(2)],
+        *[Slide(name=f"s{i}", protocol="staining", deck=1) for i in range(2)],
     ]
 
-    yielded = drive_stainstorm(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=slides,
-    )
+    robots, decks, frames = _drive_stations(slides, 1, 2, 2, state=state)
+
+    assert set(decks[0].runs) == {"washing"}
+    assert set(decks[1].runs) == {"staining"}
+    assert all(frame.scans for frame in frames)
+    assert sum(len(frame.scans) for frame in frames) == 2 * len(slides)
+    assert robots[0].calls.count(("init_robot_and_gripper",)) == 1
+    assert set(state.station_devices) == {"robot/0", "microscope/0", "microscope/1"}
+    assert all(frame.homings == 1 for frame in frames)
+
+
+def test_stainstorm_7_keeps_each_robot_to_its_own_station():
+    slides = [Slide(name=f"s{i}", protocol="washing") for i in range(4)]
+    stations = [Station(robot=i, opentrons=i, microscope=i) for i in range(2)]
+
+    robots, decks, frames = _drive_stations(slides, 2, 2, 2, stations=stations)
 
-    assert microscope.acquired == [_img("image-1"), _img("image-2")]
-    assert len(yielded) == 4
-    assert opentrons.run_protocols == []
-    fetched = [c[1] for c in robot.calls if c[0] == "run_trajectory"]
-    assert "traj-1" in fetched and "traj-2" in fetched
+    # Without a deck of their own, slides are spread over the decks in turn.
+    assert {sample for _, sample in robots[0].calls[1:]} == {"s0", "s2"}
+    assert {sample for _, sample in robots[1].calls[1:]} == {"s1", "s3"}
+    assert len(decks[0].runs) == len(decks[1].runs) == 2
+    assert len(frames[0].scans) == len(frames[1].scans) == 4
 
 
-# --- run_concurrent_staining tests ------------------------------------------
+def test_stainstorm_7_rejects_stations_it_cannot_build():
+    slide = Slide(name="s1", protocol="washing", deck=2)
 
+    with pytest.raises(ValueError, match="stations must say"):
+        _drive_stations([slide], 2, 1, 1)
+    with pytest.raises(ValueError, match="was not given"):
+        _drive_stations([slide], 1, 1, 1, stations=[Station(microscope=1)])
+    with pytest.raises(ValueError, match="no station reaches"):
+        _drive_stations([slide], 1, 2, 1)
 
-def drive_concurrent_staining(
+
+# --- run_concurrent_staining_6 tests ----------------------------------------
+
+
+def drive_concurrent_staining_6(
+    slides: list[Slide],
     *,
-    robot: FakeRobot,
-    opentrons: FakeOpentrons,
-    microscope: FakeMicroscope,
-    stitcher: FakeStitcher,
-    segmenter: FakeSegmenter,
-    analyzer: FakeAnalyzer,
-    loaded_slides: list[Slide],
+    segmenter: Optional[FakeCellpose] = None,
     state: Optional[AppState] = None,
-    microscope_trajectory: str = "to_microscope",
-    opentrons_trajectory: str = "to_opentrons",
-    tile_positions: Optional[list[str]] = None,
-    target_stain_percentage: float = 0.8,
-    max_rounds: int = 5,
-) -> list[Image]:
-    return collect(
-        run_concurrent_staining(
-            robot=robot,
+    microscope: Optional[FakeFrame] = None,
+    robot: Optional[FakeFairino] = None,
+    **kwargs,
+):
+    timeline: list = []
+    opentrons, stitcher = FakeOT2(timeline), FakeStageStitcher()
+    yielded = collect(
+        run_concurrent_staining_6(
+            robot=robot or FakeFairino(timeline),
             opentrons=opentrons,
-            microscope=microscope,
+            microscope=microscope or FakeFrame(timeline, duration=0.001),
             stitcher=stitcher,
-            segmenter=segmenter,
-            analyzer=analyzer,
+            segmenter=segmenter or FakeCellpose(),
             state=state if state is not None else AppState(),
-            loaded_slides=loaded_slides,
-            microscope_trajectory=microscope_trajectory,
-            opentrons_trajectory=opentrons_trajectory,
-            tile_positions=tile_positions or ["p1", "p2"],
-            target_stain_percentage=target_stain_percentage,
-            max_rounds=max_rounds,
+            loaded_slides=slides,
+            **{"segmentation_window": 0.0, **kwargs},
         )
     )
+    return yielded, opentrons, stitcher
 
 
-def test_compute_is_offloaded_and_runs_concurrently():
-    """Compute for all slides is fired off as tasks and runs at the same time.
+def test_concurrent_staining_6_runs_compute_in_the_background():
+    """All slides are imaged before any segmentation has to finish.
 
-    Each segmentation blocks on a barrier sized to the slide count. The scheduler
-    images every slide first (spawning a compute task each) before awaiting, so
-    all segmentations reach the barrier together. A sequential implementation that
-    awaited each analysis inline would only ever have one in flight — the barrier
-    would never release and this would time out.
+    Each segmentation waits on a barrier sized to the slide count, so the run can
+    only complete if the physical path kept going while compute was in flight.
     """
     n = 3
-    slides = [
-        Slide(name=f"s{i}", protocol="stain-A", trajectory=f"traj-{i}")
-        for i in range(n)
-    ]
+    slides = [Slide(name=f"s{i}", protocol="staining") for i in range(n)]
+    segmenter = FakeCellpose(barrier=asyncio.Barrier(n))
 
     async def _run() -> list[Image]:
-        barrier = asyncio.Barrier(n)
-        agen = run_concurrent_staining(
-            robot=FakeRobot(),
-            opentrons=FakeOpentrons(),
-            microscope=FakeMicroscope(),
-            stitcher=FakeStitcher(),
-            segmenter=FakeSegmenter(barrier=barrier),
-            analyzer=FakeAnalyzer([0.95] * n),  # all above target -> no staining
+        agen = run_concurrent_staining_6(
+            robot=FakeFairino([]),
+            opentrons=FakeOT2([]),
+            microscope=FakeFrame([], duration=0.001),
+            stitcher=FakeStageStitcher(),
+            segmenter=segmenter,
             state=AppState(),
             loaded_slides=slides,
-            microscope_trajectory="to_microscope",
-            opentrons_trajectory="to_opentrons",
-            tile_positions=["p1", "p2"],
-            target_stain_percentage=0.8,
         )
         return [item async for item in agen]
 
     yielded = asyncio.run(asyncio.wait_for(_run(), timeout=3.0))
 
     assert len(yielded) == 2 * n  # stitched + segmented per slide
+    assert segmenter.max_in_flight == n
 
 
-def test_understained_slide_is_stained_then_reimaged(
-    robot, opentrons, microscope, stitcher, segmenter, captured_logs
-):
-    """A slide below target is routed to the Opentrons, stained, then re-imaged."""
-    # First analysis under target -> stain; after staining it clears the target.
-    analyzer = FakeAnalyzer([0.1, 0.9])
-    slide = Slide(name="s1", protocol="stain-A", trajectory="traj-1")
-
-    yielded = drive_concurrent_staining(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        stitcher=stitcher,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=[slide],
-    )
-
-    # Exactly one staining run, then a second imaging pass.
-    assert opentrons.run_protocols == ["stain-A"]
-    assert len(stitcher.inputs) == 2  # imaged twice
-    assert len(yielded) == 4  # (stitched + segmented) per imaging
-    # The robot visited the opentrons trajectory to stain.
-    visited = [c[1] for c in robot.calls if c[0] == "run_trajectory"]
-    assert "to_opentrons" in visited
-    # The under-stained round and the final completion are both logged.
-    assert any("staining" in m for m in captured_logs)
-    assert any("done" in m for m in captured_logs)
+def test_concurrent_staining_6_bounds_in_flight_compute():
+    """No more than ``max_in_flight`` analyses are on the fleet at once."""
+    slides = [Slide(name=f"s{i}", protocol="staining") for i in range(4)]
+    segmenter = FakeCellpose()
 
+    yielded, _, stitcher = drive_concurrent_staining_6(
+        slides, segmenter=segmenter, max_in_flight=1
+    )
 
-def test_stops_staining_at_max_rounds(
-    robot, opentrons, microscope, stitcher, segmenter, captured_logs
-):
-    """A slide that never reaches target stops after ``max_rounds`` staining runs."""
-    analyzer = FakeAnalyzer([0.1] * 10)  # always under target
-    slide = Slide(name="s1", protocol="stain-A", trajectory="traj-1")
-
-    drive_concurrent_staining(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        stitcher=stitcher,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=[slide],
-        max_rounds=2,
+    assert segmenter.max_in_flight == 1
+    assert len(stitcher.inputs) == 4
+    assert len(yielded) == 8
+
+
+def test_concurrent_staining_6_restains_until_max_rounds(captured_logs):
+    """An under-stained slide is stained and re-imaged up to ``max_rounds`` times."""
+    state = AppState()
+    slide = Slide(name="s1", protocol="staining")
+
+    yielded, opentrons, stitcher = drive_concurrent_staining_6(
+        [slide], state=state, target_stain_percentage=100.0, max_rounds=2
     )
 
-    assert opentrons.run_protocols == ["stain-A", "stain-A"]
-    # 1 initial imaging + 2 re-images after staining.
-    assert len(stitcher.inputs) == 3
+    assert opentrons.runs == ["staining", "staining"]
+    assert len(stitcher.inputs) == 3  # 1 initial imaging + 2 re-images
+    assert len(yielded) == 6
+    assert state.staining_rounds["s1"] == 2
+    assert state.slide_status["s1"] == SlideStatus.DONE
+    assert sum("staining (round" in m for m in captured_logs) == 2
     assert any("done" in m for m in captured_logs)
 
 
-def test_well_stained_slides_are_not_stained(
-    robot, opentrons, microscope, stitcher, segmenter, captured_logs
-):
-    """Slides already at/above target are imaged once and never touched again."""
-    slides = [
-        Slide(name="s1", protocol="stain-A", trajectory="traj-1"),
-        Slide(name="s2", protocol="stain-B", trajectory="traj-2"),
-    ]
-    analyzer = FakeAnalyzer([0.9, 0.85])  # both above the 0.8 target
+def test_concurrent_staining_6_restains_a_slide_measured_below_target(stained_fractions):
+    stained_fractions.extend([0.5, 0.9])
 
-    yielded = drive_concurrent_staining(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        stitcher=stitcher,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=slides,
+    _, opentrons, stitcher = drive_concurrent_staining_6(
+        [Slide(name="s1", protocol="staining")], target_stain_percentage=0.8
     )
 
-    assert opentrons.run_protocols == []
-    assert len(stitcher.inputs) == 2  # each slide imaged exactly once
-    assert len(yielded) == 4
-    assert all("done" in m for m in captured_logs)
+    assert opentrons.runs == ["staining"]
+    assert len(stitcher.inputs) == 2
 
 
-def test_state_tracks_each_slide_through_the_workflow(
-    robot, opentrons, microscope, stitcher, segmenter, captured_logs
-):
-    """The injected AppState records every slide's final status, rounds and images."""
+def _image(array: np.ndarray, chunks: int) -> SimpleNamespace:
+    """A stand-in for a mikro Image whose ``data`` is a chunked (c, t, z, y, x) array."""
+    data = da.from_array(array[:, None, None], chunks=(1, 1, 1, chunks, chunks))
+    return SimpleNamespace(data=xr.DataArray(data, dims=["c", "t", "z", "y", "x"]))
+
+
+def test_quantify_stain_measures_cells_across_chunk_borders():
+    labels = np.zeros((8, 8), dtype=np.uint16)
+    labels[2:6, 2:6] = 1  # straddles all four 4x4 chunks
+    labels[0:2, 6:8] = 2
+    labels[6:8, 0:2] = 3
+    stain = np.ones((8, 8))
+    stain[labels == 1] = 5.0  # stained
+    stain[labels == 2] = 1.5  # faint, below twice the background
+    stain[labels == 3] = 2.0  # exactly twice the background
+    nuclei = np.zeros((8, 8))
+
+    async def _run() -> app.StainQuantification:
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            return await quantify_stain(
+                _image(np.stack([nuclei, stain]), chunks=4),
+                _image(labels[None], chunks=4),
+                stain_channel=1,
+                executor=executor,
+            )
+
+    quantified = asyncio.run(_run())
+
+    assert (quantified.cells, quantified.stained_cells) == (3, 2)
+    assert quantified.stained_fraction == pytest.approx(2 / 3)
+
+
+def test_quantify_pool_does_not_fork_the_agent(monkeypatch):
+    monkeypatch.setattr(app, "_quantify_executor", None)
+    pool = app._quantify_pool()
+    try:
+        assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+    finally:
+        pool.shutdown()
+
+
+def test_count_cells_counts_each_label_once_across_chunks():
+    labels = np.zeros((8, 8), dtype=np.uint16)
+    labels[2:6, 2:6] = 1  # straddles all four 4x4 chunks
+    labels[0:2, 6:8] = 7
+
+    assert count_cells(_image(labels[None], chunks=4)) == 2
+
+
+def test_concurrent_staining_6_tracks_state_per_slide(captured_logs):
+    """Every slide ends DONE with its latest stitched and segmented images."""
     state = AppState()
-    slides = [
-        Slide(name="s1", protocol="stain-A", trajectory="traj-1"),  # needs one round
-        Slide(name="s2", protocol="stain-B", trajectory="traj-2"),  # already good
-    ]
-    # s1: under target then clears; s2: above target immediately.
-    analyzer = FakeAnalyzer([0.1, 0.9, 0.9])
-
-    drive_concurrent_staining(
-        robot=robot,
-        opentrons=opentrons,
-        microscope=microscope,
-        stitcher=stitcher,
-        segmenter=segmenter,
-        analyzer=analyzer,
-        loaded_slides=slides,
-        state=state,
-    )
+    slides = [Slide(name="s1", protocol="staining"), Slide(name="s2", protocol="washing")]
 
-    # Both slides end DONE, and no slide is left mid-acquisition.
-    assert dict(state.slide_status) == {
-        "s1": SlideStatus.DONE,
-        "s2": SlideStatus.DONE,
-    }
+    drive_concurrent_staining_6(slides, state=state)
+
+    assert dict(state.slide_status) == {"s1": SlideStatus.DONE, "s2": SlideStatus.DONE}
     assert state.currently_imaging_slide is None
-    # s1 went through one staining round; s2 needed none.
-    assert state.staining_rounds["s1"] == 1
-    assert state.staining_rounds["s2"] == 0
-    # Latest stitched/segmented images are recorded for both slides.
+    assert state.staining_rounds == {"s1": 0, "s2": 0}
     assert set(state.latest_images) == {"s1", "s2"}
-    assert set(state.latest_segmented) == {"s1", "s2"}
-    # s1's staining round and both completions were logged.
-    assert any("staining" in m for m in captured_logs)
-    assert sum("done" in m for m in captured_logs) == 2
+    assert state.latest_segmented["s1"] == _img("cells-stitched-stage-1")
+
+
+def _record(round_: int, well: str = "A1") -> ImageRecord:
+    return ImageRecord(
+        round=round_, well=well, stitched=_img(f"st-{round_}"), segmented=_img(f"m-{round_}")
+    )
 
 
-def test_state_reports_in_progress_statuses_mid_run():
-    """While a compute task is blocked, its slide shows ANALYZING and others QUEUED."""
+def test_image_history_keeps_the_last_results_of_each_slide():
     state = AppState()
-    slides = [
-        Slide(name="s1", protocol="stain-A", trajectory="traj-1"),
-        Slide(name="s2", protocol="stain-B", trajectory="traj-2"),
-    ]
 
-    async def _run() -> None:
-        # Block segmentation so the run cannot complete; inspect state mid-flight.
-        gate = asyncio.Event()
+    for round_ in range(4):
+        record_history(state, "s1", _record(round_), keep=2, max_entries=100)
+    record_history(state, "s2", _record(0), keep=2, max_entries=100)
+    record_history(state, "s1", _record(4), keep=2, max_entries=100)
 
-        class BlockingSegmenter(FakeSegmenter):
-            async def segment_image(self, image: Image) -> Image:
-                await gate.wait()
-                return await super().segment_image(image)
-
-        agen = run_concurrent_staining(
-            robot=FakeRobot(),
-            opentrons=FakeOpentrons(),
-            microscope=FakeMicroscope(),
-            stitcher=FakeStitcher(),
-            segmenter=BlockingSegmenter(),
-            analyzer=FakeAnalyzer([0.9, 0.9]),
-            state=state,
-            loaded_slides=slides,
-            microscope_trajectory="to_microscope",
-            opentrons_trajectory="to_opentrons",
-            tile_positions=["p1", "p2"],
-        )
-        # Drive the generator in the background; it will hang on the gated segmenter.
-        consumer = asyncio.ensure_future(_drain(agen))
-        await asyncio.sleep(0.05)  # let both slides get imaged and analysis start
+    assert [record.round for record in state.image_history["s1"]] == [3, 4]
+    assert list(state.image_history) == ["s2", "s1"]  # least recently imaged first
 
-        # Both slides have been imaged and handed off to (blocked) compute.
-        assert state.slide_status["s1"] == SlideStatus.ANALYZING
-        assert state.slide_status["s2"] == SlideStatus.ANALYZING
-        assert state.currently_imaging_slide is None
 
-        gate.set()  # release segmentation so the workflow can finish cleanly
+def test_concurrent_staining_6_needs_some_history_per_slide():
+    with pytest.raises(ValueError, match="history_per_slide"):
+        drive_concurrent_staining_6([Slide(name="s1", protocol="washing")], history_per_slide=0)
+
+
+def test_image_history_evicts_the_least_recently_imaged_done_slides():
+    state = AppState()
+    for name in ("old", "busy", "recent"):
+        record_history(state, name, _record(0), keep=5, max_entries=100)
+        state.latest_images[name] = _img(f"st-{name}")
+    state.slide_status.update(
+        old=SlideStatus.DONE, busy=SlideStatus.ANALYZING, recent=SlideStatus.DONE
+    )
+
+    evict_done_slides(state, max_entries=2)
+
+    assert list(state.image_history) == ["busy", "recent"]
+    assert set(state.latest_images) == {"busy", "recent"}
+
+    evict_done_slides(state, max_entries=0)
+
+    assert list(state.image_history) == ["busy"]  # slides in progress are never evicted
+
+
+def test_concurrent_staining_6_keeps_the_image_history_of_every_round():
+    state = AppState()
+
+    drive_concurrent_staining_6(
+        [Slide(name="s1", protocol="staining", wells=["A1", "A2"])],
+        state=state,
+        target_stain_percentage=100.0,
+        max_rounds=2,
+        history_per_slide=4,
+    )
+
+    history = state.image_history["s1"]
+    assert [record.round for record in history] == [1, 1, 2, 2]
+    assert {record.well for record in history[-2:]} == {"A1", "A2"}
+    assert history[-1].segmented == state.latest_segmented["s1"]
+
+
+def test_concurrent_staining_6_reports_in_progress_statuses_mid_run():
+    """While compute is blocked, imaged slides show ANALYZING and none is on the FRAME."""
+    state = AppState()
+    slides = [Slide(name="s1", protocol="staining"), Slide(name="s2", protocol="washing")]
+
+    async def _run() -> None:
+        # Block segmentation so the run cannot complete; inspect state mid-flight.
+        gate = asyncio.Event()
+
+        class BlockingCellpose(FakeCellpose):
+            async def run_cellpose_SAM(self, image: Image, **kwargs):
+                await gate.wait()
+                return await super().run_cellpose_SAM(image, **kwargs)
+
+        agen = run_concurrent_staining_6(
+            robot=FakeFairino([]),
+            opentrons=FakeOT2([]),
+            microscope=FakeFrame([], duration=0.001),
+            stitcher=FakeStageStitcher(),
+            segmenter=BlockingCellpose(),
+            state=state,
+            loaded_slides=slides,
+        )
+        consumer = asyncio.ensure_future(_drain(agen))
+        await asyncio.sleep(0.1)  # let both slides get imaged and analysis start
+
+        assert state.slide_status["s1"] == SlideStatus.ANALYZING
+        assert state.slide_status["s2"] == SlideStatus.ANALYZING
+        assert state.currently_imaging_slide is None
+
+        gate.set()  # release segmentation so the workflow can finish cleanly
         await asyncio.wait_for(consumer, timeout=2.0)
 
     async def _drain(agen) -> None:
@@ -600,3 +1164,953 @@ def test_state_reports_in_progress_statuses_mid_run():
 
     asyncio.run(_run())
     assert dict(state.slide_status) == {"s1": SlideStatus.DONE, "s2": SlideStatus.DONE}
+
+
+def test_concurrent_staining_6_decides_on_all_wells_of_a_slide(captured_logs):
+    slide = Slide(name="s1", protocol="staining", wells=["A1", "A2", "B1"])
+
+    yielded, opentrons, stitcher = drive_concurrent_staining_6(
+        [slide], target_stain_percentage=100.0, max_rounds=1
+    )
+
+    assert len(stitcher.inputs) == 6  # three wells, imaged twice
+    assert opentrons.runs == ["staining"]
+    assert len(yielded) == 12
+    assert sum("staining (round" in message for message in captured_logs) == 1
+
+
+def test_concurrent_staining_6_stains_queued_slides_in_one_run():
+    slides = [Slide(name=f"s{i}", protocol="staining") for i in range(3)]
+
+    _, opentrons, stitcher = drive_concurrent_staining_6(
+        slides, target_stain_percentage=100.0, max_rounds=1, deck_capacity=3
+    )
+
+    assert len(stitcher.inputs) == 6  # every slide imaged twice
+    assert len(opentrons.runs) < 3
+
+
+def test_concurrent_staining_6_rejects_a_slide_without_wells():
+    with pytest.raises(ValueError, match="no wells"):
+        drive_concurrent_staining_6([Slide(name="s1", protocol="staining", wells=[])])
+
+
+# --- Call latency instrumentation tests -------------------------------------
+
+
+def test_latency_recorder_summarizes_each_method():
+    """Counts, errors and the max are cumulative; percentiles use the window."""
+    state = AppState()
+    recorder = app.LatencyRecorder(window=4)
+
+    for seconds in (1.0, 2.0, 3.0, 4.0, 10.0):
+        recorder.record(state, "OT2.run_washing_protocol", seconds)
+    recorder.record(state, "OT2.run_washing_protocol", 5.0, failed=True)
+
+    # ``@state`` hands back evented copies of nested models, so compare their fields.
+    assert dataclasses.asdict(state.call_latency["OT2.run_washing_protocol"]) == dataclasses.asdict(
+        CallLatency(count=6, errors=1, p50=4.0, p95=10.0, max=10.0)
+    )
+
+
+def test_stainstorm_7_publishes_latency_per_remote_call():
+    state = AppState()
+
+    drive_stainstorm_7([Slide(name="s1", protocol="washing")], state=state)
+
+    latency = state.call_latency
+    assert latency["fairinogale.pick_up_frame"].count == 2
+    assert latency["FRAME Fork Approval.run_well_tile_scan"].count == 2
+    assert latency["OT2.run_washing_protocol"].count == 1
+    assert latency["cellpose-ARK.run_cellpose_SAM"].count == 2
+    assert latency["correct_coordinate_system.invert_x_axis"].count == 2
+    scan = latency["FRAME Fork Approval.run_well_tile_scan"]
+    assert 0.0 < scan.p50 <= scan.p95 <= scan.max
+    assert all(entry.errors == 0 for entry in latency.values())
+
+
+def test_failed_remote_call_is_counted_and_reraised():
+    state = AppState()
+
+    class BrokenCellpose(FakeCellpose):
+        async def run_cellpose_SAM(self, image: Image, **kwargs):
+            raise RuntimeError("GPU node went away")
+
+    with pytest.raises(RuntimeError, match="GPU node"):
+        collect(
+            run_concurrent_staining_6(
+                robot=FakeFairino([]),
+                opentrons=FakeOT2([]),
+                microscope=FakeFrame([], duration=0.001),
+                stitcher=FakeStageStitcher(),
+                segmenter=BrokenCellpose(),
+                state=state,
+                loaded_slides=[Slide(name="s1", protocol="staining")],
+            )
+        )
+
+    retries = app.CALL_POLICIES["cellpose-ARK.run_cellpose_SAM"].retries
+    assert state.call_latency["cellpose-ARK.run_cellpose_SAM"].errors == 1 + retries
+    assert state.call_latency["stainstorm-stitch.stitch_stage"].errors == 0
+
+
+# --- Timeout, retry and hedging tests ---------------------------------------
+
+
+class ScriptedCellpose:
+    """Cellpose whose n-th call sleeps ``delays[n]`` seconds, or raises if that is an exception."""
+
+    def __init__(self, delays: list) -> None:
+        self.delays = delays
+        self.calls = 0
+
+    async def run_cellpose_SAM(self, image: Image, **_) -> tuple:
+        delay = self.delays[self.calls]
+        self.calls += 1
+        if isinstance(delay, Exception):
+            raise delay
+        await asyncio.sleep(delay)
+        return _img(f"cells-{self.calls}"), None, None
+
+
+def _segment_with_policies(segmenter, state: AppState):
+    async def _run():
+        device = app.with_call_policies(segmenter, app.SegmenterLike, state)
+        return await device.run_cellpose_SAM(_img("img"))
+
+    return asyncio.run(_run())
+
+
+def test_a_failed_compute_call_is_retried_at_step_granularity(captured_logs):
+    segmenter = ScriptedCellpose([RuntimeError("node restarted"), 0.0])
+
+    cells, _, _ = _segment_with_policies(segmenter, AppState())
+
+    assert cells == "cells-2"
+    assert any("retrying" in message for message in captured_logs)
+
+
+def test_a_stuck_compute_call_times_out(call_policies):
+    call_policies["cellpose-ARK.run_cellpose_SAM"] = app.CallPolicy(timeout=0.05)
+
+    with pytest.raises(TimeoutError):
+        _segment_with_policies(ScriptedCellpose([10.0]), AppState())
+
+
+def test_a_lone_instance_is_never_hedged(call_policies, captured_logs):
+    call_policies["cellpose-ARK.run_cellpose_SAM"] = app.CallPolicy(hedge=True, hedge_after=5)
+    state = AppState()
+    state.call_latency["cellpose-ARK.run_cellpose_SAM"] = CallLatency(
+        count=50, errors=0, p50=0.01, p95=0.02, max=0.05
+    )
+    segmenter = ScriptedCellpose([0.05])
+
+    async def _run():
+        pool = app.ComputePool([segmenter], app.SegmenterLike, state)
+        device = app.with_call_policies(pool, app.SegmenterLike, state)
+        return await device.run_cellpose_SAM(_img("img"))
+
+    cells, _, _ = asyncio.run(_run())
+
+    assert cells == "cells-1"
+    assert segmenter.calls == 1
+    assert not any("hedging" in message for message in captured_logs)
+
+
+def test_calls_are_not_hedged_before_enough_latency_is_known(call_policies):
+    call_policies["cellpose-ARK.run_cellpose_SAM"] = app.CallPolicy(hedge=True, hedge_after=5)
+    segmenter = ScriptedCellpose([0.05])
+
+    _segment_with_policies(segmenter, AppState())
+
+    assert segmenter.calls == 1
+
+
+# --- Compute pool tests -----------------------------------------------------
+
+
+def test_pool_sends_each_call_to_the_least_loaded_instance():
+    barrier = asyncio.Barrier(4)
+    instances = [FakeCellpose(barrier), FakeCellpose(barrier)]
+    state = AppState()
+
+    async def _run() -> None:
+        pool = app.ComputePool(instances, app.SegmenterLike, state)
+        await asyncio.gather(*(pool.run_cellpose_SAM(_img(f"img-{i}")) for i in range(4)))
+
+    asyncio.run(asyncio.wait_for(_run(), timeout=3.0))
+
+    assert [len(instance.inputs) for instance in instances] == [2, 2]
+    assert [instance.max_in_flight for instance in instances] == [2, 2]
+    for key in ("cellpose-ARK/0", "cellpose-ARK/1"):
+        assert state.compute_instances[key].count == 2
+        assert state.compute_instances[key].outstanding == 0
+
+
+def test_pool_leaves_out_an_instance_that_keeps_failing(captured_logs):
+    failing = ScriptedCellpose([RuntimeError("GPU lost")] * 2)
+    healthy = ScriptedCellpose([0.0, 0.0])
+    state = AppState()
+
+    async def _run() -> list:
+        pool = app.ComputePool([failing, healthy], app.SegmenterLike, state, unhealthy_after=2)
+        results = []
+        for _ in range(4):
+            try:
+                results.append(await pool.run_cellpose_SAM(_img("img")))
+            except RuntimeError:
+                results.append(None)
+        return results
+
+    results = asyncio.run(_run())
+
+    assert results[:2] == [None, None]
+    assert [cells for cells, _, _ in results[2:]] == ["cells-1", "cells-2"]
+    assert state.compute_instances["cellpose-ARK/0"].healthy is False
+    assert state.compute_instances["cellpose-ARK/0"].errors == 2
+    assert any("leaving it out" in message for message in captured_logs)
+
+
+def test_a_hedged_call_goes_to_another_instance(call_policies):
+    call_policies["cellpose-ARK.run_cellpose_SAM"] = app.CallPolicy(hedge=True, hedge_after=5)
+    state = AppState()
+    state.call_latency["cellpose-ARK.run_cellpose_SAM"] = CallLatency(
+        count=50, errors=0, p50=0.01, p95=0.02, max=0.05
+    )
+    stuck, spare = ScriptedCellpose([10.0]), ScriptedCellpose([0.0])
+
+    pool = app.ComputePool([stuck, spare], app.SegmenterLike, state)
+
+    cells, _, _ = _segment_with_policies(pool, state)
+
+    assert cells == "cells-1"
+    assert (stuck.calls, spare.calls) == (1, 1)
+
+
+def test_a_hedge_skips_the_instance_running_the_call_even_when_busy_elsewhere(call_policies):
+    call_policies["cellpose-ARK.run_cellpose_SAM"] = app.CallPolicy(hedge=True, hedge_after=5)
+    state = AppState()
+    state.call_latency["cellpose-ARK.run_cellpose_SAM"] = CallLatency(
+        count=50, errors=0, p50=0.01, p95=0.02, max=0.05
+    )
+    first, second = ScriptedCellpose([10.0]), ScriptedCellpose([0.05, 0.0])
+
+    async def _run():
+        pool = app.ComputePool([first, second], app.SegmenterLike, state)
+        device = app.with_call_policies(pool, app.SegmenterLike, state)
+        hedged = asyncio.ensure_future(device.run_cellpose_SAM(_img("x")))
+        await asyncio.sleep(0)  # "x" is running on the first instance
+        other = asyncio.ensure_future(pool.run_cellpose_SAM(_img("other")))
+        return await asyncio.gather(hedged, other)
+
+    asyncio.run(_run())
+
+    # Both instances have a call outstanding, but the duplicate of "x" avoids its own.
+    assert (first.calls, second.calls) == (1, 2)
+
+
+def test_blocking_compute_calls_run_on_their_own_threads():
+    class BlockingCellpose:
+        def run_cellpose_SAM(self, image, **_):
+            return threading.current_thread().name
+
+    async def _run():
+        pool = app.ComputePool([BlockingCellpose()], app.SegmenterLike, AppState())
+        return await pool.run_cellpose_SAM(_img("img"))
+
+    assert asyncio.run(_run()).startswith("compute")
+
+
+def test_no_hedge_goes_to_an_instance_that_is_left_out(call_policies):
+    call_policies["cellpose-ARK.run_cellpose_SAM"] = app.CallPolicy(hedge=True, hedge_after=5)
+    state = AppState()
+    state.call_latency["cellpose-ARK.run_cellpose_SAM"] = CallLatency(
+        count=50, errors=0, p50=0.01, p95=0.02, max=0.05
+    )
+    failing, slow = ScriptedCellpose([RuntimeError("GPU lost")]), ScriptedCellpose([0.05])
+
+    async def _run():
+        pool = app.ComputePool([failing, slow], app.SegmenterLike, state, unhealthy_after=1)
+        with pytest.raises(RuntimeError):
+            await pool.run_cellpose_SAM(_img("img"))
+        device = app.with_call_policies(pool, app.SegmenterLike, state)
+        return await device.run_cellpose_SAM(_img("img"))
+
+    cells, _, _ = asyncio.run(_run())
+
+    assert cells == "cells-1"
+    assert (failing.calls, slow.calls) == (1, 1)
+
+
+def test_concurrent_staining_6_spreads_segmentation_over_every_segmenter():
+    barrier = asyncio.Barrier(4)
+    segmenters = [FakeCellpose(barrier), FakeCellpose(barrier)]
+    slides = [Slide(name=f"s{i}", protocol="staining") for i in range(4)]
+    state = AppState()
+
+    async def _run() -> list[Image]:
+        agen = run_concurrent_staining_6(
+            robot=FakeFairino([]),
+            opentrons=FakeOT2([]),
+            microscope=FakeFrame([], duration=0.001),
+            stitcher=FakeStageStitcher(),
+            segmenter=segmenters,
+            state=state,
+            loaded_slides=slides,
+            segmentation_window=0.0,
+        )
+        return [item async for item in agen]
+
+    asyncio.run(asyncio.wait_for(_run(), timeout=3.0))
+
+    assert [len(segmenter.inputs) for segmenter in segmenters] == [2, 2]
+    assert state.compute_instances["cellpose-ARK/1"].count == 2
+    assert state.compute_instances["stainstorm-stitch/0"].count == 4
+
+
+# --- Call memoization tests ------------------------------------------------
+
+
+class IdentifiedCellpose:
+    """Stand-in for ``SegmenterLike`` that returns mikro-like objects with ids."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def run_cellpose_SAM(self, image, **_) -> tuple:
+        self.calls += 1
+        parts = ("cells", "flows", "styles")
+        return tuple(SimpleNamespace(id=f"{part}-{image.id}") for part in parts)
+
+
+@pytest.fixture
+def loaded_images(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """Hand out images by id, as mikro would, recording every id looked up."""
+    loaded: list[str] = []
+
+    async def aget_image(image_id: str) -> SimpleNamespace:
+        loaded.append(image_id)
+        return SimpleNamespace(id=image_id)
+
+    monkeypatch.setattr(app, "aget_image", aget_image)
+    return loaded
+
+
+def test_a_repeated_compute_call_is_answered_from_the_cache(tmp_path, monkeypatch, loaded_images):
+    path = str(tmp_path / "calls.json")
+    monkeypatch.setattr(app, "call_cache", CallCache(path))
+    cellpose = IdentifiedCellpose()
+    segmenter = memoized(cellpose, app.SegmenterLike)
+    image = SimpleNamespace(id="img-1")
+
+    async def _run() -> list:
+        results = [
+            await segmenter.run_cellpose_SAM(image, diameter=13),
+            await segmenter.run_cellpose_SAM(image, diameter=13),
+            await segmenter.run_cellpose_SAM(image, diameter=20),
+        ]
+        await app.call_cache.flush()
+        return results
+
+    first, again, other = asyncio.run(_run())
+
+    assert cellpose.calls == 2
+    assert [part.id for part in again] == [part.id for part in first]
+    assert loaded_images == ["cells-img-1", "flows-img-1", "styles-img-1"]
+    assert len(CallCache(path)) == 2  # persisted
+
+
+def test_call_cache_evicts_least_recently_used_and_expired_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "time", lambda: now[0])
+    cache = CallCache(max_entries=2, max_age=60.0)
+    cache.put("a", "app.call", [], "id-a")
+    cache.put("b", "app.call", [], "id-b")
+    assert cache.get("a") == "id-a"
+
+    cache.put("c", "app.call", [], "id-c")
+    assert cache.get("b") is None  # least recently used
+    now[0] += 61.0
+    assert cache.get("a") is None  # too old
+    assert len(cache) == 1
+
+
+def test_call_cache_writes_its_file_off_the_event_loop(tmp_path, monkeypatch):
+    path = tmp_path / "state" / "calls.json"
+    cache = CallCache(str(path))
+    writes: list[int] = []
+    write_json = app.write_json
+
+    def counted_write(target, data, indent=None):
+        writes.append(len(data["entries"]))
+        write_json(target, data, indent)
+
+    monkeypatch.setattr(app, "write_json", counted_write)
+
+    async def _run() -> None:
+        for key in "abc":
+            cache.put(key, "app.call", [], f"id-{key}")
+        assert not path.exists()  # nothing was written on the loop
+        await cache.flush()
+
+    asyncio.run(_run())
+
+    assert writes == [3]  # changes made before the write starts share it
+    assert len(CallCache(str(path))) == 3
+
+
+def test_state_files_default_to_the_state_directory(monkeypatch):
+    monkeypatch.delenv("STAINSTORM_CALL_CACHE", raising=False)
+    assert app.state_file("STAINSTORM_CALL_CACHE", "call_cache.json") == os.path.join(
+        app.STATE_DIR, "call_cache.json"
+    )
+    monkeypatch.setenv("STAINSTORM_CALL_CACHE", "/elsewhere/calls.json")
+    assert app.state_file("STAINSTORM_CALL_CACHE", "call_cache.json") == "/elsewhere/calls.json"
+
+
+def test_unreadable_state_files_are_logged_and_start_empty(tmp_path, captured_logs):
+    corrupt = tmp_path / "corrupt.json"
+    corrupt.write_text('{"entries": ')
+    wrong_shape = tmp_path / "wrong_shape.json"
+    wrong_shape.write_text('{"something": "else"}')
+
+    for path in (corrupt, wrong_shape):
+        assert len(CallCache(str(path))) == 0
+        assert app.DurationModel(str(path)).mean("OT2.run_washing_protocol") is None
+        registry = app.WellRegistry(str(path))
+        assert (registry.version, registry.wells()) == (0, {})
+    assert len(captured_logs) == 6
+    assert all("starting empty" in message for message in captured_logs)
+
+
+def test_concurrent_json_writes_leave_a_whole_file(tmp_path):
+    path = str(tmp_path / "state.json")
+
+    def write(n: int) -> None:
+        for _ in range(20):
+            app.write_json(path, {"n": n, "padding": "x" * 10_000})
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(path) as f:
+        assert json.load(f)["n"] in range(4)
+    assert os.listdir(tmp_path) == ["state.json"]  # no temporary file left behind
+
+
+def test_cached_results_can_be_invalidated(
+    call_cache, loaded_images, captured_logs, monkeypatch
+):
+    cellpose = IdentifiedCellpose()
+    segmenter = memoized(cellpose, app.SegmenterLike)
+
+    async def _segment(image_id: str) -> tuple:
+        return await segmenter.run_cellpose_SAM(SimpleNamespace(id=image_id))
+
+    for image_id in ("img-1", "img-2"):
+        asyncio.run(_segment(image_id))
+    assert clear_call_cache(input_id="img-1") == 1
+    asyncio.run(_segment("img-1"))
+    assert cellpose.calls == 3
+
+    async def lost(image_id: str) -> None:
+        raise LookupError(image_id)
+
+    monkeypatch.setattr(app, "aget_image", lost)
+    asyncio.run(_segment("img-2"))  # a result deleted on the server is recomputed
+    assert cellpose.calls == 4
+    assert any("could not be loaded" in message for message in captured_logs)
+    assert clear_call_cache(method="cellpose-ARK.run_cellpose_SAM") == 2
+    assert len(call_cache) == 0
+
+
+# --- State publishing tests -------------------------------------------------
+
+
+class RecordingPublisher:
+    def __init__(self) -> None:
+        self.patches: list[tuple[str, str, object]] = []
+
+    def publish_patch(self, interface: str, patch: Patch) -> None:
+        self.patches.append((patch.op, patch.path, patch.value))
+
+
+def test_publisher_sends_each_changed_value_once_per_interval():
+    inner = RecordingPublisher()
+    publisher = CoalescingPublisher(inner, interval=0.05)
+    publish = functools.partial(publisher.publish_patch, "AppState")
+
+    async def _run() -> list:
+        for status in (SlideStatus.QUEUED, SlideStatus.IMAGING, SlideStatus.ANALYZING):
+            publish(Patch(op="replace", path="/slide_status/s1", value=status))
+        publish(Patch(op="add", path="/staining_rounds/s1", value=0))
+        publish(Patch(op="replace", path="/staining_rounds/s1", value=1))
+        held = list(inner.patches)
+        await asyncio.sleep(0.1)
+        return held
+
+    assert asyncio.run(_run()) == []
+    assert inner.patches == [
+        ("replace", "/slide_status/s1", SlideStatus.ANALYZING),
+        ("add", "/staining_rounds/s1", 1),
+    ]
+    assert (publisher.received, publisher.sent) == (5, 2)
+
+
+def test_publisher_keeps_patches_behind_a_list_insert_in_order():
+    inner = RecordingPublisher()
+    publisher = CoalescingPublisher(inner, interval=10.0)
+
+    async def _run() -> None:
+        with publisher:
+            assert get_current_publisher() is publisher
+            for op, path, value in (("replace", "1", 1), ("add", "0", 9), ("replace", "1", 2)):
+                patch = Patch(op=op, path=f"/cell_counts/s1/{path}", value=value)
+                publisher.publish_patch("AppState", patch)
+        publisher.flush()
+
+    asyncio.run(_run())
+
+    assert inner.patches == [
+        ("replace", "/cell_counts/s1/1", 1),
+        ("add", "/cell_counts/s1/0", 9),
+        ("replace", "/cell_counts/s1/1", 2),
+    ]
+    assert get_current_publisher() is None
+
+
+def test_publisher_forwards_right_away_without_an_interval():
+    inner = RecordingPublisher()
+
+    CoalescingPublisher(inner, interval=0.0).publish_patch(
+        "AppState", Patch(op="replace", path="/currently_imaging_slide", value="s1")
+    )
+
+    assert inner.patches == [("replace", "/currently_imaging_slide", "s1")]
+
+
+# --- Device state tests -----------------------------------------------------
+
+
+def test_stainstorm_7_initializes_and_homes_only_once():
+    """Init and homing happen once per run, not per slide and iteration."""
+    state = AppState()
+    slides = [Slide(name="s1", protocol="washing"), Slide(name="s2", protocol="washing")]
+
+    _, _, robot, _, microscope, _ = drive_stainstorm_7(
+        slides, max_iterations=2, state=state
+    )
+
+    assert robot.calls.count(("init_robot_and_gripper",)) == 1
+    assert microscope.homings == 1
+    assert dataclasses.asdict(state.devices) == dataclasses.asdict(
+        DeviceState(
+            robot_initialized=True,
+            gripper=Gripper.OPEN,
+            arm_location=ArmLocation.OPENTRONS,
+            stage_homed=True,
+        )
+    )
+
+
+def test_known_device_state_carries_over_to_the_next_run():
+    state = AppState()
+    slide = Slide(name="s1", protocol="washing")
+    drive_stainstorm_7([slide], state=state)
+
+    _, _, robot, _, microscope, _ = drive_stainstorm_7([slide], state=state)
+
+    assert ("init_robot_and_gripper",) not in robot.calls
+    assert microscope.homings == 0
+
+
+def test_failed_robot_move_forces_reinitialization():
+    """A failing transfer forgets the robot state; the next run initializes again."""
+    state = AppState()
+    slide = Slide(name="s1", protocol="washing")
+
+    class JammedFairino(FakeFairino):
+        async def pick_up_frame(self, sample: str, **_) -> None:
+            raise RuntimeError("gripper jammed")
+
+    with pytest.raises(RuntimeError, match="jammed"):
+        drive_stainstorm_7([slide], state=state, robot=JammedFairino([]))
+
+    assert state.devices.robot_initialized is False
+    assert state.devices.gripper is None
+    assert state.devices.stage_homed is True  # the microscope did not fail
+
+    _, _, robot, _, microscope, _ = drive_stainstorm_7([slide], state=state)
+    assert robot.calls.count(("init_robot_and_gripper",)) == 1
+    assert microscope.homings == 0
+
+
+def test_reset_device_state_forgets_everything():
+    state = AppState()
+    drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")], state=state, focus_refinement_range=5
+    )
+
+    reset_device_state(state=state)
+
+    assert dataclasses.asdict(state.devices) == dataclasses.asdict(DeviceState())
+    assert state.focus_maps == {}
+
+
+# --- Motion profile tests --------------------------------------------------
+
+
+def test_every_transfer_leg_runs_with_its_motion_profile():
+    state = AppState()
+    set_motion_profile(state=state, leg="pick_up_opentrons", speed=80, danger_speed=10)
+    set_motion_profile(state=state, leg="release_at_frame", sample_type="ibidi", speed=60)
+    set_motion_profile(state=state, leg="release_at_frame", acceleration=40)
+
+    slides = [
+        Slide(name="s1", protocol="washing", sample_type="ibidi"),
+        Slide(name="s2", protocol="washing"),
+    ]
+
+    _, _, robot, _, _, _ = drive_stainstorm_7(slides, max_iterations=0, state=state)
+
+    by_slide = {(leg, sample): motion for leg, sample, motion in robot.motion}
+    assert by_slide[("pick_up_opentrons", "s1")] == {"speed": 80, "dangerSpeed": 10}
+    assert by_slide[("release_at_frame", "s1")] == {"speed": 60}
+    assert by_slide[("release_at_frame", "s2")] == {"acceleration": 40}
+    assert by_slide[("pick_up_frame", "s2")] == {}
+
+
+def test_set_motion_profile_validates_the_leg_and_clears_empty_profiles():
+    state = AppState()
+    set_motion_profile(state=state, leg="pick_up_frame", speed=50)
+    assert {key: dataclasses.asdict(p) for key, p in state.motion_profiles.items()} == {
+        "pick_up_frame": dataclasses.asdict(MotionProfile(speed=50))
+    }
+
+    set_motion_profile(state=state, leg="pick_up_frame")
+    assert state.motion_profiles == {}
+
+    with pytest.raises(ValueError, match="Unknown robot leg"):
+        set_motion_profile(state=state, leg="teleport", speed=100)
+
+
+# --- Focus cache tests ------------------------------------------------------
+
+
+def test_stainstorm_7_refines_the_focus_of_a_well_scanned_last():
+    state = AppState()
+
+    _, _, _, _, microscope, _ = drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")],
+        max_iterations=2,
+        state=state,
+        focus_refinement_range=5,
+    )
+
+    assert microscope.settings == [{}, {"autofocus_range": 5}, {"autofocus_range": 5}]
+    assert state.focus_maps["s1/A1"].scans == 3
+
+
+def test_focus_is_swept_again_after_another_well_was_scanned():
+    state = AppState()
+    slide = Slide(name="s1", protocol="washing", wells=["A1", "A2"])
+
+    _, _, _, _, microscope, _ = drive_stainstorm_7(
+        [slide], max_iterations=2, state=state, focus_refinement_range=5
+    )
+
+    # A1 and A2 alternate, so the stage is never left at the well to refine.
+    assert microscope.settings == [{}] * 6
+    assert state.focus_maps["s1/A1"].scans == 3
+    assert list(state.focus_maps) == ["s1/A1", "s1/A2"]
+
+
+def test_homing_the_stage_drops_the_focus_cache():
+    state = AppState()
+    state.focus_maps["s1/A1"] = WellFocus(scans=4)
+
+    _, _, _, _, microscope, _ = drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")],
+        max_iterations=0,
+        state=state,
+        focus_refinement_range=5,
+    )
+
+    assert microscope.homings == 1
+    assert microscope.settings == [{}]
+    assert state.focus_maps["s1/A1"].scans == 1
+
+
+def test_focus_is_not_refined_without_a_refinement_range():
+    _, _, _, _, microscope, _ = drive_stainstorm_7(
+        [Slide(name="s1", protocol="washing")], max_iterations=2
+    )
+
+    assert microscope.settings == [{}] * 3
+
+
+# --- Segmentation batching tests -------------------------------------------
+
+
+def test_batcher_submits_requests_arriving_together_as_one_batch():
+    segmenter = FakeCellpose()
+
+    async def _run():
+        batcher = SegmentationBatcher(segmenter, window=0.05, max_batch=8)
+
+        async def late(image: Image):
+            await asyncio.sleep(0.02)
+            return await batcher.segment(image)
+
+        return await asyncio.gather(
+            batcher.segment(_img("a")), batcher.segment(_img("b")), late(_img("c"))
+        )
+
+    results = asyncio.run(_run())
+
+    assert [cells for cells, _, _ in results] == ["cells-a", "cells-b", "cells-c"]
+    assert segmenter.max_in_flight == 3  # submitted in one burst
+
+
+def test_batcher_shares_one_call_between_identical_requests():
+    segmenter = FakeCellpose()
+
+    async def _run():
+        batcher = SegmentationBatcher(segmenter, window=0.01)
+        return await asyncio.gather(
+            batcher.segment(_img("a"), gpu=True),
+            batcher.segment(_img("a"), gpu=True),
+            batcher.segment(_img("a"), gpu=False),
+        )
+
+    first, second, third = asyncio.run(_run())
+
+    assert first == second == third
+    assert segmenter.inputs == ["a", "a"]  # gpu=True once, gpu=False once
+
+
+def test_batcher_by_default_only_shares_requests_made_together():
+    segmenter = FakeCellpose()
+
+    async def _run():
+        batcher = SegmentationBatcher(segmenter)
+        together = await asyncio.gather(batcher.segment(_img("a")), batcher.segment(_img("a")))
+        return together, await batcher.segment(_img("a"))
+
+    (first, second), later = asyncio.run(_run())
+
+    assert first == second == later
+    assert segmenter.inputs == ["a", "a"]  # the later request is not held back to share
+
+
+def test_batcher_closes_a_full_batch_without_waiting_for_the_window():
+    segmenter = FakeCellpose()
+
+    async def _run():
+        batcher = SegmentationBatcher(segmenter, window=60.0, max_batch=2)
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.segment(_img("a")), batcher.segment(_img("b"))),
+            timeout=1.0,
+        )
+
+    assert len(asyncio.run(_run())) == 2
+
+
+def test_batcher_never_holds_a_request_past_max_delay():
+    segmenter = FakeCellpose()
+
+    async def _run():
+        batcher = SegmentationBatcher(segmenter, window=0.05, max_batch=100, max_delay=0.1)
+
+        async def trickle() -> None:
+            for i in range(20):
+                await asyncio.sleep(0.02)
+                asyncio.ensure_future(batcher.segment(_img(f"late-{i}")))
+
+        trickler = asyncio.ensure_future(trickle())
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await batcher.segment(_img("first"))
+        waited = loop.time() - start
+        trickler.cancel()
+        batcher.close()
+        return waited
+
+    assert asyncio.run(_run()) < 0.3
+
+
+def test_batcher_hands_each_caller_its_own_failure():
+    class FlakyCellpose(FakeCellpose):
+        async def run_cellpose_SAM(self, image: Image, **kwargs):
+            if image == "bad":
+                raise RuntimeError("out of GPU memory")
+            return await super().run_cellpose_SAM(image, **kwargs)
+
+    async def _run():
+        batcher = SegmentationBatcher(FlakyCellpose(), window=0.01)
+        return await asyncio.gather(
+            batcher.segment(_img("good")), batcher.segment(_img("bad")), return_exceptions=True
+        )
+
+    good, bad = asyncio.run(_run())
+
+    assert good[0] == "cells-good"
+    assert isinstance(bad, RuntimeError)
+
+
+# --- Local coordinate correction tests --------------------------------------
+
+
+def test_mirror_affine_matrices_matches_the_diagonal_product():
+    matrices = np.arange(2 * 16, dtype=float).reshape(2, 4, 4)
+
+    for axes, mirror in app.AXIS_MIRRORS.items():
+        expected = np.diag(mirror) @ matrices
+        np.testing.assert_array_equal(mirror_affine_matrices(matrices, axes), expected)
+
+
+def test_invert_stage_axes_registers_mirrored_views_locally(monkeypatch, duration_model):
+    views = [
+        SimpleNamespace(image=SimpleNamespace(id=f"img-{i}"), affine_matrix=np.eye(4) * (i + 1))
+        for i in range(3)
+    ]
+    stage = SimpleNamespace(id="stage-1", name="scan", affine_views=views)
+    uploads: list = []
+
+    async def acreate_stage(name):
+        return SimpleNamespace(id="stage-2", name=name)
+
+    async def aget_image(image_id):
+        return SimpleNamespace(data=f"data-{image_id}", name=image_id)
+
+    async def afrom_array_like(data, name, transformation_views):
+        uploads.append((name, transformation_views[0]))
+
+    async def aget_stage(stage_id):
+        return f"fetched-{stage_id}"
+
+    for fn in (acreate_stage, aget_image, afrom_array_like, aget_stage):
+        monkeypatch.setattr(app, fn.__name__, fn)
+
+    class UnusedCorrector:
+        def invert_x_axis(self, stage):
+            raise AssertionError("the remote corrector must not be called")
+
+    state = AppState()
+    result = asyncio.run(invert_stage_axes(stage, "x", UnusedCorrector(), state))
+
+    assert result == "fetched-stage-2"
+    assert state.call_latency["correct_coordinate_system.invert_x_axis"].count == 1
+    assert duration_model.mean("correct_coordinate_system.invert_x_axis") is not None
+    assert [name for name, _ in uploads] == ["img-0", "img-1", "img-2"]
+    for i, (_, view) in enumerate(uploads):
+        assert view.stage == "stage-2"
+        assert np.asarray(view.affine_matrix)[0, 0] == -(i + 1)
+        assert np.asarray(view.affine_matrix)[1, 1] == i + 1
+
+
+def test_invert_stage_axes_falls_back_to_the_remote_corrector(captured_logs):
+    result = asyncio.run(invert_stage_axes(_img("stage-1"), "x", FakeCorrector()))
+
+    assert result == "inverted-stage-1"
+    assert any("remote corrector" in message for message in captured_logs)
+
+
+
+def test_an_unreadable_tile_falls_back_before_any_stage_is_created(monkeypatch):
+    views = [SimpleNamespace(image=SimpleNamespace(id=f"img-{i}"), affine_matrix=np.eye(4)) for i in range(2)]
+    stage = SimpleNamespace(id="stage-1", name="scan", affine_views=views)
+    created: list = []
+
+    async def acreate_stage(name):
+        created.append(name)
+        return SimpleNamespace(id="stage-2", name=name)
+
+    async def aget_image(image_id):
+        if image_id == "img-1":
+            raise LookupError(image_id)
+        return SimpleNamespace(data=None, name=image_id)
+
+    for fn in (acreate_stage, aget_image):
+        monkeypatch.setattr(app, fn.__name__, fn)
+
+    result = asyncio.run(invert_stage_axes(stage, "x", FakeCorrector()))
+
+    assert result == f"inverted-{stage}"
+    assert created == []
+
+# --- Well geometry tests ----------------------------------------------------
+
+
+class TeachingFrame:
+    """Synchronous stand-in for the well-teaching calls of ``FrameLike``."""
+
+    def __init__(self) -> None:
+        self.position = app.PositionModel(x=100, y=200, z=30)
+        self.committed: list[tuple] = []
+
+    def saveFirstWellCorner(self, **_):
+        return self.position
+
+    def getStagePosition(self, **_):
+        return self.position
+
+    def saveSecondWellCorner(self, well_id: str, plate_type: Optional[str] = None, **_):
+        self.committed.append((well_id, plate_type))
+
+
+def test_well_registry_versions_and_persists_taught_wells(tmp_path):
+    path = str(tmp_path / "wells.json")
+    registry = WellRegistry(path)
+
+    registry.teach("ibidi-8", "A1", [1, 2, 3])
+    registry.teach(None, "A1", [4, 5, 6])
+    registry.teach("ibidi-8", "A1", [7, 8, 9])
+
+    reloaded = WellRegistry(path)
+    assert reloaded.version == 3
+    assert reloaded.get("ibidi-8", "A1").first_corner == [7, 8, 9]
+    assert reloaded.get("ibidi-8", "A1").version == 3
+    assert reloaded.get("ibidi-8", "A1").second_corner is None
+    assert reloaded.get(None, "A1").plate_type == app.DEFAULT_PLATE
+    assert reloaded.get("ibidi-8", "B1") is None
+    assert set(reloaded.wells()) == {"ibidi-8/A1", "default/A1"}
+
+
+def test_teaching_a_well_records_it_in_the_registry_and_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "well_registry", WellRegistry(str(tmp_path / "wells.json")))
+    state, frame = AppState(), TeachingFrame()
+
+    save_first_well_corner(microscope=frame, state=state)
+    frame.position = app.PositionModel(x=900, y=700, z=31)
+    geometry = save_second_well_corner(
+        microscope=frame, state=state, well_id="A2", plate_type="ibidi-8"
+    )
+
+    assert frame.committed == [("A2", "ibidi-8")]
+    assert geometry.first_corner == [100, 200, 30]
+    assert geometry.second_corner == [900, 700, 31]
+    assert state.well_geometry["ibidi-8/A2"] == geometry
+    assert state.pending_well_corner is None
+    assert app.well_registry.get("ibidi-8", "A2") == geometry
+
+
+def test_second_well_corner_needs_a_first_one():
+    with pytest.raises(ValueError, match="first corner"):
+        save_second_well_corner(microscope=TeachingFrame(), state=AppState(), well_id="A1")
+
+
+def test_stainstorm_7_scans_on_the_slides_plate_and_warns_about_untaught_wells(captured_logs):
+    state = AppState()
+    state.well_geometry["ibidi-8/A1"] = app.WellGeometry(
+        plate_type="ibidi-8", well_id="A1", first_corner=[0, 0, 0], version=1
+    )
+    slide = Slide(name="s1", protocol="washing", wells=["A1", "A2"], plate_type="ibidi-8")
+
+    _, _, _, _, microscope, _ = drive_stainstorm_7([slide], max_iterations=0, state=state)
+
+    assert microscope.settings == [{"plate_type": "ibidi-8"}] * 2
+    assert any("ibidi-8/A2" in m and "ibidi-8/A1" not in m for m in captured_logs)
@@ -0,0 +1,149 @@
+"""Tests for the virtual-clock benchmark harness in ``benchmark.py``."""
+
+import asyncio
+
+import pytest
+
+import app
+from benchmark import (
+    DEFAULT_DURATIONS,
+    SimFleet,
+    VirtualClockLoop,
+    plan_durations,
+    run_virtual,
+    simulate,
+)
+
+
+def test_virtual_clock_skips_waiting():
+    """An hour of sleeping finishes immediately and advances the loop clock by an hour."""
+
+    async def _sleep() -> float:
+        await asyncio.gather(asyncio.sleep(3600), asyncio.sleep(1800))
+        return asyncio.get_running_loop().time()
+
+    assert run_virtual(_sleep()) == pytest.approx(3600)
+
+
+def test_virtual_clock_loop_starts_at_zero():
+    loop = VirtualClockLoop()
+    try:
+        assert loop.time() == 0.0
+    finally:
+        loop.close()
+
+
+def test_fleet_records_busy_intervals_per_device():
+    fleet = SimFleet(durations={"robot.pick_up_frame": 7.0})
+
+    async def _run() -> None:
+        await fleet.robot.pick_up_frame("s1")
+        await fleet.microscope.run_well_tile_scan(well_id="A1")
+
+    run_virtual(_run())
+
+    assert fleet.intervals["robot"] == [(0.0, 7.0)]
+    scan = DEFAULT_DURATIONS["microscope.run_well_tile_scan"]
+    assert fleet.intervals["microscope"] == [(7.0, 7.0 + scan)]
+
+
+def test_single_slide_makespan_is_the_serial_chain():
+    """With one slide nothing can overlap except the final segmentation."""
+    d = DEFAULT_DURATIONS
+    transfer = d["robot.pick_up_opentrons"] + d["robot.release_at_frame"]
+    back = d["robot.pick_up_frame"] + d["robot.release_at_opentrons"]
+    scan = d["microscope.run_well_tile_scan"]
+    # Local inversion: read the tiles, create the stage, upload the tiles, fetch it.
+    inversion = (
+        d["mikro.aget_image"] + d["mikro.acreate_stage"]
+        + d["mikro.afrom_array_like"] + d["mikro.aget_stage"]
+    )
+    analysis = inversion + d["segmenter.run_cellpose_SAM"]
+    protocol = d["opentrons.run_staining_protocol"]
+    iterations = 2
+    expected = (
+        d["robot.init_robot_and_gripper"]
+        + transfer
+        + d["microscope.homeStageAxis"]
+        + scan
+        + iterations * (back + protocol + transfer + scan)
+        + max(back, analysis)
+    )
+
+    report = simulate("run_stainstorm_7", slides=1, iterations=iterations)
+
+    assert report.makespan == pytest.approx(expected)
+    assert "coordinate_corrector" not in report.devices
+
+
+def test_an_extra_well_costs_one_scan_per_imaging_pass():
+    """The second well is scanned while the first is analyzed, so only its scan adds up."""
+    iterations = 2
+    one = simulate("run_stainstorm_7", slides=1, iterations=iterations)
+    two = simulate("run_stainstorm_7", slides=1, iterations=iterations, wells=2)
+
+    scan = DEFAULT_DURATIONS["microscope.run_well_tile_scan"]
+    assert two.makespan - one.makespan == pytest.approx((iterations + 1) * scan)
+
+
+def test_batched_protocol_runs_shorten_the_makespan():
+    serial = simulate("run_concurrent_staining_6", slides=4, iterations=2)
+    batched = simulate("run_concurrent_staining_6", slides=4, iterations=2, deck_capacity=4)
+
+    assert batched.makespan < serial.makespan
+    assert batched.devices["opentrons"].busy < serial.devices["opentrons"].busy
+
+
+def test_a_second_segmenter_absorbs_slow_segmentation():
+    slow = {"segmenter.run_cellpose_SAM": 600.0}
+    one = simulate("run_stainstorm_7", slides=6, iterations=2, durations=slow)
+    two = simulate("run_stainstorm_7", slides=6, iterations=2, durations=slow, segmenters=2)
+
+    assert two.makespan < one.makespan
+    assert two.devices["segmenter-2"].busy > 0.0
+
+
+def test_a_second_station_shortens_the_makespan():
+    one = simulate("run_stainstorm_7", slides=6, iterations=2)
+    two = simulate("run_stainstorm_7", slides=6, iterations=2, stations=2)
+
+    assert two.makespan < one.makespan
+    assert two.devices["microscope-2"].busy > 0.0
+    assert two.devices["opentrons-2"].busy > 0.0
+
+
+@pytest.mark.parametrize("slides", [1, 3])
+def test_a_dry_run_predicts_the_simulated_plan(slides):
+    loaded = [app.Slide(name=f"slide-{i + 1}", protocol="staining") for i in range(slides)]
+
+    estimate = app.estimate_plan(app.stainstorm_plan(loaded, 2), plan_durations())
+    report = simulate("stainstorm_plan", slides=slides, iterations=2)
+
+    assert estimate.unmeasured == []
+    assert estimate.makespan == pytest.approx(report.makespan)
+
+
+def test_report_busy_and_idle_time_add_up_to_the_makespan():
+    report = simulate("run_stainstorm_7", slides=3, iterations=2, jitter=0.2, seed=4)
+
+    for device in report.devices.values():
+        idle = sum(end - start for start, end in device.idle_gaps)
+        assert device.busy + idle == pytest.approx(report.makespan)
+        assert 0.0 < device.utilization <= 1.0
+
+
+def test_jitter_is_reproducible_per_seed():
+    first = simulate("run_concurrent_staining_6", slides=2, iterations=1, jitter=0.3, seed=1)
+    again = simulate("run_concurrent_staining_6", slides=2, iterations=1, jitter=0.3, seed=1)
+    other = simulate("run_concurrent_staining_6", slides=2, iterations=1, jitter=0.3, seed=2)
+
+    assert first.makespan == again.makespan
+    assert first.makespan != other.makespan
+
+
+def test_pipelining_beats_running_slides_back_to_back():
+    single = simulate("run_stainstorm_7", slides=1, iterations=3)
+    six = simulate("run_stainstorm_7", slides=6, iterations=3)
+
+    assert six.makespan < 0.9 * 6 * single.makespan
+    assert six.devices["opentrons"].utilization > single.devices["opentrons"].utilization